@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011-2015 Martin Sandve Alnæs
+#
+# This file is part of UFLACS.
+#
+# UFLACS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UFLACS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
+
+"""Collection of representative forms used for benchmarking uflacs.
+
+Each entry in bench_forms maps a benchmark name to a function
+taking no arguments and returning a UFL form.
+"""
+
+from collections import OrderedDict
+
+from ufl import *
+
+
+def poisson(degree, cell=triangle):
+    V = FiniteElement("Lagrange", cell, degree)
+    u = TrialFunction(V)
+    v = TestFunction(V)
+    return inner(grad(u), grad(v))*dx
+
+
+def elasticity():
+    cell = tetrahedron
+    V = VectorElement("Lagrange", cell, 2)
+    u = TrialFunction(V)
+    v = TestFunction(V)
+    mu = Constant(cell)
+    lmbda = Constant(cell)
+
+    def eps(w):
+        return sym(grad(w))
+
+    def sigma(w):
+        return 2*mu*eps(w) + lmbda*tr(eps(w))*Identity(3)
+
+    return inner(sigma(u), eps(v))*dx
+
+
+def hyperelasticity():
+    cell = tetrahedron
+    V = VectorElement("Lagrange", cell, 1)
+    du = TrialFunction(V)
+    v = TestFunction(V)
+    u = Coefficient(V)
+    mu = Constant(cell)
+    lmbda = Constant(cell)
+
+    # Compressible neo-Hookean model
+    I = Identity(3)
+    F = variable(I + grad(u))
+    C = F.T*F
+    J = det(F)
+    Ic = tr(C)
+    psi = (mu/2)*(Ic - 3) - mu*ln(J) + (lmbda/2)*ln(J)**2
+    P = diff(psi, F)
+
+    L = inner(P, grad(v))*dx
+    return derivative(L, u, du)
+
+
+def navier_stokes():
+    cell = triangle
+    P2 = VectorElement("Lagrange", cell, 2)
+    P1 = FiniteElement("Lagrange", cell, 1)
+    TH = MixedElement([P2, P1])
+    u, p = TrialFunctions(TH)
+    v, q = TestFunctions(TH)
+    w = Coefficient(P2)
+    nu = Constant(cell)
+    k = Constant(cell)
+
+    # Picard linearized, implicit Euler step
+    return ((1/k)*inner(u, v)*dx
+            + inner(grad(u)*w, v)*dx
+            + nu*inner(grad(u), grad(v))*dx
+            - p*div(v)*dx
+            - q*div(u)*dx)
+
+
+def dg_interior_facet():
+    cell = triangle
+    V = FiniteElement("Discontinuous Lagrange", cell, 2)
+    u = TrialFunction(V)
+    v = TestFunction(V)
+    n = FacetNormal(cell)
+    alpha = Constant(cell)
+
+    # Interior penalty terms of the symmetric interior penalty method
+    return (- inner(avg(grad(u)), jump(v, n))*dS
+            - inner(jump(u, n), avg(grad(v)))*dS
+            + alpha*inner(jump(u, n), jump(v, n))*dS)
+
+
+def high_degree_quadrature():
+    cell = tetrahedron
+    V = FiniteElement("Lagrange", cell, 2)
+    u = TrialFunction(V)
+    v = TestFunction(V)
+    f = Coefficient(V)
+    return (1 + f**2)*u*v*dx(metadata={"quadrature_degree": 12})
+
+
+bench_forms = OrderedDict([
+    ("poisson_p1", lambda: poisson(1)),
+    ("poisson_p2", lambda: poisson(2)),
+    ("poisson_p3", lambda: poisson(3)),
+    ("poisson_p4", lambda: poisson(4)),
+    ("poisson_p5", lambda: poisson(5)),
+    ("elasticity", elasticity),
+    ("hyperelasticity", hyperelasticity),
+    ("navier_stokes", navier_stokes),
+    ("dg_interior_facet", dg_interior_facet),
+    ("high_degree_quadrature", high_degree_quadrature),
+    ])
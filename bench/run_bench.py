@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011-2015 Martin Sandve Alnæs
+#
+# This file is part of UFLACS.
+#
+# UFLACS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UFLACS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark uflacs compilation and generated tabulate_tensor kernels.
+
+For each form in bench_forms this records the time spent in each
+compilation phase, the size of the generated code, the C++ compile
+time, and the throughput of the generated tabulate_tensor functions
+in cells per second measured with a generated C++ driver over the mock
+cells from test/crosslanguage/cppsupport/mock_cells.h.
+
+Results are written as JSON and can be compared against a previous
+run given with --baseline.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from six import iteritems
+
+import uflacs
+from uflacs.params import default_parameters
+from uflacs.backends.ffc.ffc_compiler import compute_integral_irs
+from uflacs.backends.ffc.generation import generate_tabulate_tensor_code
+
+_benchdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _benchdir)
+from forms import bench_forms
+
+
+_mock_cells_dir = os.path.join(_benchdir, os.pardir, "test", "crosslanguage", "cppsupport")
+
+
+# === Compilation of forms through the uflacs pipeline ===
+
+class PhaseTimer(object):
+    "Accumulate wall clock time spent in named phases."
+    def __init__(self):
+        self.phases = {}
+
+    def __call__(self, name, func, *args, **kwargs):
+        t0 = time.time()
+        result = func(*args, **kwargs)
+        self.phases[name] = self.phases.get(name, 0.0) + (time.time() - t0)
+        return result
+
+
+def compile_form(form, parameters):
+    """Compile all integrals of form to tabulate_tensor bodies.
+
+    Returns phase timings and a list of dicts with ir and code for each integral.
+    """
+    from ffc.fiatinterface import create_element
+
+    timer = PhaseTimer()
+    form_data, irs = compute_integral_irs(form, parameters, timer)
+
+    coefficient_dims = [create_element(e).space_dimension() for e in form_data.coefficient_elements]
+
+    integrals = []
+    for itg_data, ir in irs:
+        code = timer("generation", generate_tabulate_tensor_code, ir, "bench", parameters)
+
+        integrals.append({
+            "integral_type": itg_data.integral_type,
+            "subdomain_id": str(itg_data.subdomain_id),
+            "cell": itg_data.domain.ufl_cell(),
+            "ir": ir,
+            "code": code,
+            "coefficient_dims": coefficient_dims,
+            })
+    return timer.phases, integrals
+
+
+# === Generation of C++ driver ===
+
+_kernel_signatures = {
+    "cell": "double* A, const double * const * w, const double* coordinate_dofs, int cell_orientation",
+    "exterior_facet": "double* A, const double * const * w, const double* coordinate_dofs, std::size_t facet, int cell_orientation",
+    "interior_facet": ("double* A, const double * const * w, const double* coordinate_dofs_0, const double* coordinate_dofs_1, "
+                       "std::size_t facet_0, std::size_t facet_1, int cell_orientation_0, int cell_orientation_1"),
+    "vertex": "double* A, const double * const * w, const double* coordinate_dofs, std::size_t vertex, int cell_orientation",
+    }
+
+_kernel_calls = {
+    "cell": "{kernel}(A, w, c0.coordinate_dofs, 0);",
+    "exterior_facet": "{kernel}(A, w, c0.coordinate_dofs, n % {num_facets}, 0);",
+    "interior_facet": "{kernel}(A, w, c0.coordinate_dofs, c1.coordinate_dofs, n % {num_facets}, (n + 1) % {num_facets}, 0, 0);",
+    "vertex": "{kernel}(A, w, c0.coordinate_dofs, n % {num_vertices}, 0);",
+    }
+
+_kernel_template = """
+void {kernel}({signature})
+{{
+{body}
+}}
+"""
+
+_run_template = """
+    {{
+        static double A[{A_size}];
+        static double wdata[{w_size}];
+        for (std::size_t i = 0; i < {w_size}; ++i)
+            wdata[i] = 0.5 + 0.01 * (i % 17);
+        const double * w[{num_w}] = {{ {w_pointers} }};
+        std::size_t n = 0;
+        std::size_t batch = 1;
+        double checksum = 0.0;
+        double elapsed = 0.0;
+        std::chrono::high_resolution_clock::time_point t0 = std::chrono::high_resolution_clock::now();
+        while (elapsed < min_time)
+        {{
+            for (std::size_t i = 0; i < batch; ++i, ++n)
+            {{
+                {call}
+                checksum += A[n % {A_size}];
+            }}
+            batch *= 2;
+            elapsed = std::chrono::duration<double>(std::chrono::high_resolution_clock::now() - t0).count();
+        }}
+        std::printf("{kernel} %lu %.17g %.17g\\n", (unsigned long) n, elapsed, checksum);
+    }}
+"""
+
+_driver_template = """// Benchmark driver generated by uflacs bench/run_bench.py
+{includes}
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include "mock_cells.h"
+
+{kernels}
+
+int main(int argc, char** argv)
+{{
+    double min_time = argc > 1 ? std::atof(argv[1]): 0.5;
+
+    mock_cell c0;
+    mock_cell c1;
+    c0.fill_reference_{cellname}({gdim});
+    c1.fill_reference_{cellname}({gdim});
+    c0.scale(1.5);
+{runs}
+    return 0;
+}}
+"""
+
+
+def generate_driver(integrals):
+    "Generate C++ source for a benchmark driver running all integrals of a form."
+    includes = set()
+    kernels = []
+    runs = []
+    for i, itg in enumerate(integrals):
+        ir = itg["ir"]
+        code = itg["code"]
+        cell = itg["cell"]
+        integral_type = itg["integral_type"]
+        kernel = "tabulate_tensor_{0}_{1}".format(integral_type, i)
+        includes.update(code["additional_includes_set"])
+        kernels.append(_kernel_template.format(kernel=kernel,
+                                               signature=_kernel_signatures[integral_type],
+                                               body=code["tabulate_tensor"]))
+
+        # Interior facet integrals see doubled element tensors and coefficient dofs
+        r = 2 if integral_type == "interior_facet" else 1
+        A_size = 1
+        for n in ir["prim_idims"]:
+            A_size *= r * n
+        w_dims = [r * n for n in itg["coefficient_dims"]]
+        offsets = [sum(w_dims[:k]) for k in range(len(w_dims))]
+        w_pointers = ", ".join("wdata + {0}".format(k) for k in offsets) or "0"
+
+        call = _kernel_calls[integral_type].format(kernel=kernel,
+                                                   num_facets=cell.num_facets(),
+                                                   num_vertices=cell.num_vertices())
+        runs.append(_run_template.format(kernel=kernel, call=call,
+                                         A_size=A_size,
+                                         w_size=max(1, sum(w_dims)),
+                                         num_w=max(1, len(w_dims)),
+                                         w_pointers=w_pointers))
+
+    cell = integrals[0]["cell"]
+    return _driver_template.format(includes="\n".join(sorted(includes)),
+                                   kernels="\n".join(kernels),
+                                   cellname=cell.cellname(),
+                                   gdim=cell.geometric_dimension(),
+                                   runs="\n".join(runs))
+
+
+def find_ufc_include_dir():
+    "Return directory containing ufc.h from ffc if available, or None to rely on the default include path."
+    try:
+        from ffc.backends.ufc import get_include_path
+        return get_include_path()
+    except ImportError:
+        return None
+
+
+def compile_and_run_driver(source, workdir, cxx, cxxflags, min_time):
+    "Compile and run driver source, returning compile time and kernel throughputs."
+    src = os.path.join(workdir, "driver.cpp")
+    exe = os.path.join(workdir, "driver")
+    with open(src, "w") as f:
+        f.write(source)
+
+    cmd = [cxx] + cxxflags.split() + ["-I" + _mock_cells_dir]
+    ufc_dir = find_ufc_include_dir()
+    if ufc_dir:
+        cmd += ["-I" + ufc_dir]
+    cmd += ["-o", exe, src]
+
+    t0 = time.time()
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+    compile_time = time.time() - t0
+    if p.returncode:
+        raise RuntimeError("Compilation of benchmark driver failed:\n{0}\n{1}".format(
+            " ".join(cmd), output.decode("utf-8", "replace")))
+
+    output = subprocess.check_output([exe, str(min_time)]).decode("utf-8")
+    throughputs = {}
+    for line in output.splitlines():
+        kernel, n, elapsed, checksum = line.split()
+        throughputs[kernel] = int(n) / float(elapsed)
+    return compile_time, throughputs
+
+
+# === Running and comparing benchmarks ===
+
+def run_benchmark(name, parameters, args, workdir):
+    form = bench_forms[name]()
+    phases, integrals = compile_form(form, parameters)
+
+    code_bytes = sum(len(itg["code"]["tabulate_tensor"]) for itg in integrals)
+    code_lines = sum(itg["code"]["tabulate_tensor"].count("\n") + 1 for itg in integrals)
+    flops = sum(itg["code"]["cost_estimate"]["flops_per_cell"] for itg in integrals)
+
+    result = {
+        "phases": phases,
+        "compilation_time": sum(phases.values()),
+        "code_bytes": code_bytes,
+        "code_lines": code_lines,
+        "flops_per_cell": flops,
+        "integrals": [{"integral_type": itg["integral_type"],
+                       "subdomain_id": itg["subdomain_id"],
+                       "cost_estimate": itg["code"]["cost_estimate"]}
+                      for itg in integrals],
+        }
+
+    if not args.no_cxx:
+        source = generate_driver(integrals)
+        formdir = os.path.join(workdir, name)
+        os.mkdir(formdir)
+        compile_time, throughputs = compile_and_run_driver(source, formdir, args.cxx,
+                                                           args.cxxflags, args.min_time)
+        result["cxx_compile_time"] = compile_time
+
+        # Assembling a cell means calling each kernel once
+        result["cells_per_second"] = 1.0 / sum(1.0 / r for r in throughputs.values())
+        for i, itg in enumerate(result["integrals"]):
+            kernel = "tabulate_tensor_{0}_{1}".format(itg["integral_type"], i)
+            itg["cells_per_second"] = throughputs[kernel]
+
+    return result
+
+
+# Metrics compared against baseline and whether larger values are better
+_compared_metrics = [
+    ("compilation_time", False),
+    ("code_bytes", False),
+    ("flops_per_cell", False),
+    ("cxx_compile_time", False),
+    ("cells_per_second", True),
+    ]
+
+
+def compare_results(results, baseline, tolerance):
+    "Print relative change of each metric from baseline and return list of regressions."
+    regressions = []
+    print("{0:<24} {1:<18} {2:>14} {3:>14} {4:>8}".format("form", "metric", "baseline", "current", "ratio"))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for metric, larger_is_better in _compared_metrics:
+            old = baseline[name].get(metric)
+            new = results[name].get(metric)
+            if not old or new is None:
+                continue
+            ratio = float(new) / old
+            worse = ratio < 1.0 - tolerance if larger_is_better else ratio > 1.0 + tolerance
+            flag = " <-- regression" if worse else ""
+            print("{0:<24} {1:<18} {2:>14.6g} {3:>14.6g} {4:>8.3f}{5}".format(name, metric, old, new, ratio, flag))
+            if worse:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("forms", nargs="*", help="names of forms to benchmark (default: all)")
+    parser.add_argument("--list", action="store_true", help="list available forms and exit")
+    parser.add_argument("--output", default="bench_results.json", help="JSON file to write results to")
+    parser.add_argument("--baseline", help="JSON file with results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative change from baseline reported as regression")
+    parser.add_argument("--cxx", default=os.environ.get("CXX", "g++"), help="C++ compiler")
+    parser.add_argument("--cxxflags", default="-std=c++11 -O2", help="C++ compiler flags")
+    parser.add_argument("--min-time", type=float, default=0.5,
+                        help="minimal time in seconds to run each kernel")
+    parser.add_argument("--no-cxx", action="store_true",
+                        help="skip compiling and running the generated code")
+    parser.add_argument("--parameter", action="append", default=[], metavar="NAME=VALUE",
+                        help="override uflacs parameter, value is parsed as JSON")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(bench_forms))
+        return 0
+
+    names = args.forms or list(bench_forms)
+    unknown = [name for name in names if name not in bench_forms]
+    if unknown:
+        parser.error("Unknown forms: {0}".format(", ".join(unknown)))
+
+    parameters = default_parameters()
+    for p in args.parameter:
+        k, v = p.split("=", 1)
+        parameters[k] = json.loads(v)
+
+    workdir = tempfile.mkdtemp(prefix="uflacs_bench_")
+    try:
+        results = {}
+        for name in names:
+            print("Benchmarking {0}".format(name))
+            results[name] = run_benchmark(name, parameters, args, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    output = {
+        "uflacs_version": uflacs.__version__,
+        "parameters": parameters,
+        "cxx": None if args.no_cxx else args.cxx,
+        "cxxflags": None if args.no_cxx else args.cxxflags,
+        "results": results,
+        }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print("Wrote results to {0}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print("Found {0} regressions.".format(len(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,44 @@
+"""
+This file contains fixtures for compiling generated C++ code from within Python tests using py.test.
+"""
+
+import os
+import ctypes
+import subprocess
+from distutils.spawn import find_executable
+
+import pytest
+
+
+_cpp_compiler = os.environ.get("CXX", "g++")
+
+
+@pytest.fixture
+def compile_cpp(tmpdir):
+    """Return a function compiling C++ source code to a shared library and loading it with ctypes.
+
+    The ufc headers shipped with ffc are on the include path.
+    Tests using this fixture are skipped if no compiler is found.
+    Each library gets a unique filename, since the dynamic loader
+    returns an already loaded library when a filename is reused.
+    """
+    if find_executable(_cpp_compiler) is None:
+        pytest.skip("C++ compiler %s not found" % (_cpp_compiler,))
+    from ffc.backends.ufc import get_include_path
+    count = [0]
+
+    def compile(code, name="generated"):
+        count[0] += 1
+        name = "%s_%d" % (name, count[0])
+        source = str(tmpdir.join(name + ".cpp"))
+        library = str(tmpdir.join(name + ".so"))
+        with open(source, "w") as f:
+            f.write(code)
+        cmd = [_cpp_compiler, "-shared", "-fPIC", "-O1", "-I" + get_include_path(),
+               source, "-o", library]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = p.communicate()[0]
+        assert p.returncode == 0, "Compilation of %s failed:\n%s" % (source, output)
+        return ctypes.CDLL(library)
+
+    return compile
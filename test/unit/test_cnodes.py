@@ -207,6 +207,27 @@ def test_cnode_array_declarations():
 }"""
     assert str(Scope(ArrayDecl("double", "x", (2,3), [[1.,2.,3.], [4.,5.,6.]]))) == reference
 
+def test_float_literal_suffixes():
+    assert float_literal_suffix("double") == ""
+    assert float_literal_suffix("static const float") == "f"
+    assert float_literal_suffix("long double") == "L"
+    assert float_literal_suffix("int") == ""
+
+    assert str(LiteralFloat(0.5, "f")) == "0.5f"
+    assert LiteralFloat(0.5, "f") != LiteralFloat(0.5)
+    assert str(VariableDecl("const float", "x", 0.0)) == "const float x = 0.0f;"
+    assert str(VariableDecl("float", "x", Mul("y", LiteralFloat(3.0, "f")))) == "float x = y * 3.0f;"
+
+    assert str(ArrayDecl("float", "x", 3, [1.,2.,3.])) == "float x[3] = { 1.0f, 2.0f, 3.0f };"
+    assert str(ArrayDecl("int", "n", 2, [1, 2])) == "int n[2] = { 1, 2 };"
+    reference = """\
+{
+    static const float x[2][2] =
+        { { 1.0f, 2.0f },
+          { 3.0f, 4.0f } };
+}"""
+    assert str(Scope(ArrayDecl("static const float", "x", (2,2), [[1.,2.], [3.,4.]]))) == reference
+
 def test_cnode_comments():
     assert str(Comment("hello world")) == "// hello world"
     assert str(Comment("  hello\n world  ")) == "// hello\n// world"
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Tests of fused evaluation of coefficients in the FFC definitions backend.
+"""
+
+from __future__ import print_function
+
+from ufl import *
+
+import uflacs.language.cnodes as L
+from uflacs.analysis.modified_terminals import analyse_modified_terminal
+from uflacs.backends.ffc.common import FFCBackendSymbols
+from uflacs.backends.ffc.definitions import FFCDefinitionsBackend
+from uflacs.params import default_parameters
+
+
+def make_definitions(f):
+    ir = {"integral_type": "cell", "entitytype": "cell"}
+    symbols = FFCBackendSymbols(L, {f: 0})
+    return FFCDefinitionsBackend(ir, L, symbols, default_parameters())
+
+
+def coefficient_data():
+    V = VectorElement("CG", triangle, 2)
+    f = Coefficient(V)
+    data = [
+        (analyse_modified_terminal(f[0]), ("FE0", 0, 6), L.Symbol("w0_c0")),
+        (analyse_modified_terminal(f[1]), ("FE0", 6, 12), L.Symbol("w0_c1")),
+        (analyse_modified_terminal(grad(f)[0, 1]), ("FE1", 0, 6), L.Symbol("w0_d01_c0")),
+        ]
+    return f, data
+
+
+def test_fused_coefficient_loops():
+    f, data = coefficient_data()
+    precode, code = make_definitions(f).coefficients(data)
+    assert precode == []
+    code = str(L.StatementList(code))
+    print(code)
+    # One dof loop for each component, shared by values and derivatives
+    assert code.count("for (int ic") == 2
+    assert "w0_c0 += w[0][ic] * FE0[0][iq][ic - 0];" in code
+    assert "w0_d01_c0 += w[0][ic] * FE1[0][iq][ic - 0];" in code
+    assert "w0_c1 += w[0][ic] * FE0[0][iq][ic - 6];" in code
+
+
+def test_precomputed_coefficients():
+    f, data = coefficient_data()
+    precode, code = make_definitions(f).coefficients(data, ("wq3", 3))
+    precode = str(L.StatementList(precode))
+    code = str(L.StatementList(code))
+    assert "double wq3[3][3] = {};" in precode
+    assert "wq3[iq][1] += w[0][ic] * FE1[0][iq][ic - 0];" in precode
+    assert "const double w0_d01_c0 = wq3[iq][1];" in code
+    assert "for" not in code
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+"""
+Tests of generated coordinate mapping code.
+"""
+
+from __future__ import print_function
+
+import ctypes
+
+import numpy
+
+import uflacs.language.cnodes as L
+from uflacs.backends.ufc.coordinate_mapping import ufc_coordinate_mapping
+
+
+def mock_coordinate_mapping_ir(cellname, degree, num_dofs):
+    tdim = 2
+    ir = {
+        "cell_shape": cellname,
+        "geometric_dimension": 2,
+        "topological_dimension": tdim,
+        "coordinate_element_degree": degree,
+        "num_scalar_coordinate_element_dofs": num_dofs,
+        "scalar_coordinate_finite_element_classname": "mock_scalar_coordinate_finite_element_classname",
+        "tables": {"x0": numpy.ones((num_dofs,)),
+                   "xm": numpy.ones((num_dofs,)),
+                   "J0": numpy.ones((tdim, num_dofs)),
+                   "Jm": numpy.ones((tdim, num_dofs)),}
+        }
+    return ir
+
+
+def test_affine_reference_coordinates_are_computed_in_closed_form():
+    ir = mock_coordinate_mapping_ir("triangle", 1, 3)
+    code = str(ufc_coordinate_mapping().compute_reference_coordinates(L, ir))
+    print(code)
+    # K0 is computed once, outside the loop over points
+    assert code.count("compute_jacobian_inverses(K0, 1, J0, detJ0);") == 1
+    assert "compute_geometry" not in code
+    assert "compute_physical_coordinates" not in code
+    assert code.index("compute_jacobian_inverses") < code.index("for (int ip = 0;")
+
+
+def test_bilinear_quadrilateral_uses_newton():
+    ir = mock_coordinate_mapping_ir("quadrilateral", 1, 4)
+    code = str(ufc_coordinate_mapping().compute_reference_coordinates(L, ir))
+    assert "quadrilateral_midpoint" in code
+    assert "::_evaluate_reference_basis(phi, num_active, Xa);" in code
+
+
+def test_newton_reference_coordinates():
+    ir = mock_coordinate_mapping_ir("triangle", 2, 6)
+    code = str(ufc_coordinate_mapping().compute_reference_coordinates(L, ir))
+    print(code)
+    # The basis is evaluated in one call for all unconverged points
+    assert "::_evaluate_reference_basis(phi, num_active, Xa);" in code
+    assert "::_evaluate_reference_basis_derivatives(dphi, num_active, Xa);" in code
+    assert "compute_physical_coordinates" not in code
+    assert "compute_jacobians" not in code
+    assert "active[num_unconverged++] = ib;" in code
+    # Default tolerance on |dX|^2 and iteration limit
+    assert "dX2 >= 1e-24" in code
+    assert "k < 20" in code
+    # Failure to converge is signalled
+    assert 'throw std::runtime_error("compute_reference_coordinates: Newton solver did not converge");' in code
+
+
+def test_simplified_newton_reference_coordinates():
+    ir = mock_coordinate_mapping_ir("triangle", 2, 6)
+    ir["newton_simplified"] = True
+    ir["newton_tolerance"] = 1e-8
+    ir["newton_max_iterations"] = 7
+    code = str(ufc_coordinate_mapping().compute_reference_coordinates(L, ir))
+    print(code)
+    # Only x is evaluated in iterations, K at the midpoint is reused
+    assert "::_evaluate_reference_basis(phi, num_active, Xa);" in code
+    assert "_evaluate_reference_basis_derivatives" not in code
+    assert code.count("compute_jacobian_inverses") == 1
+    assert "dX2 >= %s" % L.LiteralFloat(1e-8*1e-8) in code
+    assert "k < 7" in code
+
+    # Simplified newton converges linearly and gets a larger default iteration limit
+    del ir["newton_max_iterations"]
+    code = str(ufc_coordinate_mapping().compute_reference_coordinates(L, ir))
+    assert "k < 100" in code
+
+
+def test_affine_geometry_is_computed_once_per_cell():
+    ir = mock_coordinate_mapping_ir("triangle", 1, 3)
+    code = str(ufc_coordinate_mapping().compute_geometry(L, ir))
+    print(code)
+    # No calls to other geometry functions or to the element
+    assert "compute_" not in code
+    assert "_evaluate_reference_basis" not in code
+    # J, detJ and K are computed before the loop over points and copied
+    loop = code.index("for (int ip = 0;")
+    assert code.index("detJ0 =") < loop
+    assert code.index("K0[") < loop
+    assert "detJ[ip] = detJ0;" in code
+
+
+def test_nonaffine_geometry_is_fused():
+    ir = mock_coordinate_mapping_ir("triangle", 2, 6)
+    code = str(ufc_coordinate_mapping().compute_geometry(L, ir))
+    print(code)
+    assert "compute_" not in code
+    # Basis values and derivatives are evaluated once per point
+    assert code.count("::_evaluate_reference_basis(") == 1
+    assert code.count("::_evaluate_reference_basis_derivatives(") == 1
+    assert "detJ[ip] =" in code
+
+
+# Lagrange basis functions on the reference triangle in FIAT dof
+# ordering, as expressions valid both in Python and C++, with the
+# derivatives w.r.t. x and y
+_triangle_lagrange_basis = {
+    1: [("1 - x - y", "-1", "-1"),
+        ("x", "1", "0"),
+        ("y", "0", "1")],
+    2: [("(1 - x - y)*(1 - 2*x - 2*y)", "4*x + 4*y - 3", "4*x + 4*y - 3"),
+        ("x*(2*x - 1)", "4*x - 1", "0"),
+        ("y*(2*y - 1)", "0", "4*y - 1"),
+        ("4*x*y", "4*y", "4*x"),
+        ("4*y*(1 - x - y)", "-4*y", "4 - 4*x - 8*y"),
+        ("4*x*(1 - x - y)", "4 - 8*x - 4*y", "-4*x")],
+    }
+
+def tabulate_triangle_lagrange_basis(degree, X):
+    "Tabulate basis values phi[ip, d] and derivatives dphi[ip, j, d] at points X."
+    X = numpy.asarray(X, dtype=float).reshape((-1, 2))
+    basis = _triangle_lagrange_basis[degree]
+    phi = numpy.zeros((len(X), len(basis)))
+    dphi = numpy.zeros((len(X), 2, len(basis)))
+    for ip, (x, y) in enumerate(X):
+        for d, expressions in enumerate(basis):
+            values = [eval(e, {"x": x, "y": y}) for e in expressions]
+            phi[ip, d] = values[0]
+            dphi[ip, :, d] = values[1:]
+    return phi, dphi
+
+def triangle_lagrange_element_code(degree):
+    "Generate a C++ class with the static basis functions called by the coordinate mapping."
+    basis = _triangle_lagrange_basis[degree]
+    n = len(basis)
+    values = "\n".join("      phi[%d*ip + %d] = %s;" % (n, d, e[0])
+                       for d, e in enumerate(basis))
+    derivatives = "\n".join("      dphi[%d*ip + %d] = %s;" % (2*n, j*n + d, e[j+1])
+                            for j in range(2) for d, e in enumerate(basis))
+    return """
+struct coordinate_element
+{
+  static void _evaluate_reference_basis(double * phi, std::size_t num_points, const double * X)
+  {
+    for (std::size_t ip = 0; ip < num_points; ++ip)
+    {
+      const double x = X[2*ip];
+      const double y = X[2*ip + 1];
+%s
+    }
+  }
+
+  static void _evaluate_reference_basis_derivatives(double * dphi, std::size_t num_points, const double * X)
+  {
+    for (std::size_t ip = 0; ip < num_points; ++ip)
+    {
+      const double x = X[2*ip];
+      const double y = X[2*ip + 1];
+%s
+    }
+  }
+};
+""" % (values, derivatives)
+
+def triangle_lagrange_coordinate_mapping_ir(degree, **newton_parameters):
+    "Build coordinate mapping ir for a triangle with Lagrange coordinate element of given degree."
+    num_dofs = len(_triangle_lagrange_basis[degree])
+    phi0, dphi0 = tabulate_triangle_lagrange_basis(degree, [0.0, 0.0])
+    phim, dphim = tabulate_triangle_lagrange_basis(degree, [1.0/3.0, 1.0/3.0])
+    ir = {
+        "cell_shape": "triangle",
+        "geometric_dimension": 2,
+        "topological_dimension": 2,
+        "coordinate_element_degree": degree,
+        "num_scalar_coordinate_element_dofs": num_dofs,
+        "scalar_coordinate_finite_element_classname": "coordinate_element",
+        "tables": {"x0": phi0[0], "xm": phim[0], "J0": dphi0[0], "Jm": dphim[0]},
+        }
+    ir.update(newton_parameters)
+    return ir
+
+_coordinate_mapping_signatures = [
+    ("void", "compute_physical_coordinates",
+     "double * x, std::size_t num_points, const double * X, const double * coordinate_dofs",
+     "x, num_points, X, coordinate_dofs"),
+    ("void", "compute_reference_coordinates",
+     "double * X, std::size_t num_points, const double * x, const double * coordinate_dofs, double cell_orientation",
+     "X, num_points, x, coordinate_dofs, cell_orientation"),
+    ("void", "compute_jacobians",
+     "double * J, std::size_t num_points, const double * X, const double * coordinate_dofs",
+     "J, num_points, X, coordinate_dofs"),
+    ("void", "compute_jacobian_determinants",
+     "double * detJ, std::size_t num_points, const double * J, double cell_orientation",
+     "detJ, num_points, J, cell_orientation"),
+    ("void", "compute_jacobian_inverses",
+     "double * K, std::size_t num_points, const double * J, const double * detJ",
+     "K, num_points, J, detJ"),
+    ("void", "compute_geometry",
+     "double * x, double * J, double * detJ, double * K, std::size_t num_points, "
+     "const double * X, const double * coordinate_dofs, double cell_orientation",
+     "x, J, detJ, K, num_points, X, coordinate_dofs, cell_orientation"),
+    ]
+
+def compile_coordinate_mapping(compile_cpp, degree, **newton_parameters):
+    """Compile the generated coordinate mapping functions for a Lagrange triangle.
+
+    The functions are wrapped in extern "C" functions returning 0,
+    or 1 if the generated code throws an exception.
+    """
+    ir = triangle_lagrange_coordinate_mapping_ir(degree, **newton_parameters)
+    generator = ufc_coordinate_mapping()
+    members = []
+    wrappers = []
+    for rettype, name, args, callargs in _coordinate_mapping_signatures:
+        body = str(getattr(generator, name)(L, ir))
+        members.append("  %s %s(%s) const\n  {\n%s\n  }\n" % (rettype, name, args, body))
+        wrappers.append('extern "C" int %s(%s)\n{\n  try\n  {\n    coordinate_mapping().%s(%s);\n  }\n'
+                        '  catch (std::runtime_error &)\n  {\n    return 1;\n  }\n  return 0;\n}\n'
+                        % (name, args, name, callargs))
+    code = "\n".join([
+        "#include <cmath>",
+        "#include <cstddef>",
+        "#include <stdexcept>",
+        "#include <ufc_geometry.h>",
+        "using std::sqrt;",
+        triangle_lagrange_element_code(degree),
+        "struct coordinate_mapping\n{\n%s};\n" % "\n".join(members),
+        ] + wrappers)
+    lib = compile_cpp(code, "coordinate_mapping_P%d" % degree)
+
+    array = numpy.ctypeslib.ndpointer(dtype=numpy.float64, flags="C_CONTIGUOUS")
+    size = ctypes.c_size_t
+    real = ctypes.c_double
+    argtypes = {
+        "compute_physical_coordinates": [array, size, array, array],
+        "compute_reference_coordinates": [array, size, array, array, real],
+        "compute_jacobians": [array, size, array, array],
+        "compute_jacobian_determinants": [array, size, array, real],
+        "compute_jacobian_inverses": [array, size, array, array],
+        "compute_geometry": [array, array, array, array, size, array, array, real],
+        }
+    for name, types in argtypes.items():
+        getattr(lib, name).argtypes = types
+        getattr(lib, name).restype = ctypes.c_int
+    return lib
+
+# Vertices followed by edge midpoints in FIAT ordering, with curved edges for P2
+_triangle_coordinate_dofs = {
+    1: [[0.5, 0.25], [2.0, 0.5], [0.75, 1.5]],
+    2: [[0.5, 0.25], [2.0, 0.5], [0.75, 1.5],
+        [1.5, 1.1], [0.5, 0.9], [1.2, 0.2]],
+    }
+
+def reference_points(num_points):
+    "Points in the reference triangle, more than one block of the newton solver."
+    rng = numpy.random.RandomState(13)
+    X = rng.uniform(0.0, 1.0, size=(num_points, 2))
+    outside = X.sum(axis=1) > 1.0
+    X[outside] = 1.0 - X[outside]
+    return X
+
+def check_coordinate_mapping(lib, degree):
+    coordinate_dofs = numpy.array(_triangle_coordinate_dofs[degree])
+    num_points = 37
+    X = reference_points(num_points)
+
+    # Reference geometry computed with numpy
+    phi, dphi = tabulate_triangle_lagrange_basis(degree, X)
+    x_ref = numpy.dot(phi, coordinate_dofs)
+    J_ref = numpy.einsum("pjd,di->pij", dphi, coordinate_dofs)
+    detJ_ref = numpy.linalg.det(J_ref)
+    K_ref = numpy.linalg.inv(J_ref)
+
+    x = numpy.zeros((num_points, 2))
+    J = numpy.zeros((num_points, 2, 2))
+    detJ = numpy.zeros((num_points,))
+    K = numpy.zeros((num_points, 2, 2))
+    assert lib.compute_geometry(x, J, detJ, K, num_points, X, coordinate_dofs, 1.0) == 0
+    assert numpy.allclose(x, x_ref, rtol=1e-14, atol=1e-14)
+    assert numpy.allclose(J, J_ref, rtol=1e-14, atol=1e-14)
+    assert numpy.allclose(detJ, detJ_ref, rtol=1e-14, atol=1e-14)
+    assert numpy.allclose(K, K_ref, rtol=1e-13, atol=1e-13)
+
+    # The separate geometry functions give the same results
+    x2 = numpy.zeros((num_points, 2))
+    J2 = numpy.zeros((num_points, 2, 2))
+    detJ2 = numpy.zeros((num_points,))
+    K2 = numpy.zeros((num_points, 2, 2))
+    assert lib.compute_physical_coordinates(x2, num_points, X, coordinate_dofs) == 0
+    assert lib.compute_jacobians(J2, num_points, X, coordinate_dofs) == 0
+    assert lib.compute_jacobian_determinants(detJ2, num_points, J2, 1.0) == 0
+    assert lib.compute_jacobian_inverses(K2, num_points, J2, detJ2) == 0
+    assert numpy.allclose(x2, x_ref, rtol=1e-14, atol=1e-14)
+    assert numpy.allclose(J2, J_ref, rtol=1e-14, atol=1e-14)
+    assert numpy.allclose(detJ2, detJ_ref, rtol=1e-14, atol=1e-14)
+    assert numpy.allclose(K2, K_ref, rtol=1e-13, atol=1e-13)
+
+    # Mapping the physical points back gives the reference points
+    X2 = numpy.zeros((num_points, 2))
+    assert lib.compute_reference_coordinates(X2, num_points, x2, coordinate_dofs, 1.0) == 0
+    assert numpy.allclose(X2, X, rtol=1e-12, atol=1e-12)
+
+
+def test_compiled_affine_coordinate_mapping(compile_cpp):
+    lib = compile_coordinate_mapping(compile_cpp, 1)
+    check_coordinate_mapping(lib, 1)
+
+
+def test_compiled_nonaffine_coordinate_mapping(compile_cpp):
+    lib = compile_coordinate_mapping(compile_cpp, 2)
+    check_coordinate_mapping(lib, 2)
+
+
+def test_compiled_simplified_newton_coordinate_mapping(compile_cpp):
+    lib = compile_coordinate_mapping(compile_cpp, 2, newton_simplified=True)
+    check_coordinate_mapping(lib, 2)
+
+
+def test_compiled_newton_throws_if_not_converged(compile_cpp):
+    lib = compile_coordinate_mapping(compile_cpp, 2, newton_simplified=True,
+                                     newton_max_iterations=3)
+    coordinate_dofs = numpy.array(_triangle_coordinate_dofs[2])
+    X = reference_points(5)
+    x = numpy.zeros((5, 2))
+    assert lib.compute_physical_coordinates(x, 5, X, coordinate_dofs) == 0
+    assert lib.compute_reference_coordinates(X, 5, x, coordinate_dofs, 1.0) == 1
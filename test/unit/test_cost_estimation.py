@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Tests of static cost estimation of generated code.
+"""
+
+from __future__ import print_function
+
+import uflacs.language.cnodes as L
+from uflacs.generation.costestimation import (count_expr_operations, empty_operation_counts,
+                                              estimate_kernel_cost, count_flops, typename_size)
+
+
+def test_count_expr_operations():
+    x = L.Symbol("x")
+    y = L.Symbol("y")
+    A = L.Symbol("A")
+
+    counts = count_expr_operations(L.Add(L.Mul(x, y), L.Div(x, 2.0)), empty_operation_counts())
+    assert counts == {"add": 1, "mul": 1, "div": 1, "call": 0}
+
+    counts = count_expr_operations(L.Product([x, y, x, y]), empty_operation_counts())
+    assert counts["mul"] == 3
+
+    counts = count_expr_operations(L.Call("std::sqrt", L.Sum([x, y, 1.0])), empty_operation_counts())
+    assert counts == {"add": 2, "mul": 0, "div": 0, "call": 1}
+
+    # Index arithmetic is not counted
+    counts = count_expr_operations(L.AssignAdd(A[L.Add(L.Mul(3, x), y)], L.Mul(x, y)), empty_operation_counts())
+    assert counts == {"add": 1, "mul": 1, "div": 0, "call": 0}
+
+
+def test_estimate_kernel_cost_with_loops():
+    A = L.Symbol("A")
+    FE = L.Symbol("FE")
+    w = L.Symbol("weights3")
+    code = L.StatementList([
+        L.ArrayDecl("static const double", "weights3", 3, [1.0, 2.0, 3.0]),
+        L.ArrayDecl("static const double", "FE", (3, 4), 0.0),
+        L.ForRange("iq", 0, 3, body=[
+            L.ArrayDecl("double", "sv3", 2),
+            L.ForRange("ia0", 0, 4, body=[
+                L.ForRange("ia1", 0, 4, body=[
+                    L.AssignAdd(A[L.Symbol("ia0")*4 + L.Symbol("ia1")],
+                                L.Product([w[L.Symbol("iq")], FE[L.Symbol("iq"), L.Symbol("ia0")],
+                                           FE[L.Symbol("iq"), L.Symbol("ia1")]]))
+                    ])
+                ])
+            ]),
+        ])
+    cost = estimate_kernel_cost(code, "iq", (4, 4))
+    print(cost)
+
+    assert cost["operations_per_point"] == {3: {"add": 16, "mul": 32, "div": 0, "call": 0}}
+    assert cost["operations_per_cell"] == {"add": 48, "mul": 96, "div": 0, "call": 0}
+    assert cost["flops_per_cell"] == count_flops(cost["operations_per_cell"]) == 144
+    assert cost["tables"] == {"weights3": 24, "FE": 96}
+    assert cost["table_bytes"] == 120
+    assert cost["temporaries"] == {"sv3": 2}
+    assert cost["temporary_bytes"] == 16
+    assert cost["element_tensor_size"] == 16
+    assert cost["element_tensor_bytes"] == 128
+
+
+def test_estimate_kernel_cost_single_point():
+    x = L.Symbol("x")
+    code = L.StatementList([
+        L.VariableDecl("const int", "iq", 0),
+        L.Scope([L.AssignAdd(L.Symbol("A")[0], L.Mul(x, x))]),
+        ])
+    cost = estimate_kernel_cost(code, "iq", ())
+    assert cost["operations_per_point"] == {1: {"add": 1, "mul": 1, "div": 0, "call": 0}}
+    assert cost["element_tensor_size"] == 1
+
+
+def test_typename_size():
+    assert typename_size("double") == 8
+    assert typename_size("static const float") == 4
+    assert typename_size("long double") == 16
+    assert typename_size("static const long double") == 16
+    assert typename_size("const int") == 4
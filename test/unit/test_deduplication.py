@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Tests of deduplication of structurally identical ufc classes.
+"""
+
+from __future__ import print_function
+
+import numpy
+
+from six import StringIO
+
+import uflacs.language.cnodes as L
+from uflacs.backends.ufc.generator import ufc_generator
+from uflacs.backends.ufc.deduplication import ir_structural_signature, deduplicate_irs
+
+
+def element_ir(classname, degree, subelements=()):
+    return {
+        "classname": classname,
+        "degree": degree,
+        "table": numpy.arange(6.0).reshape((2, 3)) * degree,
+        "create_sub_element": list(subelements),
+        }
+
+
+def test_structural_signature_ignores_classname():
+    a = element_ir("a", 2)
+    b = element_ir("b", 2)
+    c = element_ir("c", 3)
+    assert ir_structural_signature(a) == ir_structural_signature(b)
+    assert ir_structural_signature(a) != ir_structural_signature(c)
+
+    # References to subclasses are compared after alias substitution
+    p = element_ir("p", 1, ["a", "a"])
+    q = element_ir("q", 1, ["b", "b"])
+    assert ir_structural_signature(p) != ir_structural_signature(q)
+    assert ir_structural_signature(p) == ir_structural_signature(q, {"b": "a"})
+
+
+def test_deduplicate_irs_propagates_to_parents():
+    irs = [element_ir("p", 1, ["a", "c"]),
+           element_ir("a", 2),
+           element_ir("b", 2),
+           element_ir("c", 3),
+           element_ir("q", 1, ["b", "c"]),
+           element_ir("r", 1, ["c", "c"])]
+    unique_irs, aliases = deduplicate_irs(irs)
+    assert aliases == {"b": "a", "q": "p"}
+    assert [ir["classname"] for ir in unique_irs] == ["p", "a", "c", "r"]
+
+
+class mock_generator(ufc_generator):
+    def __init__(self):
+        ufc_generator.__init__(self, "finite_element")
+        self._header_template = "class %(classname)s;\n"
+        self._implementation_template = "// %(classname)s %(create_sub_element)s\n"
+        self._combined_template = self._header_template + self._implementation_template
+
+    def generate_snippets(self, L, ir):
+        return {"classname": ir["classname"], "create_sub_element": ir["create_sub_element"]}
+
+
+def test_generate_to_streams_deduplicated():
+    irs = [element_ir("a", 2), element_ir("b", 2),
+           element_ir("p", 1, ["b"])]
+
+    hs = StringIO()
+    cs = StringIO()
+    mock_generator().generate_to_streams(L, irs, hs, cs, deduplicate=True)
+    assert hs.getvalue() == "class a;\nclass p;\n\ntypedef a b;\n"
+    assert cs.getvalue() == "// a []\n// p ['a']\n"
+
+    # Typedefs follow the classes in the combined stream
+    combined = StringIO()
+    mock_generator().generate_to_streams(L, irs, combined, deduplicate=True)
+    assert combined.getvalue() == "class a;\n// a []\nclass p;\n// p ['a']\n\ntypedef a b;\n"
+
+    # Deduplication is opt-in
+    combined = StringIO()
+    mock_generator().generate_to_streams(L, irs, combined)
+    assert "class b;" in combined.getvalue()
+    assert "typedef" not in combined.getvalue()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Tests of generated evaluate_reference_basis code.
+"""
+
+from __future__ import print_function
+
+import ctypes
+
+import numpy
+
+from ufl import *
+from ffc.fiatinterface import create_element
+from ffc.representation import _evaluate_basis
+
+import uflacs.language.cnodes as L
+from uflacs.backends.ufc.evaluatebasis import (generate_evaluate_reference_basis,
+                                               _build_coefficient_matrices)
+
+
+def mock_dofs_data():
+    # Two vector valued dofs sharing the same coefficients for degree 1,
+    # and one scalar dof of degree 0 in a mixed element of reference value size 3
+    dofs_data = [
+        {
+        "embedded_degree": 1,
+        "num_components": 2,
+        "num_expansion_members": 3,
+        "coeffs": [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]],
+        "reference_offset": 0,
+        },
+        {
+        "embedded_degree": 1,
+        "num_components": 2,
+        "num_expansion_members": 3,
+        "coeffs": [[4.0, 5.0, 6.0], [1.0, 2.0, 3.0]],
+        "reference_offset": 0,
+        },
+        {
+        "embedded_degree": 0,
+        "num_components": 1,
+        "num_expansion_members": 1,
+        "coeffs": [[0.5]],
+        "reference_offset": 2,
+        },
+        ]
+    return dofs_data
+
+
+def test_coefficient_matrices_merge_equal_rows():
+    matrices, zero_offsets = _build_coefficient_matrices(mock_dofs_data(), 3)
+    assert len(matrices) == 2
+
+    degree, num_members, coefficients, coefficient_rows, value_offsets = matrices[0]
+    assert degree == 1
+    assert num_members == 3
+    assert coefficients == [(1.0, 2.0, 3.0), (4.0, 5.0, 6.0)]
+    assert coefficient_rows == [0, 1, 1, 0]
+    assert value_offsets == [0, 1, 3, 4]
+
+    degree, num_members, coefficients, coefficient_rows, value_offsets = matrices[1]
+    assert degree == 0
+    assert coefficients == [(0.5,)]
+    assert coefficient_rows == [0]
+    assert value_offsets == [8]
+
+    # Components of each dof not computed from any coefficients
+    assert zero_offsets == [2, 5, 6, 7]
+
+
+def test_generate_evaluate_reference_basis():
+    data = {
+        "cellname": "triangle",
+        "geometric_dimension": 2,
+        "topological_dimension": 2,
+        "reference_value_size": 3,
+        "physical_value_size": 3,
+        "dofs_data": mock_dofs_data(),
+        }
+    code = str(generate_evaluate_reference_basis(L, data))
+    print(code)
+
+    # One stacked coefficients table per embedded degree
+    assert code.count("static const double coefficients1[2][3]") == 1
+    assert code.count("static const double coefficients0[1][1]") == 1
+    assert "coefficient_rows1" in code
+    assert "zero_offsets" in code
+
+    # Basisvalues are computed in blocks of points
+    assert "basisvalues1[" in code
+    assert "ip0 += " in code
+
+
+def test_generate_evaluate_reference_basis_not_supported():
+    code = generate_evaluate_reference_basis(L, "Function not supported.")
+    assert isinstance(code, L.Throw)
+    assert str(code) == 'throw std::runtime_error("evaluate_reference_basis: Function not supported.");'
+
+
+def compile_evaluate_reference_basis(compile_cpp, e):
+    "Compile the generated evaluate_reference_basis for UFL element e as an extern C function."
+    data = _evaluate_basis(e, create_element(e))
+    body = str(generate_evaluate_reference_basis(L, data))
+    code = "\n".join([
+        "#include <cmath>",
+        "#include <cstddef>",
+        "#include <stdexcept>",
+        'extern "C" void evaluate_reference_basis(double * reference_values, std::size_t num_points, const double * X)',
+        "{",
+        body,
+        "}",
+        ])
+    lib = compile_cpp(code, "evaluate_reference_basis")
+    array = numpy.ctypeslib.ndpointer(dtype=numpy.float64, flags="C_CONTIGUOUS")
+    lib.evaluate_reference_basis.argtypes = [array, ctypes.c_size_t, array]
+    lib.evaluate_reference_basis.restype = None
+    return lib.evaluate_reference_basis
+
+
+def reference_points(tdim, num_points):
+    "Points in the reference simplex, more than one block of points."
+    rng = numpy.random.RandomState(17)
+    X = rng.uniform(0.0, 1.0, size=(num_points, tdim))
+    X /= numpy.maximum(1.0, X.sum(axis=1))[:, None]
+    return X
+
+
+def check_evaluate_reference_basis(compile_cpp, e):
+    evaluate_reference_basis = compile_evaluate_reference_basis(compile_cpp, e)
+
+    tdim = e.cell().topological_dimension()
+    num_points = 41
+    X = reference_points(tdim, num_points)
+
+    # FIAT tabulates reference values with shape (num_dofs, [reference_value_size,] num_points)
+    fiat_element = create_element(e)
+    num_dofs = fiat_element.space_dimension()
+    reference_value_size = e.reference_value_size()
+    table = fiat_element.tabulate(0, X)[(0,)*tdim]
+    expected = table.reshape((num_dofs, reference_value_size, num_points)).transpose((2, 0, 1))
+
+    values = numpy.zeros((num_points, num_dofs, reference_value_size))
+    evaluate_reference_basis(values, num_points, X)
+    assert numpy.allclose(values, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_compiled_evaluate_reference_basis_lagrange(compile_cpp):
+    check_evaluate_reference_basis(compile_cpp, FiniteElement("DG", interval, 3))
+    check_evaluate_reference_basis(compile_cpp, FiniteElement("CG", triangle, 2))
+    check_evaluate_reference_basis(compile_cpp, FiniteElement("CG", tetrahedron, 3))
+
+
+def test_compiled_evaluate_reference_basis_vector(compile_cpp):
+    # Components share coefficient rows which are merged
+    check_evaluate_reference_basis(compile_cpp, VectorElement("CG", triangle, 2))
+    check_evaluate_reference_basis(compile_cpp, FiniteElement("N1curl", tetrahedron, 2))
+
+
+def test_compiled_evaluate_reference_basis_mixed(compile_cpp):
+    # Several embedded degrees and components which are zero for some dofs
+    P2 = VectorElement("CG", triangle, 2)
+    P1 = FiniteElement("CG", triangle, 1)
+    RT = FiniteElement("RT", triangle, 1)
+    check_evaluate_reference_basis(compile_cpp, MixedElement(P2, P1))
+    check_evaluate_reference_basis(compile_cpp, MixedElement(RT, FiniteElement("DG", triangle, 0)))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Tests of generated evaluate_dofs and tabulate_dof_coordinates.
+"""
+
+from __future__ import print_function
+
+import numpy
+
+from ufl import *
+from ffc.fiatinterface import create_element
+from ffc.representation import _evaluate_dof, _tabulate_dof_coordinates
+
+import uflacs.language.cnodes as L
+from uflacs.backends.ufc.finite_element import ufc_finite_element, affine_vertex_weights
+
+
+def element_ir(e):
+    fe = create_element(e)
+    return {"cell_shape": e.cell().cellname(),
+            "evaluate_dof": _evaluate_dof(e, fe),
+            "tabulate_dof_coordinates": _tabulate_dof_coordinates(e, fe)}
+
+
+def test_affine_vertex_weights():
+    W = affine_vertex_weights([(0.0, 0.0), (1.0, 0.0), (0.25, 0.5)])
+    assert W.shape == (3, 3)
+    assert numpy.allclose(W, [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.25, 0.25, 0.5]])
+
+
+def test_evaluate_dofs_uses_weight_tables():
+    ir = element_ir(VectorElement("CG", triangle, 2))
+    code = str(ufc_finite_element().evaluate_dofs(L, ir))
+    print(code)
+    assert "static const double dof_vertex_weights[6][3]" in code
+    assert "f.evaluate(vals + 2 * ip, x + 2 * ip, c);" in code
+    assert "static const int dof_weight_indices[12] = { 0, 10, 4, 8, 2, 6, 1, 11, 5, 9, 3, 7 };" in code
+    assert "values[j] += dof_weights[k] * vals[dof_weight_indices[k]];" in code
+
+
+def test_evaluate_dofs_not_implemented_for_piola_mapped_elements():
+    ir = element_ir(FiniteElement("N1curl", triangle, 1))
+    code = str(ufc_finite_element().evaluate_dofs(L, ir))
+    assert code == 'throw std::runtime_error("evaluate_dofs is not implemented for this element");'
+
+
+_mock_coordinate_mapping_code = """
+#include <cstddef>
+#include <stdexcept>
+
+// Affine coordinate mapping of a tetrahedron from its vertex coordinates
+struct mock_coordinate_mapping
+{
+  void compute_physical_coordinates(double * x, std::size_t num_points,
+                                    const double * X, const double * coordinate_dofs) const
+  {
+    for (std::size_t ip = 0; ip < num_points; ++ip)
+      for (std::size_t i = 0; i < 3; ++i)
+      {
+        x[3*ip + i] = coordinate_dofs[i];
+        for (std::size_t j = 0; j < 3; ++j)
+          x[3*ip + i] += X[3*ip + j]*(coordinate_dofs[3*(j + 1) + i] - coordinate_dofs[i]);
+      }
+  }
+};
+"""
+
+def compile_tabulate_dof_coordinates(compile_cpp, ir):
+    "Compile the generated tabulate_dof_coordinates as an extern C function."
+    body = str(ufc_finite_element().tabulate_dof_coordinates(L, ir))
+    code = "\n".join([
+        _mock_coordinate_mapping_code,
+        'extern "C" void tabulate_dof_coordinates(double * dof_coordinates, const double * coordinate_dofs)',
+        "{",
+        body,
+        "}",
+        ])
+    lib = compile_cpp(code, "tabulate_dof_coordinates")
+    array = numpy.ctypeslib.ndpointer(dtype=numpy.float64, flags="C_CONTIGUOUS")
+    lib.tabulate_dof_coordinates.argtypes = [array, array]
+    lib.tabulate_dof_coordinates.restype = None
+    return lib.tabulate_dof_coordinates
+
+
+def test_tabulate_dof_coordinates(compile_cpp):
+    e = FiniteElement("CG", tetrahedron, 2)
+    ir = element_ir(e)
+    vertices = numpy.array([[0.5, 0.25, 0.0], [2.0, 0.5, 0.25], [0.75, 1.5, 0.5], [0.25, 0.5, 1.75]])
+
+    # Dof points mapped with numpy
+    points = numpy.array(ir["tabulate_dof_coordinates"]["points"])
+    expected = numpy.dot(affine_vertex_weights(points), vertices)
+
+    # Affine cells use the static vertex weights, higher order
+    # geometry calls the batched coordinate mapping
+    code = str(ufc_finite_element().tabulate_dof_coordinates(L, ir))
+    assert "static const double dof_vertex_weights[10][4]" in code
+    ir["coordinate_mapping"] = "mock_coordinate_mapping"
+    code = str(ufc_finite_element().tabulate_dof_coordinates(L, ir))
+    assert "cm.compute_physical_coordinates(dof_coordinates, 10, dof_reference_coordinates, coordinate_dofs);" in code
+
+    for coordinate_mapping in (None, "mock_coordinate_mapping"):
+        ir["coordinate_mapping"] = coordinate_mapping
+        tabulate_dof_coordinates = compile_tabulate_dof_coordinates(compile_cpp, ir)
+        dof_coordinates = numpy.zeros((len(points), 3))
+        tabulate_dof_coordinates(dof_coordinates, vertices)
+        assert numpy.allclose(dof_coordinates, expected, rtol=1e-14, atol=1e-14)
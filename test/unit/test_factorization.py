@@ -5,7 +5,9 @@ Tests of algorithm for factorization of integrand w.r.t. Argument terms.
 
 from six.moves import xrange as range
 from ufl import *
+from ufl.classes import Product, Division, QuadratureWeight
 from uflacs.analysis.factorization import compute_argument_factorization
+from uflacs.analysis.factorization import remove_factor, divide_monomials_by_factor
 
 # TODO: Restructure these tests using py.test fixtures and parameterization?
 
@@ -126,3 +128,35 @@ def test_compute_argument_factorization():
     IM = { (0, 1): 9 + offset,  # (a*e)*(c+d)*(u*v) == (AV[0] * AV[2]) * FV[13]
            (0, 2): 10 + offset } # (b*e)*(c+d)*(u.dx(0)*v) == (AV[1] * AV[2]) * FV[12]
     compare_compute_argument_factorization(SV, dependencies, AV, FV, IM)
+
+
+def test_remove_factor():
+    V = FiniteElement("CG", triangle, 1)
+    a, b = [Coefficient(V, count=k) for k in range(2)]
+    w = QuadratureWeight(triangle)
+
+    assert remove_factor(w, QuadratureWeight) == (True, None)
+    assert remove_factor(Product(a, w), QuadratureWeight) == (True, a)
+    assert remove_factor(Product(Product(w, b), a), QuadratureWeight) == (True, Product(b, a))
+    assert remove_factor(Division(w, a), QuadratureWeight) == (True, Division(as_ufl(1.0), a))
+    assert remove_factor(Division(a, w), QuadratureWeight) == (False, None)
+    assert remove_factor(a + w, QuadratureWeight) == (False, None)
+
+
+def test_divide_monomials_by_factor():
+    V = FiniteElement("CG", triangle, 1)
+    a, b = [Coefficient(V, count=k) for k in range(2)]
+    w = QuadratureWeight(triangle)
+
+    FV = [a, w, b, Product(a, w), Product(b, w)]
+    IM = {(0,): 3, (1,): 4, (2,): 1}
+    e2i, FV2, targets, dependencies, IM2 = divide_monomials_by_factor(FV, IM, QuadratureWeight)
+    assert FV2[IM2[(0,)]] == a
+    assert FV2[IM2[(1,)]] == b
+    assert FV2[IM2[(2,)]] == as_ufl(1.0)
+    assert w not in e2i
+    assert sorted(targets) == sorted(set(IM2.values()))
+
+    # Not all monomials have the factor
+    IM = {(0,): 3, (1,): 2}
+    assert divide_monomials_by_factor(FV, IM, QuadratureWeight) is None
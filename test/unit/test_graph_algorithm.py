@@ -11,7 +11,7 @@ from ufl import product
 from ufl.permutation import compute_indices
 
 from uflacs.analysis.graph import build_graph
-from uflacs.analysis.graph_rebuild import rebuild_expression_from_graph
+from uflacs.analysis.graph_rebuild import rebuild_expression_from_graph, mark_needed_symbols
 #from uflacs.analysis.graph_rebuild import rebuild_scalar_e2i
 #from uflacs.analysis.graph_dependencies import (compute_dependencies,
 #                                                mark_active,
@@ -61,11 +61,12 @@ def test_graph_algorithm_allocates_correct_number_of_symbols():
     assert G.total_unique_symbols == 2+2+1
 
     # Reusing symbols for indexed with different ordering
-    # Note that two index sums are created, giving 2+1 symbols
+    # Note that two index sums are created, giving 2+1 symbols,
+    # and that the product components (0,1) and (1,0) are equal
     expr = w[i, j]*w[j, i]
     G = build_graph([expr], DEBUG=0)
     assert G.V_symbols.num_elements == 4+4+4+4+2+1
-    assert G.total_unique_symbols == 4+4+2+1
+    assert G.total_unique_symbols == 4+3+2+1
 
     # Testing ComponentTensor
     expr = dot(as_vector(2*v[i], i), v)
@@ -81,7 +82,7 @@ def test_graph_algorithm_allocates_correct_number_of_symbols():
     expr = outer(v, v)[i, j]*outer(v, v)[j, i]
     G = build_graph([expr], DEBUG=0)
     assert G.V_symbols.num_elements == 21 # 2+4+4+4 + 4+2+1
-    assert G.total_unique_symbols == 13 # 2+4+4 + 2+1
+    assert G.total_unique_symbols == 12 # 2+4+3 + 2+1
 
     # Testing tensor/scalar
     expr = as_ufl(2)
@@ -99,21 +100,87 @@ def test_graph_algorithm_allocates_correct_number_of_symbols():
     assert G.V_symbols.num_elements == 2+4
     assert G.total_unique_symbols == 2+4
 
+    # Symmetric products only get symbols for the independent components
     expr = as_tensor(v[i]*v[j], (i, j))
     G = build_graph([expr], DEBUG=0)
     assert G.V_symbols.num_elements == 2+2+2+4+4
-    assert G.total_unique_symbols == 2+4
+    assert G.total_unique_symbols == 2+3
 
     expr = as_tensor(v[i]*v[j]/2, (i, j))
     G = build_graph([expr], DEBUG=0)
     assert G.V_symbols.num_elements == 2+2+2+4+4+4+1
-    assert G.total_unique_symbols == 2+1+4+4
+    assert G.total_unique_symbols == 2+1+3+3
 
-    expr = outer(v, v)/2 # converted to the tensor notation above
+    # Outer is not lowered by build_graph, it is numbered as a new value
+    # without the symmetry of the tensor notation above, so the symmetric
+    # components get separate symbols (the compiler applies algebra
+    # lowering before building the graph)
+    expr = outer(v, v)/2
     G = build_graph([expr], DEBUG=0)
     assert G.V_symbols.num_elements == 2+2+2+4+4+4+1
     assert G.total_unique_symbols == 2+1+4+4
 
+def test_graph_algorithm_maps_symmetric_components_to_shared_symbols():
+    S = TensorElement("CG", tetrahedron, 1, symmetry=True)
+    T = TensorElement("CG", tetrahedron, 1)
+    s = Coefficient(S)
+    t = Coefficient(T)
+
+    # Symmetric tensor element, 6 independent components of 3x3
+    G = build_graph([s], DEBUG=0)
+    assert G.V_symbols.num_elements == 9
+    assert G.total_unique_symbols == 6
+    symbols = list(G.V_symbols[G.nv - 1])
+    assert symbols[1] == symbols[3]
+    assert symbols[2] == symbols[6]
+    assert symbols[5] == symbols[7]
+    assert len(set(symbols)) == 6
+
+    # Symmetric product t*t^T, 6 independent components of 3x3
+    expr = as_tensor(t[i, k]*t[j, k], (i, j))
+    G = build_graph([expr], DEBUG=0)
+    symbols = list(G.V_symbols[G.nv - 1])
+    assert len(symbols) == 9
+    assert len(set(symbols)) == 6
+    assert symbols[1] == symbols[3]
+    assert symbols[2] == symbols[6]
+    assert symbols[5] == symbols[7]
+
+    # Equal scalar values in different nodes share symbols
+    G = build_graph([as_vector((t[0, 1]*t[1, 0], t[1, 0]*t[0, 1]))], DEBUG=0)
+    symbols = list(G.V_symbols[G.nv - 1])
+    assert symbols[0] == symbols[1]
+
+    # The rebuilt expression uses the first component for symmetric components
+    G = build_graph([s[1, 0] + s[0, 1]], DEBUG=0)
+    assert rebuild_expression_from_graph(G) == s[0, 1] + s[0, 1]
+
+
+def test_rebuild_only_marks_needed_symbols():
+    V = VectorElement("CG", tetrahedron, 2)
+    f = Coefficient(V)
+    g = Coefficient(V)
+
+    # A single component of a big tensor needs a single terminal symbol
+    A = grad(grad(f))
+    expr = A[0, 1, 2]
+    G = build_graph([expr], DEBUG=0)
+    needed = mark_needed_symbols(G, G.V_symbols[G.nv - 1])
+    assert G.total_unique_symbols == 3 + 3*6 + 9
+    assert sum(needed) == 1
+    assert rebuild_expression_from_graph(G) == A[0, 1, 2]
+
+    # A component of a tensor product needs one component of each factor
+    expr = as_tensor(f[i]*g[j], (i, j))[1, 2]
+    G = build_graph([expr], DEBUG=0)
+    needed = mark_needed_symbols(G, G.V_symbols[G.nv - 1])
+    assert G.total_unique_symbols == 15
+    assert sum(needed) == 3
+    assert [bool(needed[s]) for s in G.V_symbols[G.e2i[f]]] == [False, True, False]
+    assert [bool(needed[s]) for s in G.V_symbols[G.e2i[g]]] == [False, False, True]
+    assert rebuild_expression_from_graph(G) == f[1]*g[2]
+
+
 def test_rebuild_expression_from_graph_basic_scalar_expressions():
     U = FiniteElement("CG", triangle, 1)
     V = VectorElement("CG", triangle, 1)
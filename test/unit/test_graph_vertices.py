@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Tests of the unique post order traversal building graph vertices.
+"""
+
+from __future__ import print_function
+
+from ufl import *
+
+from uflacs.analysis.graph_vertices import (traverse_unique_post_order,
+                                            build_graph_vertices,
+                                            build_scalar_graph_vertices)
+from uflacs.analysis.graph_dependencies import compute_dependencies
+from uflacs.analysis.graph_symbols import build_node_shapes
+
+
+def test_traversal_is_post_order_and_unique():
+    V = FiniteElement("CG", triangle, 1)
+    f = Coefficient(V)
+    g = Coefficient(V)
+    s = f + g
+    expr = s * s + f
+
+    e2i, V, ri, dependencies, shapes = traverse_unique_post_order([expr])
+    assert list(V) == [f, g, s, s * s, expr]
+    assert ri == [4]
+    assert all(e2i[v] == i for i, v in enumerate(V))
+    assert dependencies is None
+    assert shapes is None
+
+
+def test_traversal_skips_multiindex_and_duplicate_roots():
+    V = VectorElement("CG", triangle, 1)
+    f = Coefficient(V)
+    expr = f[0]
+
+    e2i, V, ri, dependencies, shapes = traverse_unique_post_order([expr, f, expr])
+    assert list(V) == [f, expr]
+    assert ri == [1, 0, 1]
+
+
+def test_traversal_builds_dependencies_and_shapes():
+    U = VectorElement("CG", triangle, 1)
+    f = Coefficient(U)
+    g = Coefficient(U)
+    expr = dot(grad(f)[0, :], g) * f[1] + f[0] * 2
+
+    for skip in (False, True):
+        e2i, V, ri, dependencies, shapes = \
+            traverse_unique_post_order([expr], skip,
+                                       build_dependencies=True, build_shapes=True)
+        if skip:
+            assert list(V) == list(build_scalar_graph_vertices([expr])[1])
+        else:
+            assert list(V) == list(build_graph_vertices([expr])[1])
+
+        expected_shapes = build_node_shapes(V)
+        assert [list(r) for r in shapes] == [list(r) for r in expected_shapes]
+
+    # With modified terminals as units the dependencies of a
+    # scalar expression match compute_dependencies
+    expr = grad(f)[0, 1] * g[0] + f[0] * 2 / g[1]
+    e2i, V, ri, dependencies, shapes = \
+        traverse_unique_post_order([expr], True, build_dependencies=True)
+    expected = compute_dependencies(e2i, V)
+    assert [list(r) for r in dependencies] == [list(r) for r in expected]
+    assert dependencies.data.dtype == expected.data.dtype
+
+
+def test_modified_terminals_are_traversed_as_units():
+    U = VectorElement("CG", triangle, 1)
+    f = Coefficient(U)
+    expr = grad(f)[0, 1] + f[1]
+
+    e2i, V, ri, dependencies, shapes = \
+        traverse_unique_post_order([expr], skip_terminal_modifiers=True,
+                                   build_dependencies=True)
+    assert list(V) == [grad(f)[0, 1], f[1], expr]
+    assert [list(r) for r in dependencies] == [[], [], [0, 1]]
+
+    e2i, V, ri, dependencies, shapes = traverse_unique_post_order([expr])
+    assert list(V) == [f, grad(f), grad(f)[0, 1], f[1], expr]
+
+
+def test_traversal_extends_existing_numbering():
+    U = FiniteElement("CG", triangle, 1)
+    f = Coefficient(U)
+    g = Coefficient(U)
+
+    e2i, V0, ri, dependencies, shapes = traverse_unique_post_order([f])
+    e2i, V1, ri, dependencies, shapes = \
+        traverse_unique_post_order([f * g], e2i=e2i, build_dependencies=True)
+    assert list(V1) == [g, f * g]
+    assert ri == [2]
+    assert [list(r) for r in dependencies] == [[], [0, 1]]
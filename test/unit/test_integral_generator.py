@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+Tests of parts of the integral generator not requiring a full form compilation.
+"""
+
+from __future__ import print_function
+
+import numpy
+
+import uflacs.language.cnodes as L
+from uflacs.backends.ffc.common import FFCBackendSymbols
+from uflacs.generation.integralgenerator import IntegralGenerator, tiled_accumulation_is_profitable
+from uflacs.params import default_parameters
+
+
+def parameters(**kwargs):
+    "Default parameters with the given values changed, as merged by the FFC backend."
+    p = default_parameters()
+    p.update(kwargs)
+    return p
+
+
+class MockArgument(object):
+    def __init__(self, restriction):
+        self.restriction = restriction
+
+
+def interior_facet_ir():
+    # Table on 3 facets, 2 points, 3 dofs with the dof opposite to each facet zero
+    table = numpy.ones((3, 2, 3))
+    for f in range(3):
+        table[f, :, f] = 0.0
+    expr_ir = {
+        "unique_tables": {"FE0": table},
+        "modified_arguments": [MockArgument("+"), MockArgument("-")],
+        "modified_argument_table_ranges": [("FE0", 0, 3), ("FE0", 3, 6)],
+        }
+    return {
+        "integral_type": "interior_facet",
+        "prim_idims": (3,),
+        "quadrature_rules": {2: None},
+        "uflacs": {"expr_ir": {2: expr_ir}},
+        }
+
+
+def test_fixed_entities():
+    symbols = FFCBackendSymbols(L, {})
+    assert str(symbols.entity("facet", "+")) == "facet_0"
+    assert str(symbols.entity("facet", "-")) == "facet_1"
+    symbols.fixed_entities = {("facet", "+"): 2, ("facet", "-"): 1}
+    assert str(symbols.entity("facet", "+")) == "2"
+    assert str(symbols.entity("facet", "-")) == "1"
+
+
+def test_specialized_argument_table_ranges():
+    ig = IntegralGenerator(interior_facet_ir(), None)
+    assert ig.num_table_entities() == 3
+    assert ig.get_argument_table_ranges(2) == [("FE0", 0, 3), ("FE0", 3, 6)]
+
+    # Zero columns at the ends of the table on the fixed facets are skipped
+    assert ig.specialized_argument_table_ranges(2, {"+": 0, "-": 2}) == [("FE0", 1, 3), ("FE0", 3, 5)]
+    assert ig.specialized_argument_table_ranges(2, {"+": 1, "-": 1}) == [("FE0", 0, 3), ("FE0", 3, 6)]
+
+
+def test_specialization_is_opt_in():
+    ig = IntegralGenerator(interior_facet_ir(), None)
+    assert not ig.specialize_interior_facets()
+    ig = IntegralGenerator(interior_facet_ir(), None, parameters(specialize_interior_facets=True))
+    assert ig.specialize_interior_facets()
+
+
+class MockAccess(object):
+    def element_tensor_name(self):
+        return "A"
+
+
+class MockBackend(object):
+    language = L
+    access = MockAccess()
+
+
+def rank_one_ir(num_points, ranges):
+    expr_ir = {
+        "argument_factorization": {(i,): i for i in range(len(ranges))},
+        "modified_argument_table_ranges": [("FE0", b, e) for b, e in ranges],
+        }
+    return {
+        "integral_type": "cell",
+        "rank": 1,
+        "prim_idims": (6,),
+        "quadrature_rules": {num_points: None},
+        "uflacs": {"expr_ir": {num_points: expr_ir}},
+        }
+
+
+def test_analyse_tensor_blocks():
+    # First monomial in emission order is assigned, overlapping later monomial is added
+    ig = IntegralGenerator(rank_one_ir(1, [(2, 4), (0, 3), (5, 5)]), MockBackend())
+    assigned_monomials, assigned_tiles, assigned = ig.analyse_tensor_blocks()
+    assert assigned_monomials == {1: set([(1,)])}
+    assert list(assigned) == [True, True, True, False, False, False]
+
+    code = str(L.StatementList(ig.generate_tensor_reset()))
+    assert "memset(A + 3, 0, 3 * sizeof(*A));" in code
+
+    # Nothing is assigned inside quadrature loops
+    ig = IntegralGenerator(rank_one_ir(3, [(2, 4), (0, 3)]), MockBackend())
+    assigned_monomials, assigned_tiles, assigned = ig.analyse_tensor_blocks()
+    assert assigned_monomials == {3: set()}
+    code = str(L.StatementList(ig.generate_tensor_reset()))
+    assert "memset(A, 0, 6 * sizeof(*A));" in code
+
+    # No reset if all entries are assigned
+    ig = IntegralGenerator(rank_one_ir(1, [(0, 4), (4, 6)]), MockBackend())
+    code = str(L.StatementList(ig.generate_tensor_reset()))
+    assert "memset" not in code
+
+
+def test_tiled_accumulation_cost_model():
+    assert not tiled_accumulation_is_profitable(1, 100, 1, 1024)
+    assert not tiled_accumulation_is_profitable(20, 2000, 1, 1024)
+    assert tiled_accumulation_is_profitable(20, 100, 4, 1024)
+    # Many monomial factors to store for a small block
+    assert not tiled_accumulation_is_profitable(4, 2, 8, 1024)
+
+
+def test_tiled_dofblocks_are_assigned():
+    ir = rank_one_ir(6, [(0, 4), (2, 6)])
+    ig = IntegralGenerator(ir, MockBackend())
+    assert ig.get_tiled_dofblocks(6) == []
+
+    ig = IntegralGenerator(ir, MockBackend(), parameters(enable_tiled_accumulation=True))
+    assert ig.get_tiled_dofblocks(6) == [((0, 4),), ((2, 6),)]
+    assigned_monomials, assigned_tiles, assigned = ig.analyse_tensor_blocks()
+    assert assigned_tiles == {6: set([((0, 4),)])}
+    assert list(assigned) == [True, True, True, True, False, False]
+
+
+class MockMonomialAccess(MockAccess):
+    def __call__(self, terminal, mt, table_range, num_points):
+        name, b, e = table_range
+        return L.Symbol("{0}_{1}".format(name, mt))
+
+    def argument_loop_index(self, iarg):
+        return L.Symbol("ia{0}".format(iarg))
+
+    def element_tensor_entry(self, indices, shape):
+        return L.ArrayAccess(L.Symbol("A"), indices)
+
+
+class MockModifiedArgument(object):
+    terminal = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class MockMonomialBackend(object):
+    language = L
+    access = MockMonomialAccess()
+
+
+def test_argument_partition():
+    from ufl import triangle, FiniteElement, Coefficient, as_ufl
+    f = Coefficient(FiniteElement("CG", triangle, 1))
+    g = Coefficient(FiniteElement("CG", triangle, 2))
+    # f*v0*u + g*v1*u + 1*v0*w, all in the same dofblock
+    expr_ir = {
+        "V": [f, g, as_ufl(1.0)],
+        "argument_factorization": {(0, 2): 0, (1, 2): 1, (0, 3): 2},
+        "modified_arguments": [MockModifiedArgument(name) for name in ("v0", "v1", "u", "w")],
+        "modified_argument_table_ranges": [("FE0", 0, 3), ("FE1", 0, 3), ("FE2", 0, 3), ("FE3", 0, 3)],
+        }
+    ir = {
+        "integral_type": "cell",
+        "rank": 2,
+        "prim_idims": (3, 3),
+        "quadrature_rules": {4: None},
+        "uflacs": {"expr_ir": {4: expr_ir}},
+        }
+    ig = IntegralGenerator(ir, MockMonomialBackend(), parameters(hoist_loop_invariants=True))
+    ig.vaccesses = {4: {f: L.Symbol("f"), g: L.Symbol("g")}}
+    ig._hoisted_accumulations = {}
+    ig._assigned_monomials = {}
+
+    dofblock = ((0, 3), (0, 3))
+    hoisted, accumulations = ig.get_argument_partition(4, dofblock[:1])
+    assert [str(e) for e in hoisted] == ["f * FE0_v0 + g * FE1_v1"]
+    assert accumulations[dofblock][0][:2] == ([(0, 2), (1, 2)], 0)
+    # The binary product 1*v0*w is not hoisted
+    assert accumulations[dofblock][1][:2] == ([(0, 3)], None)
+
+    code = str(L.StatementList(ig.generate_argument_partition(4, dofblock[:1])))
+    assert "sa4[0] = f * FE0_v0 + g * FE1_v1;" in code
+    code = str(L.StatementList(ig.generate_integrand_accumulation(4, dofblock)))
+    assert "A[ia0][ia1] += sa4[0] * FE2_u;" in code
+    assert "A[ia0][ia1] += FE0_v0 * FE3_w;" in code
+
+
+def test_scalar_types():
+    ir = rank_one_ir(1, [(0, 6)])
+    ig = IntegralGenerator(ir, MockBackend())
+    assert (ig.scalar_type, ig.table_type) == ("double", "double")
+    ig = IntegralGenerator(ir, MockBackend(), parameters(scalar_type="float"))
+    assert (ig.scalar_type, ig.table_type) == ("float", "float")
+    ig = IntegralGenerator(ir, MockBackend(), parameters(table_type="float"))
+    assert (ig.scalar_type, ig.table_type) == ("double", "float")
+
+    ir["uflacs"]["expr_ir"][1]["unique_tables"] = {"FE0": numpy.ones((1, 1, 2))}
+    code = str(L.StatementList(ig.generate_element_tables()))
+    assert "static const float FE0[1][1][2] = { { { 1.0f, 1.0f } } };" in code
+
+
+def test_weighted_tables():
+    ir = rank_one_ir(2, [(0, 6)])
+    expr_ir = ir["uflacs"]["expr_ir"][2]
+    expr_ir["unique_tables"] = {"FE0": numpy.ones((1, 2, 3))}
+    expr_ir["weighted_tables"] = {"FE1_W": numpy.ones((1, 2, 3))}
+    expr_ir["modified_terminals"] = [None]
+    expr_ir["piecewise"] = [1]
+    expr_ir["varying"] = [0]
+    ir["quadrature_rules"] = {2: (numpy.array([0.25, 0.75]), numpy.zeros((2, 1)))}
+
+    ig = IntegralGenerator(ir, MockBackend())
+    tables = ig.get_unique_tables(2)
+    assert sorted(tables) == ["FE0", "FE1_W"]
+    assert (tables["FE1_W"][0, :, 0] == [0.25, 0.75]).all()
+    assert (tables["FE0"] == 1.0).all()
+
+    # No weights are used in the integrand
+    assert not ig.quadrature_weights_needed(2)
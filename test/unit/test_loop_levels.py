@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Tests of loop level partitioning and reassociation of the scalar graph.
+"""
+
+from __future__ import print_function
+
+from ufl import *
+from ufl.classes import Sum, Product, Division
+
+from uflacs.analysis.graph_vertices import traverse_unique_post_order
+from uflacs.analysis.graph_dependencies import mark_active
+from uflacs.analysis.graph_ssa import (mark_partitions, loop_level_partition_seed,
+                                       argument_loop_level, KERNEL_LEVEL, QUADRATURE_LEVEL)
+from uflacs.analysis.reassociation import rebalance_products, reassociate_chains, reduce_divisions
+
+
+def build(expressions):
+    e2i, V, targets, dependencies, shapes = \
+        traverse_unique_post_order(expressions, skip_terminal_modifiers=True,
+                                   build_dependencies=True)
+    active, num_active = mark_active(dependencies, targets)
+    return e2i, V, targets, dependencies, active
+
+
+def test_loop_level_partition_seed():
+    cell = triangle
+    c = Coefficient(FiniteElement("DG", cell, 0))
+    f = Coefficient(FiniteElement("CG", cell, 1))
+    v = TestFunction(FiniteElement("CG", cell, 1))
+    u = TrialFunction(FiniteElement("CG", cell, 1))
+    x = SpatialCoordinate(cell)
+
+    assert loop_level_partition_seed(as_ufl(2.0), 2) == KERNEL_LEVEL
+    assert loop_level_partition_seed(c, 2) == KERNEL_LEVEL
+    assert loop_level_partition_seed(f, 2) == QUADRATURE_LEVEL
+    assert loop_level_partition_seed(grad(f)[1], 2) == QUADRATURE_LEVEL
+    assert loop_level_partition_seed(x[0], 2) == QUADRATURE_LEVEL
+    assert loop_level_partition_seed(v, 2) == argument_loop_level(0)
+    assert loop_level_partition_seed(grad(u)[0], 2) == argument_loop_level(1)
+
+
+def test_mark_partitions_with_loop_levels():
+    cell = triangle
+    a = Coefficient(FiniteElement("DG", cell, 0))
+    b = Coefficient(FiniteElement("Real", cell, 0))
+    w = Coefficient(FiniteElement("CG", cell, 1))
+    expr = (a * b) * w
+
+    e2i, V, targets, dependencies, active = build([expr])
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    assert levels[e2i[a]] == KERNEL_LEVEL
+    assert levels[e2i[a * b]] == KERNEL_LEVEL
+    assert levels[e2i[w]] == QUADRATURE_LEVEL
+    assert levels[e2i[expr]] == QUADRATURE_LEVEL
+
+
+def test_rebalance_products():
+    cell = triangle
+    a = Coefficient(FiniteElement("DG", cell, 0))
+    b = Coefficient(FiniteElement("Real", cell, 0))
+    w = Coefficient(FiniteElement("CG", cell, 1))
+    u = Coefficient(FiniteElement("CG", cell, 2))
+    expr = Product(Product(a, w), Product(b, u))
+
+    e2i, V, targets, dependencies, active = build([expr])
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    # Before: no product of piecewise factors
+    assert sum(1 for i, v in enumerate(V) if isinstance(v, Product) and levels[i] == KERNEL_LEVEL) == 0
+
+    e2i, V, targets, dependencies, index_map = \
+        rebalance_products(V, targets, dependencies, active, levels)
+    assert index_map == {len(active) - 1: targets[0]}
+
+    # After: a*b is computed at the kernel level, same number of products
+    active, num_active = mark_active(dependencies, targets)
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    products = [i for i, v in enumerate(V) if isinstance(v, Product)]
+    assert len(products) == 3
+    assert levels[e2i[Product(a, b)]] == KERNEL_LEVEL
+    assert sum(1 for i in products if levels[i] == QUADRATURE_LEVEL) == 2
+
+
+def test_rebalance_products_keeps_shared_products():
+    cell = triangle
+    a = Coefficient(FiniteElement("DG", cell, 0))
+    b = Coefficient(FiniteElement("Real", cell, 0))
+    w = Coefficient(FiniteElement("CG", cell, 1))
+    aw = Product(a, w)
+    expr = Product(aw, b) + sin(aw)
+
+    e2i, V, targets, dependencies, active = build([expr])
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    new_e2i, new_V, new_targets, new_dependencies, index_map = \
+        rebalance_products(V, targets, dependencies, active, levels)
+
+    # a*w is used twice and not split up, so the graph is unchanged
+    assert set(new_V) == set(V)
+
+
+def test_rebalance_products_keeps_target_products():
+    cell = triangle
+    a = Coefficient(FiniteElement("DG", cell, 0))
+    b = Coefficient(FiniteElement("Real", cell, 0))
+    w = Coefficient(FiniteElement("CG", cell, 1))
+    t1 = Product(a, w)
+    t2 = Product(t1, b)
+
+    e2i, V, targets, dependencies, active = build([t1, t2])
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    new_e2i, new_V, new_targets, new_dependencies, index_map = \
+        rebalance_products(V, targets, dependencies, active, levels)
+
+    # a*w is a target itself and not split up, so no product is duplicated
+    assert set(new_V) == set(V)
+    assert sum(1 for v in new_V if isinstance(v, Product)) == 2
+
+
+def graph_depth(V, dependencies):
+    depth = [0] * len(V)
+    for i in range(len(V)):
+        if len(dependencies[i]):
+            depth[i] = 1 + max(depth[j] for j in dependencies[i])
+    return depth
+
+
+def test_reassociate_chains():
+    cell = triangle
+    a = Coefficient(FiniteElement("DG", cell, 0))
+    b = Coefficient(FiniteElement("Real", cell, 0))
+    ws = [Coefficient(FiniteElement("CG", cell, 1)) for k in range(6)]
+
+    # Left deep chain of sums with piecewise terms in the middle
+    terms = ws[:3] + [a] + ws[3:] + [b]
+    expr = terms[0]
+    for t in terms[1:]:
+        expr = Sum(expr, t)
+
+    e2i, V, targets, dependencies, active = build([expr])
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    assert graph_depth(V, dependencies)[targets[0]] == 7
+
+    e2i, V, targets, dependencies, index_map = \
+        reassociate_chains(V, targets, dependencies, active, levels)
+    assert index_map == {len(active) - 1: targets[0]}
+
+    # After: a + b is computed at the kernel level, the varying
+    # terms are summed in a balanced tree, same number of sums
+    active, num_active = mark_active(dependencies, targets)
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    sums = [i for i, v in enumerate(V) if isinstance(v, Sum)]
+    assert len(sums) == 7
+    assert levels[e2i[Sum(a, b)]] == KERNEL_LEVEL
+    assert graph_depth(V, dependencies)[targets[0]] == 4
+
+    # Shared subexpressions and targets are not flattened
+    ab = Sum(a, ws[0])
+    expr = Product(Product(ab, ws[1]), ws[2]) + sin(ab)
+    e2i, V, targets, dependencies, active = build([expr, ab])
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    new_e2i, new_V, new_targets, new_dependencies, index_map = \
+        reassociate_chains(V, targets, dependencies, active, levels)
+    assert ab in new_e2i
+    assert new_V[new_targets[1]] == ab
+
+
+def test_reduce_divisions():
+    cell = triangle
+    a = Coefficient(FiniteElement("DG", cell, 0))
+    b = Coefficient(FiniteElement("Real", cell, 0))
+    w = Coefficient(FiniteElement("CG", cell, 1))
+    u = Coefficient(FiniteElement("CG", cell, 2))
+
+    # Division by a varying value in the quadrature loop is kept,
+    # division by a piecewise value in the quadrature loop is reduced
+    # and a shared denominator gets a single reciprocal
+    expr = Division(w, u) + Division(w, a) + Division(b, a)
+
+    e2i, V, targets, dependencies, active = build([expr])
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    e2i, V, targets, dependencies, index_map = \
+        reduce_divisions(V, targets, dependencies, active, levels)
+
+    r = Division(as_ufl(1.0), a)
+    assert Division(w, u) in e2i
+    assert Division(w, a) not in e2i
+    assert Division(b, a) not in e2i
+    assert Product(w, r) in e2i
+    assert Product(b, r) in e2i
+    assert sum(1 for v in V if isinstance(v, Division)) == 2
+
+    # Division by literal becomes multiplication
+    expr = Division(w, as_ufl(4.0))
+    e2i, V, targets, dependencies, active = build([expr])
+    levels = mark_partitions(V, active, dependencies, 0,
+                             partition_seed=loop_level_partition_seed)
+    e2i, V, targets, dependencies, index_map = \
+        reduce_divisions(V, targets, dependencies, active, levels)
+    assert V[targets[0]] == Product(w, as_ufl(0.25))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Tests of modified terminal analysis.
+"""
+
+from __future__ import print_function
+
+import pickle
+
+from ufl import *
+from uflacs.analysis.modified_terminals import (analyse_modified_terminal,
+                                                cached_modified_terminal_analysis)
+
+
+def test_analyse_modified_terminal():
+    V = VectorElement("CG", triangle, 2)
+    f = Coefficient(V)
+
+    mt = analyse_modified_terminal(grad(f)[1, 0])
+    assert mt.terminal == f
+    assert mt.component == (1,)
+    assert mt.global_derivatives == (0,)
+    assert mt.local_derivatives == ()
+    assert mt.restriction is None
+    assert mt.averaged is None
+
+    mt = analyse_modified_terminal(f('-')[0])
+    assert mt.restriction == "-"
+    assert mt.component == (0,)
+
+
+def test_modified_terminal_equality_and_hashing():
+    V = FiniteElement("CG", triangle, 1)
+    f = Coefficient(V)
+    a = analyse_modified_terminal(grad(f)[0])
+    b = analyse_modified_terminal(grad(f)[0])
+    c = analyse_modified_terminal(grad(f)[1])
+    assert a is not b
+    assert a == b
+    assert hash(a) == hash(b)
+    assert a != c
+    assert len({a, b, c}) == 2
+    assert sorted([c, a]) == [a, c]
+    assert a.as_tuple() == b.as_tuple()
+
+    # ModifiedTerminal uses slots and no instance dict
+    assert not hasattr(a, "__dict__")
+
+
+def test_modified_terminal_pickling():
+    V = FiniteElement("CG", triangle, 1)
+    f = Coefficient(V)
+    a = analyse_modified_terminal(grad(f)[0])
+    # UFL expressions need protocol 2 or higher
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        b = pickle.loads(pickle.dumps(a, protocol))
+        assert a == b
+        assert hash(a) == hash(b)
+        assert b.flat_component == a.flat_component
+
+
+def test_cached_modified_terminal_analysis():
+    V = FiniteElement("CG", triangle, 1)
+    f = Coefficient(V)
+    e = grad(f)[0]
+
+    # Not cached outside of scope
+    assert analyse_modified_terminal(e) is not analyse_modified_terminal(e)
+
+    with cached_modified_terminal_analysis():
+        a = analyse_modified_terminal(e)
+        assert analyse_modified_terminal(e) is a
+        with cached_modified_terminal_analysis():
+            assert analyse_modified_terminal(e) is a
+        assert analyse_modified_terminal(e) is a
+
+        # Cache is keyed by identity, an equal expression object is analysed separately
+        e2 = grad(f)[0]
+        assert e2 is not e
+        b = analyse_modified_terminal(e2)
+        assert b is not a
+        assert b == a
+
+    assert analyse_modified_terminal(e) is not a
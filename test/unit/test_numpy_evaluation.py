@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Tests of numerical evaluation of the uflacs integral ir with numpy.
+"""
+
+from __future__ import print_function
+
+import numpy
+
+from ufl import *
+from uflacs.backends.ffc import ffc_compiler
+from uflacs.backends.ffc.evaluation import evaluate_tabulate_tensor, reference_cell_geometry
+from uflacs.backends.ffc.generation import compile_tabulate_tensor_python
+from uflacs.params import default_parameters
+
+
+def compute_integral_irs(form, parameters={}):
+    "Build the ir of each integral in form the way ffc does for uflacs."
+    form_data, irs = ffc_compiler.compute_integral_irs(form, parameters)
+    return [ir for itg_data, ir in irs]
+
+
+def scaled_triangles(factors):
+    "Coordinate dofs of the reference triangle scaled by each factor."
+    vertices = numpy.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0])
+    return numpy.outer(factors, vertices)
+
+
+def test_reference_cell_geometry():
+    g = reference_cell_geometry("triangle")
+    assert g["cell_volume"] == 0.5
+    assert g["facet_volume"] == 1.0
+    s = numpy.sqrt(0.5)
+    assert numpy.allclose(g["facet_normals"], [[s, s], [-1.0, 0.0], [0.0, -1.0]])
+    assert numpy.allclose(g["facet_jacobians"], [[[-1.0], [1.0]], [[0.0], [1.0]], [[1.0], [0.0]]])
+
+    g = reference_cell_geometry("tetrahedron")
+    assert numpy.allclose(g["cell_volume"], 1.0 / 6.0)
+    assert g["facet_volume"] == 0.5
+    assert numpy.allclose(g["facet_jacobians"][0], [[-1.0, -1.0], [1.0, 0.0], [0.0, 1.0]])
+
+
+def test_evaluate_mass_and_stiffness_matrices():
+    V = FiniteElement("CG", triangle, 1)
+    u = TrialFunction(V)
+    v = TestFunction(V)
+    factors = numpy.array([1.0, 2.0, 0.5])
+    coordinate_dofs = scaled_triangles(factors)
+
+    ir, = compute_integral_irs(u*v*dx)
+    A = evaluate_tabulate_tensor(ir, coordinate_dofs, [])
+    M = numpy.array([[2.0, 1.0, 1.0], [1.0, 2.0, 1.0], [1.0, 1.0, 2.0]]) / 24.0
+    assert A.shape == (3, 3, 3)
+    for k, h in enumerate(factors):
+        assert numpy.allclose(A[k], h**2 * M)
+
+    # The stiffness matrix is invariant to scaling in 2D
+    ir, = compute_integral_irs(dot(grad(u), grad(v))*dx)
+    A = evaluate_tabulate_tensor(ir, coordinate_dofs, [])
+    K = numpy.array([[1.0, -0.5, -0.5], [-0.5, 0.5, 0.0], [-0.5, 0.0, 0.5]])
+    for k in range(len(factors)):
+        assert numpy.allclose(A[k], K)
+
+
+def test_evaluate_coefficients_and_facet_integrals():
+    V = FiniteElement("CG", triangle, 1)
+    f = Coefficient(V)
+    c = Coefficient(FiniteElement("DG", triangle, 0))
+    coordinate_dofs = scaled_triangles([1.0, 1.0, 2.0])
+    w = [numpy.array([[1.0, 1.0, 1.0], [0.0, 1.0, 0.0], [1.0, 2.0, 3.0]]),
+         numpy.array([[2.0], [3.0], [1.0]])]
+
+    # Functional with a varying and a piecewise constant coefficient
+    ir, = compute_integral_irs(c*f*dx)
+    A = evaluate_tabulate_tensor(ir, coordinate_dofs, w)
+    assert A.shape == (3,)
+    assert numpy.allclose(A, [2.0 * 0.5, 3.0 / 6.0, 1.0 * 2.0 * 6.0 / 3.0])
+
+    # Length of each facet of each cell, c is the only coefficient in this form
+    ir, = compute_integral_irs(c*ds)
+    facets = numpy.array([0, 1, 0])
+    A = evaluate_tabulate_tensor(ir, coordinate_dofs, w[1:], facets)
+    assert numpy.allclose(A, [2.0 * numpy.sqrt(2.0), 3.0, 1.0 * 2.0 * numpy.sqrt(2.0)])
+
+
+def test_generated_python_matches_numpy_evaluation():
+    V = FiniteElement("CG", triangle, 2)
+    u = TrialFunction(V)
+    v = TestFunction(V)
+    f = Coefficient(FiniteElement("CG", triangle, 1))
+    coordinate_dofs = numpy.array([[0.0, 0.0, 1.0, 0.0, 0.0, 1.0],
+                                   [0.5, 0.0, 2.0, 0.5, 0.0, 1.5],
+                                   [1.0, 1.0, 0.0, 1.0, 1.0, 0.0]])
+    w = [numpy.array([[1.0, 2.0, 3.0], [0.5, 0.5, 0.5], [-1.0, 0.0, 1.0]])]
+    facets = numpy.array([0, 2, 1])
+
+    forms = [exp(f)*dot(grad(u), grad(v))*dx,
+             conditional(lt(f, 1.0), f, f**2)*u*v*ds]
+    for a in forms:
+        ir, = compute_integral_irs(a)
+        entities = None if ir["integral_type"] == "cell" else facets
+        A_ref = evaluate_tabulate_tensor(ir, coordinate_dofs, w, entities)
+
+        # The generated code takes arrays with the cell axis last
+        tabulate_tensor = compile_tabulate_tensor_python(ir, default_parameters())
+        A = numpy.zeros((36, 3))
+        args = [] if entities is None else [entities]
+        tabulate_tensor(A, [w[0].T], coordinate_dofs.T, *args)
+        assert numpy.allclose(A.T.reshape(A_ref.shape), A_ref, rtol=1e-13, atol=1e-14)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Tests of parallel compilation utilities.
+"""
+
+from __future__ import print_function
+
+import pickle
+import time
+
+from uflacs.datastructures.crs import CRS
+from uflacs.backends.ffc.parallel import parallel_map, num_parallel_workers
+
+
+def slow_square(x, delay):
+    # Later items finish first to check that ordering is preserved
+    time.sleep(delay)
+    return x * x
+
+
+def test_parallel_map_preserves_order():
+    args_list = [(i, 0.01 * (5 - i)) for i in range(6)]
+    expected = [i * i for i in range(6)]
+    assert parallel_map(slow_square, args_list, 0) == expected
+    assert parallel_map(slow_square, args_list, 1) == expected
+    assert parallel_map(slow_square, args_list, 3) == expected
+
+
+def test_num_parallel_workers():
+    assert num_parallel_workers({}) == 0
+    assert num_parallel_workers({"parallel_workers": 4}) == 4
+    assert num_parallel_workers({"parallel_workers": -1}) >= 1
+
+
+def test_crs_is_picklable():
+    A = CRS(3, 6, int)
+    A.push_row([1, 2])
+    A.push_row([])
+    A.push_row([3, 4, 5])
+    B = pickle.loads(pickle.dumps(A, pickle.HIGHEST_PROTOCOL))
+    assert len(B) == 3
+    assert [list(B[i]) for i in range(3)] == [[1, 2], [], [3, 4, 5]]
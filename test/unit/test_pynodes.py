@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Tests of Python formatting of the CNodes AST and of the UFL to PyNodes translator.
+"""
+
+from __future__ import print_function
+
+import numpy
+
+import ufl
+from ufl import *
+
+from uflacs.language.pynodes import *
+from uflacs.language.ufl_to_pynodes import UFL2PyNodesTranslator
+import uflacs.language.pynodes
+
+
+def test_pynode_expressions():
+    assert py_format_expr(Add(Add(1, 2), 3)) == "1 + 2 + 3"
+    assert py_format_expr(Add(1, Add(2, 3))) == "1 + (2 + 3)"
+    assert py_format_expr(Mul(Add(1, 2), Div(3, 4))) == "(1 + 2) * (3 / 4)"
+    assert py_format_expr(Neg(Mul(2, 3))) == "-(2 * 3)"
+    assert py_format_expr(Sum([1, Product([2, 3]), 4])) == "1 + 2 * 3 + 4"
+    assert py_format_expr(LiteralFloat(0.5, "f")) == "0.5"
+    assert py_format_expr(LiteralBool(True)) == "True"
+
+    # Python chains comparisons, nested ones must be parenthesized
+    assert py_format_expr(EQ(LT("a", "b"), "c")) == "(a < b) == c"
+    assert py_format_expr(LT("a", Add("b", 1))) == "a < b + 1"
+
+    # Logical operators and conditionals are elementwise over cells
+    assert py_format_expr(And(LT("a", "b"), Not("c"))) == "numpy.logical_and(a < b, numpy.logical_not(c))"
+    assert py_format_expr(Or("a", "b")) == "numpy.logical_or(a, b)"
+    assert py_format_expr(Conditional(EQ("co", 1), -1.0, 1.0)) == "numpy.where(co == 1, -1.0, 1.0)"
+
+def test_pynode_array_access():
+    A = Symbol("A")
+    assert py_format_expr(A[Add(Mul(3, "i"), "j")]) == "A[3 * i + j]"
+    # Leading literal indices are applied one at a time, the rest as a tuple
+    assert py_format_expr(ArrayAccess("w", (0, "ic"))) == "w[0][ic]"
+    assert py_format_expr(ArrayAccess("FE", (0, "iq", "ic"))) == "FE[0][iq, ic]"
+    assert py_format_expr(ArrayAccess("FE", ("facet", "iq", 2))) == "FE[facet, iq, 2]"
+
+def test_pynode_statements():
+    assert format_python(Assign(ArrayAccess("A", 3), 0.0)) == "A[3] = 0.0"
+    assert format_python(AssignAdd("x", Mul("y", 2))) == "x += y * 2"
+    assert format_python(VariableDecl("const double", "x", 1.5)) == "x = 1.5"
+    assert format_python(Comment("foo\nbar")) == "# foo\n# bar"
+    assert format_python(Using("std::sqrt")) == ""
+    assert format_python(MemZero("A", 6)) == "A[0:6] = 0.0"
+    assert format_python(MemZero("A", 3, 3)) == "A[3:6] = 0.0"
+
+    # Scopes are flattened, loops use range and empty bodies get a pass
+    body = [Assign("x", 3), AssignAdd("x", 5)]
+    assert format_python(Scope(body)) == "x = 3\nx += 5"
+    assert format_python(ForRange("i", 0, 4, body)) == "for i in range(0, 4):\n    x = 3\n    x += 5"
+    assert format_python(ForRange("i", 0, 4, Comment("nothing"))) == "for i in range(0, 4):\n    # nothing\n    pass"
+
+def test_pynode_array_declarations():
+    # Temporaries hold arrays over cells in object arrays
+    assert format_python(ArrayDecl("double", "sp", 3)) == "sp = numpy.zeros((3,), dtype=object)"
+    assert format_python(ArrayDecl("double", "t", (2, 3), 0)) == "t = numpy.zeros((2, 3), dtype=object)"
+
+    # Tables become numpy arrays of the declared type
+    code = format_python(ArrayDecl("static const double", "weights", 2, numpy.array([0.5, 0.25])))
+    assert code == "weights = numpy.array([0.5, 0.25], dtype=float)"
+    code = format_python(ArrayDecl("static const int", "DM", (2, 2), [[1, 2], [3, 4]]))
+    assert code == "DM = numpy.array([\n    [1, 2],\n    [3, 4]\n], dtype=int)"
+    namespace = {"numpy": numpy}
+    exec(code, namespace)
+    assert namespace["DM"].tolist() == [[1, 2], [3, 4]]
+
+def test_ufl_to_pynodes():
+    L = uflacs.language.pynodes
+    translate = UFL2PyNodesTranslator(L)
+
+    f = ufl.CellVolume(ufl.triangle)
+    g = ufl.CellVolume(ufl.triangle)
+    h = ufl.CellVolume(ufl.triangle)
+
+    x = L.Symbol("x")
+    y = L.Symbol("y")
+    z = L.Symbol("z")
+
+    examples = [
+        (f*g, (x,y), "x * y"),
+        (f**g, (x,y), "numpy.power(x, y)"),
+        (ln(f), (x,), "numpy.log(x)"),
+        (abs(f), (x,), "numpy.abs(x)"),
+        (sqrt(f), (x,), "numpy.sqrt(x)"),
+        (acos(f), (x,), "numpy.arccos(x)"),
+        (atan_2(f, g), (x,y), "numpy.arctan2(x, y)"),
+        (erf(f), (x,), "scipy.special.erf(x)"),
+        (min_value(f,g), (x,y), "numpy.minimum(x, y)"),
+        (max_value(f,g), (x,y), "numpy.maximum(x, y)"),
+        (bessel_J(1, g), (x,y), "scipy.special.jv(x, y)"),
+        (conditional(f<g,g,h), (x,y,z), "numpy.where(x, y, z)"),
+        ]
+    for expr, args, code in examples:
+        assert py_format_expr(translate(expr, *args)) == code
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Tests of generated tabulate_dofs code.
+"""
+
+from __future__ import print_function
+
+import uflacs.language.cnodes as L
+from uflacs.backends.ufc.dofmap import (ufc_dofmap, max_unrolled_tabulate_dofs,
+                                        generate_tabulate_dofs_unrolled,
+                                        generate_tabulate_dofs_table)
+
+
+def p2_triangle_entity_dofs():
+    # Entity dofs of a P2 triangle: one dof per vertex and edge
+    return [[[0], [1], [2]], [[3], [4], [5]], [[]]]
+
+
+def p3_triangle_entity_dofs():
+    # Entity dofs of a P3 triangle: one dof per vertex, two per edge, one in the interior
+    return [[[0], [1], [2]], [[3, 4], [5, 6], [7, 8]], [[9]]]
+
+
+def test_small_element_is_unrolled():
+    ir = {"tabulate_dofs": ([p2_triangle_entity_dofs()], [6], True, [False])}
+    code = str(ufc_dofmap().tabulate_dofs(L, ir))
+    print(code)
+    assert "dofs[5] = offset + 1 * entity_indices[1][2] + 0;" in code
+    assert "static const" not in code
+
+
+def test_table_driven_tabulate_dofs():
+    entity_dofs = p3_triangle_entity_dofs()
+    code = str(generate_tabulate_dofs_table(L, [entity_dofs, [[[0]], [], []]], [10, 1], True, [False, True]))
+    print(code)
+    assert "static const int dof_blocks[11] = { 0, 0, 0, 1, 1, 1, 1, 1, 1, 2, 3 };" in code
+    assert "static const int dof_entity_dims[11] = { 0, 0, 0, 1, 1, 1, 1, 1, 1, 2, 0 };" in code
+    assert "static const int dof_entity_indices[11] = { 0, 1, 2, 0, 0, 1, 1, 2, 2, 0, 0 };" in code
+    assert "static const int dof_entity_offsets[11] = { 0, 0, 0, 0, 1, 0, 1, 0, 1, 0, 0 };" in code
+    # The Real dof has no entity dependency
+    assert "static const int block_entity_dofs[4] = { 1, 2, 1, 0 };" in code
+    assert "block_offsets[3] = block_offsets[2] + 1 * num_global_entities[2];" in code
+    assert "for (int k = 0; k < 11; ++k)" in code
+
+
+def test_large_vector_element_is_blocked():
+    entity_dofs = p3_triangle_entity_dofs()
+    block_size = max_unrolled_tabulate_dofs // 10 + 1
+    ir = {"tabulate_dofs": ([entity_dofs]*block_size, [10]*block_size, True, [False]*block_size)}
+    code = str(ufc_dofmap().tabulate_dofs(L, ir))
+    print(code)
+    # Only the dofs of the first subelement are numbered explicitly
+    assert code.count("dofs[") == 10 + 2
+    assert "for (int s = 1; s < %d; ++s)" % block_size in code
+    assert "dofs[s * 10 + k] = dofs[k] + s * subelement_dimension;" in code
+
+
+def test_unrolled_and_table_tabulate_dofs_of_mixed_element():
+    entity_dofs = [p3_triangle_entity_dofs(), p2_triangle_entity_dofs()]
+    args = (entity_dofs, [10, 6], True, [False, False])
+    unrolled = generate_tabulate_dofs_unrolled(L, *args)
+    table = generate_tabulate_dofs_table(L, *args)
+    assert len(unrolled.statements) == 16 + 1 + 5
+    assert isinstance(table.statements[-1], L.ForRange)
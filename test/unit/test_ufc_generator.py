@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Tests of the ufc_generator template rendering machinery.
+"""
+
+from __future__ import print_function
+
+from six import StringIO
+
+import uflacs.language.cnodes as L
+from uflacs.backends.ufc.generator import ufc_generator
+
+
+def make_generator_class(basename):
+    "Create a generator class with a trivial handler for each template keyword."
+    keywords = ufc_generator(basename)._keywords
+    handlers = dict((kw, lambda self, L, ir, kw=kw: "%s_%s" % (kw, ir)) for kw in keywords)
+
+    def __init__(self):
+        ufc_generator.__init__(self, basename)
+    handlers["__init__"] = __init__
+    return type("mock_" + basename, (ufc_generator,), handlers)
+
+
+def test_template_keywords_are_shared():
+    a = ufc_generator("dofmap")
+    b = ufc_generator("dofmap")
+    assert a._keywords is b._keywords
+    assert a._header_keywords is b._header_keywords
+    assert "dofmap" in ufc_generator._template_keywords_cache
+    assert set(a._keywords) == a._combined_keywords
+
+
+def test_generator_checks_run_once_per_class(monkeypatch):
+    cls = make_generator_class("dofmap")
+    calls = []
+    monkeypatch.setattr(cls, "_check_generator_functions", lambda self: calls.append(self))
+
+    cls().generate_snippets(L, 0)
+    cls().generate_snippets(L, 1)
+    assert len(calls) == 1
+
+    cls2 = make_generator_class("dofmap")
+    monkeypatch.setattr(cls2, "_check_generator_functions", lambda self: calls.append(self))
+    monkeypatch.setattr(cls2, "strict_checks", False)
+    cls2().generate_snippets(L, 0)
+    assert len(calls) == 1
+
+
+def test_generate_to_streams():
+    cls = make_generator_class("dofmap")
+    gen = cls()
+    irs = [0, 1, 2]
+
+    hs = StringIO()
+    cs = StringIO()
+    gen.generate_to_streams(L, irs, hs, cs)
+    expected = [gen.generate(L, ir) for ir in irs]
+    assert hs.getvalue() == "".join(h for h, cpp in expected)
+    assert cs.getvalue() == "".join(cpp for h, cpp in expected)
+
+    combined = StringIO()
+    gen.generate_to_streams(L, irs, combined)
+    assert "classname_2" in combined.getvalue()
+    assert combined.getvalue() == "".join(gen._combined_template % gen.generate_snippets(L, ir) for ir in irs)
@@ -32,6 +32,7 @@ from ffc.log import ffc_assert, error
 
 from uflacs.datastructures.arrays import int_array, object_array
 from uflacs.analysis.graph_dependencies import compute_dependencies
+from uflacs.analysis.graph_vertices import traverse_unique_post_order
 from uflacs.analysis.modified_terminals import analyse_modified_terminal, strip_modified_terminal
 
 
@@ -443,3 +444,57 @@ def compute_argument_factorization(SV, target_variables, dependencies):
     dependencies = compute_dependencies(e2fi, FV)
 
     return IM, AV, FV, target_variables, dependencies
+
+
+def remove_factor(expr, factor_type):
+    """Return expr with one multiplicative factor of type factor_type removed.
+
+    Follows products and numerators of divisions. Returns (found, rest),
+    where rest is None if expr is the factor itself.
+    """
+    if isinstance(expr, factor_type):
+        return True, None
+
+    elif isinstance(expr, Product):
+        a, b = expr.ufl_operands
+        for x, y in ((a, b), (b, a)):
+            found, rest = remove_factor(x, factor_type)
+            if found:
+                return True, (y if rest is None else Product(rest, y))
+
+    elif isinstance(expr, Division):
+        a, b = expr.ufl_operands
+        found, rest = remove_factor(a, factor_type)
+        if found:
+            return True, Division(as_ufl(1.0) if rest is None else rest, b)
+
+    return False, None
+
+
+def divide_monomials_by_factor(V, argument_factorization, factor_type):
+    """Remove a multiplicative factor of type factor_type from all monomial factors.
+
+    This is used to move a factor common to all monomials, like the
+    quadrature weight, out of the monomial factors and into the
+    argument tables.
+
+    Returns new (e2i, V, target_variables, dependencies, argument_factorization),
+    or None if some monomial factor has no such factor.
+    """
+    rebuilt = {}
+    for factor_index in set(itervalues(argument_factorization)):
+        found, rest = remove_factor(V[factor_index], factor_type)
+        if not found:
+            return None
+        rebuilt[factor_index] = as_ufl(1.0) if rest is None else rest
+
+    # Rebuild list representation of the graph from the new monomial factors
+    factor_indices = sorted(rebuilt)
+    targets = [rebuilt[i] for i in factor_indices]
+    e2i, V, target_variables, dependencies, shapes = \
+        traverse_unique_post_order(targets, skip_terminal_modifiers=True,
+                                   build_dependencies=True)
+    index_map = dict((i, e2i[rebuilt[i]]) for i in factor_indices)
+    argument_factorization = dict((mas, index_map[fi])
+                                  for mas, fi in iteritems(argument_factorization))
+    return e2i, V, sorted(set(target_variables)), dependencies, argument_factorization
@@ -18,7 +18,7 @@
 
 """Linearized data structure for the computational graph."""
 
-from uflacs.analysis.graph_vertices import build_graph_vertices
+from uflacs.analysis.graph_vertices import traverse_unique_post_order
 from uflacs.analysis.graph_symbols import build_graph_symbols
 
 
@@ -42,13 +42,14 @@ def build_graph(expressions, DEBUG=False):
     # Make empty graph
     G = Graph2()
 
-    # Populate with vertices
-    G.e2i, G.V, G.expression_vertices = build_graph_vertices(expressions)
+    # Populate with vertices and their shapes in a single traversal
+    G.e2i, G.V, G.expression_vertices, dependencies, V_shapes = \
+        traverse_unique_post_order(expressions, build_shapes=True)
     G.nv = len(G.V)
 
     # Populate with symbols
     G.V_shapes, G.V_symbols, G.total_unique_symbols = \
-        build_graph_symbols(G.V, G.e2i, DEBUG)
+        build_graph_symbols(G.V, G.e2i, DEBUG, V_shapes)
 
     if DEBUG:
         assert G.total_unique_symbols == len(set(G.V_symbols.data))
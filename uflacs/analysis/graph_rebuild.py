@@ -20,18 +20,17 @@
 
 from six.moves import zip
 from six.moves import xrange as range
-from ufl import product
 from ufl.permutation import compute_indices
 
 from ufl import as_vector
-from ufl.classes import MultiIndex, IndexSum, Product
+from ufl.classes import MultiIndex, Label, IndexSum, Product
 from ufl.corealg.multifunction import MultiFunction
-from ufl.utils.indexflattening import flatten_multiindex, shape_to_strides
 from ufl.utils.sorting import sorted_by_count
 
 from ffc.log import error, ffc_assert
-from uflacs.datastructures.arrays import object_array
+from uflacs.datastructures.arrays import object_array, bool_array
 from uflacs.analysis.modified_terminals import is_modified_terminal
+from uflacs.analysis.indexing import map_product_arg_components, map_index_sum_arg_components
 
 
 class ReconstructScalarSubexpressions(MultiFunction):
@@ -39,6 +38,10 @@ class ReconstructScalarSubexpressions(MultiFunction):
     def __init__(self):
         super(ReconstructScalarSubexpressions, self).__init__()
 
+    # Handlers take the reconstructed operand components ops, and a list
+    # needed of flags for each output component, returning None for the
+    # components that are not needed
+
     # No fallbacks, need to specify each type or group of types explicitly
     def expr(self, o, *args, **kwargs):
         error("No handler for type %s" % type(o))
@@ -59,7 +62,7 @@ class ReconstructScalarSubexpressions(MultiFunction):
     transposed = unexpected
     variable = unexpected
 
-    def scalar_nary(self, o, ops):
+    def scalar_nary(self, o, ops, needed):
         ffc_assert(o.ufl_shape == (), "Expecting scalar.")
         sops = [op[0] for op in ops]
         return [o._ufl_expr_reconstruct_(*sops)]
@@ -74,97 +77,50 @@ class ReconstructScalarSubexpressions(MultiFunction):
     bessel_function = scalar_nary  # TODO: Is this ok?
     atan_2 = scalar_nary
 
-    def condition(self, o, ops):
+    def condition(self, o, ops, needed):
         sops = [op[0] for op in ops]
         return [o._ufl_expr_reconstruct_(*sops)]
 
-    def conditional(self, o, ops):
+    def conditional(self, o, ops, needed):
         sops = [op[0] for op in ops]
         return [o._ufl_expr_reconstruct_(*sops)]
 
-    def division(self, o, ops):
+    def division(self, o, ops, needed):
         ffc_assert(len(ops) == 2, "Expecting two operands.")
         ffc_assert(len(ops[1]) == 1, "Expecting scalar divisor.")
         b, = ops[1]
-        return [o._ufl_expr_reconstruct_(a, b) for a in ops[0]]
+        return [o._ufl_expr_reconstruct_(a, b) if n else None
+                for a, n in zip(ops[0], needed)]
 
-    def sum(self, o, ops):
+    def sum(self, o, ops, needed):
         ffc_assert(len(ops) == 2, "Expecting two operands.")
         ffc_assert(len(ops[0]) == len(ops[1]), "Expecting scalar divisor.")
-        return [o._ufl_expr_reconstruct_(a, b) for a, b in zip(ops[0], ops[1])]
+        return [o._ufl_expr_reconstruct_(a, b) if n else None
+                for a, b, n in zip(ops[0], ops[1], needed)]
 
-    def product(self, o, ops):
+    def product(self, o, ops, needed):
         ffc_assert(len(ops) == 2, "Expecting two operands.")
 
-        # Get the simple cases out of the way
-        na = len(ops[0])
-        nb = len(ops[1])
-
-        if na == 1:  # True scalar * something
-            a, = ops[0]
-            return [Product(a, b) for b in ops[1]]
-
-        if nb == 1:  # Something * true scalar
-            b, = ops[1]
-            return [Product(a, b) for a in ops[0]]
-
-        # Neither of operands are true scalars, this is the tricky part
-        o0, o1 = o.ufl_operands
-
-        # Get shapes and index shapes
-        fi = o.ufl_free_indices
-        fi0 = o0.ufl_free_indices
-        fi1 = o1.ufl_free_indices
-        fid = o.ufl_index_dimensions
-        fid0 = o0.ufl_index_dimensions
-        fid1 = o1.ufl_index_dimensions
-
-        # Need to map each return component to one component of o0 and one component of o1.
-        indices = compute_indices(fid)
-
-        # Compute which component of o0 is used in component (comp,ind) of o
-        # Compute strides within free index spaces
-        ist0 = shape_to_strides(fid0)
-        ist1 = shape_to_strides(fid1)
-        # Map o0 and o1 indices to o indices
-        indmap0 = [fi.index(i) for i in fi0]
-        indmap1 = [fi.index(i) for i in fi1]
-        indks = [(flatten_multiindex([ind[i] for i in indmap0], ist0),
-                  flatten_multiindex([ind[i] for i in indmap1], ist1))
-                 for ind in indices]
+        # Map each return component to one component of each operand
+        indks = map_product_arg_components(o, len(ops[0]), len(ops[1]))
 
         # Build products for scalar components
-        results = [Product(ops[0][k0], ops[1][k1]) for k0, k1 in indks]
+        results = [Product(ops[0][k0], ops[1][k1]) if n else None
+                   for (k0, k1), n in zip(indks, needed)]
         return results
 
-    def index_sum(self, o, ops):
-        summand, mi = o.ufl_operands
-        ic = mi[0].count()
-        fi = summand.ufl_free_indices
-        fid = summand.ufl_index_dimensions
-        ipos = fi.index(ic)
-        d = fid[ipos]
-
-        # Compute "macro-dimensions" before and after i in the total shape of a
-        predim = product(summand.ufl_shape) * product(fid[:ipos])
-        postdim = product(fid[ipos+1:])
-
-        # Map each flattened total component of summand to
-        # flattened total component of indexsum o by removing
-        # axis corresponding to summation index ii.
+    def index_sum(self, o, ops, needed):
+        # Map each flattened total component of indexsum o to the
+        # flattened total components of the summand summed over
         ss = ops[0]  # Scalar subexpressions of summand
-        ffc_assert(len(ss) == predim * postdim * d, "Mismatching number of subexpressions.")
-        sops = []
-        for i in range(predim):
-            iind = i * (postdim * d)
-            for k in range(postdim):
-                ind = iind + k
-                sops.append([ss[ind + j * postdim] for j in range(d)])
+        components = map_index_sum_arg_components(o)
+        ffc_assert(sum(len(c) for c in components) == len(ss), "Mismatching number of subexpressions.")
+        sops = [[ss[k] for k in c] if n else None for c, n in zip(components, needed)]
 
         # For each scalar output component, sum over collected subcomponents
         # TODO: Need to split this into binary additions to work with future CRS format,
         #       i.e. emitting more expressions than there are symbols for this node.
-        results = [sum(sop) for sop in sops]
+        results = [sum(sop) if n else None for sop, n in zip(sops, needed)]
         return results
 
 
@@ -173,6 +129,82 @@ class ReconstructScalarSubexpressions(MultiFunction):
     # and build expressions such as sum(a*b for a,b in zip(aops, bops))
 
 
+class NeededOperandComponents(MultiFunction):
+    """Map the needed components of an operator to the needed components of its operands.
+
+    Handlers take the list comps of needed flattened components of o
+    and the number of components of each operand, and return a list
+    with the needed components of each operand.
+
+    Operators that only reorder the components of their operands,
+    such as indexing and transposition, share symbols with their
+    operands and need no propagation.
+    """
+
+    def expr(self, o, comps, sizes):
+        "Conservative fallback, all components of all operands are needed."
+        return [range(n) for n in sizes]
+
+    def fallthrough(self, o, comps, sizes):
+        return [() for n in sizes]
+    terminal = fallthrough
+    indexed = fallthrough
+    component_tensor = fallthrough
+    list_tensor = fallthrough
+    transposed = fallthrough
+    variable = fallthrough
+
+    def sum(self, o, comps, sizes):
+        return [comps, comps]
+
+    def division(self, o, comps, sizes):
+        return [comps, (0,)]
+
+    def product(self, o, comps, sizes):
+        indks = map_product_arg_components(o, sizes[0], sizes[1])
+        return [[indks[k][0] for k in comps], [indks[k][1] for k in comps]]
+
+    def index_sum(self, o, comps, sizes):
+        components = map_index_sum_arg_components(o)
+        return [[j for k in comps for j in components[k]], ()]
+
+
+def mark_needed_symbols(G, target_symbols):
+    """Mark the symbols needed to compute the target symbols.
+
+    Needed symbols are propagated backwards from the target symbols
+    through the operand component mappings of each vertex of G.V.
+
+    Returns an array with a nonzero value for each needed symbol.
+    """
+    needed_operand_components = NeededOperandComponents()
+
+    needed = bool_array(G.total_unique_symbols)
+    needed[list(target_symbols)] = 1
+
+    # Iterate over each graph node in reverse order, such that all
+    # users of a vertex are visited before the vertex itself
+    for i in range(len(G.V) - 1, -1, -1):
+        v = G.V[i]
+        if is_modified_terminal(v):
+            continue
+
+        vs = G.V_symbols[i]
+        comps = [k for k, s in enumerate(vs) if needed[s]]
+        if not comps:
+            continue
+
+        ops = [None if isinstance(vop, (MultiIndex, Label)) else G.V_symbols[G.e2i[vop]]
+               for vop in v.ufl_operands]
+        sizes = [0 if so is None else len(so) for so in ops]
+        opcomps = needed_operand_components(v, comps, sizes)
+        for so, oc in zip(ops, opcomps):
+            for k in oc:
+                needed[so[k]] = 1
+
+    return needed
+
+
 def rebuild_expression_from_graph(G):
     "This is currently only used by tests."
     w = rebuild_with_scalar_subexpressions(G)
@@ -187,6 +219,9 @@ def rebuild_expression_from_graph(G):
 def rebuild_with_scalar_subexpressions(G):
     """Build a new expression2index mapping where each subexpression is scalar valued.
 
+    Only the scalar subexpressions needed to compute the final vertex
+    of G.V are built, as marked by mark_needed_symbols.
+
     Input:
     - G.e2i
     - G.V
@@ -212,6 +247,12 @@ def rebuild_with_scalar_subexpressions(G):
     # Algorithm to apply to each subexpression
     reconstruct_scalar_subexpressions = ReconstructScalarSubexpressions()
 
+    # Find symbols of final v from input graph
+    final_symbols = G.V_symbols[G.nv - 1]  # TODO: This is easy to extend to multiple 'final v'
+
+    # Mark the symbols that the final symbols depend on
+    needed = mark_needed_symbols(G, final_symbols)
+
     # Array to store the scalar subexpression in for each symbol
     W = object_array(G.total_unique_symbols)
 
@@ -221,8 +262,11 @@ def rebuild_with_scalar_subexpressions(G):
         # Find symbols of v components
         vs = G.V_symbols[i]
 
+        # Find the components that are needed and not built already
+        vneeded = [bool(needed[s]) and W[s] is None for s in vs]
+
         # Skip if there's nothing new here (should be the case for indexing types)
-        if all(W[s] is not None for s in vs):
+        if not any(vneeded):
             continue
 
         if is_modified_terminal(v):
@@ -232,9 +276,8 @@ def rebuild_with_scalar_subexpressions(G):
             sh = v.ufl_shape
 
             if sh:
-                # Store each terminal expression component (we may not actually need all of these later!)
-                ws = [v[c] for c in compute_indices(sh)]
-                # FIXME: How does this fit in with modified terminals with symmetries?
+                # Store each needed terminal expression component
+                ws = [v[c] if n else None for c, n in zip(compute_indices(sh), vneeded)]
 
             else:
                 # Store single modified terminal expression component
@@ -261,17 +304,18 @@ def rebuild_with_scalar_subexpressions(G):
             wops = [tuple(W[k] for k in so) for so in sops]
 
             # Reconstruct scalar subexpressions of v
-            ws = reconstruct_scalar_subexpressions(v, wops)
+            ws = reconstruct_scalar_subexpressions(v, wops, vneeded)
 
             # Store all scalar subexpressions for v symbols
             ffc_assert(len(vs) == len(ws), "Expecting one symbol for each expression.")
 
-        # Store each new scalar subexpression in W at the index of its symbol
-        for s, w in zip(vs, ws):
-            W[s] = w
+        # Store each new scalar subexpression in W at the index of its symbol,
+        # components sharing a symbol by symmetry are represented by the first one
+        for s, w, n in zip(vs, ws, vneeded):
+            if n and W[s] is None:
+                W[s] = w
 
-    # Find symbols of final v from input graph
-    vs = G.V_symbols[G.nv - 1]  # TODO: This is easy to extend to multiple 'final v'
+    vs = final_symbols
 
     # Sanity check: assert that we've handled these symbols
     ffc_assert(all(W[s] is not None for s in vs),
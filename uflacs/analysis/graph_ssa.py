@@ -27,6 +27,18 @@ from ufl.checks import is_cellwise_constant
 from ffc.log import error
 from uflacs.datastructures.arrays import int_array
 from uflacs.datastructures.crs import rows_to_crs
+from uflacs.analysis.modified_terminals import strip_modified_terminal
+
+
+# Loop levels of the generated code, from outermost to innermost
+KERNEL_LEVEL = 0
+QUADRATURE_LEVEL = 1
+ARGUMENT_LEVEL_OFFSET = 2
+
+
+def argument_loop_level(number):
+    "Return the loop level of the dof loop over the argument with given number."
+    return ARGUMENT_LEVEL_OFFSET + number
 
 
 def default_partition_seed(expr, rank):
@@ -68,10 +80,30 @@ def default_partition_seed(expr, rank):
         error("Don't know how to handle %s" % expr)
 
 
+def loop_level_partition_seed(expr, rank):
+    """Return the outermost loop level a modified terminal is invariant in.
+
+    Level KERNEL_LEVEL: Piecewise constant on each cell, computed before the quadrature loop
+    Level QUADRATURE_LEVEL: Varying in the cell, computed in the quadrature loop
+    Level argument_loop_level(k): Depends on argument k, computed in its dof loop
+
+    Combined with max as the partition combiner in mark_partitions,
+    each vertex gets the innermost level of its dependencies.
+    """
+    t = strip_modified_terminal(expr)
+    if isinstance(t, Argument):
+        assert 0 <= t.number() < rank
+        return argument_loop_level(t.number())
+    elif is_cellwise_constant(expr):
+        return KERNEL_LEVEL
+    else:
+        return QUADRATURE_LEVEL
+
+
 def mark_partitions(V, active, dependencies, rank,
                     partition_seed=default_partition_seed,
                     partition_combiner=max):
-    """FIXME: Cover this with tests.
+    """Mark the partition of each vertex from its terminals and dependencies.
 
     Input:
     - V            - Array of expressions.
@@ -85,16 +85,19 @@ def build_node_symbols(V, e2i, V_shapes, V_sizes):
     return V_symbols, total_unique_symbols
 
 
-def build_graph_symbols(V, e2i, DEBUG):
+def build_graph_symbols(V, e2i, DEBUG, V_shapes=None):
     """Tabulate scalar value numbering of all nodes in a a list based representation of an expression graph.
 
+    The total shapes of the nodes are computed unless given as V_shapes.
+
     Returns:
     V_shapes - CRS of the total shapes of nodes in V.
     V_symbols - CRS of symbols (value numbers) of each component of each node in V.
     total_unique_symbols - The number of symbol values assigned to unique scalar components of the nodes in V.
     """
     # Compute the total shape (value shape x index dimensions) for each node
-    V_shapes = build_node_shapes(V)
+    if V_shapes is None:
+        V_shapes = build_node_shapes(V)
 
     # Compute the total value size for each node
     V_sizes = build_node_sizes(V_shapes)
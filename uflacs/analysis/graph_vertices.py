@@ -23,36 +23,131 @@ from six import iteritems
 from ufl.classes import Terminal, MultiIndex, Label
 
 from uflacs.datastructures.arrays import object_array
+from uflacs.datastructures.crs import rows_to_crs
+from uflacs.datastructures.types import sufficient_int_type
 from uflacs.analysis.modified_terminals import is_modified_terminal
-
-
-def count_nodes_with_unique_post_traversal(expr, e2i=None, skip_terminal_modifiers=False):
-    """Yields o for each node o in expr, child before parent.
-    Never visits a node twice."""
+from uflacs.analysis.expr_shapes import total_shape
+
+
+def traverse_unique_post_order(expressions, skip_terminal_modifiers=False, e2i=None,
+                               build_dependencies=False, build_shapes=False):
+    """Build the list representation of the graph of expressions in a single traversal.
+
+    Visits each unique node of the expressions once, child before parent,
+    skipping MultiIndex and Label nodes. If skip_terminal_modifiers is true,
+    modified terminals are treated as a unit and their operands are not visited.
+
+    Nodes already in e2i are not visited again, new nodes are numbered
+    consecutively starting from len(e2i).
+
+    Returns (e2i, V, ri, dependencies, shapes):
+    e2i          - dict mapping each node to its vertex index.
+    V            - object array of the nodes visited in this call, in post order.
+    ri           - list of the vertex indices of the expression roots.
+    dependencies - CRS of the vertex indices of the operands of each node in V,
+                   or None if not build_dependencies. Terminal modifiers have no
+                   dependencies when skip_terminal_modifiers is true.
+    shapes       - CRS of the total shape of each node in V,
+                   or None if not build_shapes.
+    """
     if e2i is None:
         e2i = {}
+    offset = len(e2i)
+    vertices = []
+    dependency_rows = []
+    shape_rows = []
+    num_dependencies = 0
+    num_shape_entries = 0
+    skip_types = (MultiIndex, Label)
+
+    # Parallel stacks of nodes, their operands, and the position
+    # of the next operand to visit, avoiding copies of operand lists
+    stack_e = []
+    stack_ops = []
+    stack_pos = []
 
-    def getops(e):
-        "Get a modifyable list of operands of e, optionally treating modified terminals as a unit."
-        if e._ufl_is_terminal_ or (skip_terminal_modifiers and is_modified_terminal(e)):
-            return []
-        else:
-            return list(e.ufl_operands)
-
-    stack = []
-    stack.append((expr, getops(expr)))
-    while stack:
-        expr, ops = stack[-1]
-        for i, o in enumerate(ops):
-            if o is not None and o not in e2i:
-                stack.append((o, getops(o)))
-                ops[i] = None
-                break
+    for expr in expressions:
+        if expr in e2i or isinstance(expr, skip_types):
+            continue
+
+        stack_e.append(expr)
+        if expr._ufl_is_terminal_ or (skip_terminal_modifiers and is_modified_terminal(expr)):
+            stack_ops.append(())
         else:
-            if not isinstance(expr, (MultiIndex, Label)):
-                count = len(e2i)
-                e2i[expr] = count
-            stack.pop()
+            stack_ops.append(expr.ufl_operands)
+        stack_pos.append(0)
+
+        while stack_e:
+            ops = stack_ops[-1]
+            j = stack_pos[-1]
+            n = len(ops)
+
+            # Find next unvisited operand
+            while j < n:
+                o = ops[j]
+                j += 1
+                if o not in e2i and not isinstance(o, skip_types):
+                    break
+            else:
+                o = None
+
+            if o is not None:
+                # Descend into operand
+                stack_pos[-1] = j
+                stack_e.append(o)
+                if o._ufl_is_terminal_ or (skip_terminal_modifiers and is_modified_terminal(o)):
+                    stack_ops.append(())
+                else:
+                    stack_ops.append(o.ufl_operands)
+                stack_pos.append(0)
+                continue
+
+            # All operands visited, number this node
+            e = stack_e.pop()
+            stack_ops.pop()
+            stack_pos.pop()
+            e2i[e] = offset + len(vertices)
+            vertices.append(e)
+
+            if build_dependencies:
+                if skip_terminal_modifiers and e._ufl_is_terminal_modifier_:
+                    row = ()
+                else:
+                    row = [e2i[o] for o in ops if not isinstance(o, skip_types)]
+                dependency_rows.append(row)
+                num_dependencies += len(row)
+
+            if build_shapes:
+                tsh = total_shape(e)
+                shape_rows.append(tsh)
+                num_shape_entries += len(tsh)
+
+    nv = len(vertices)
+    V = object_array(nv)
+    for i, e in enumerate(vertices):
+        V[i] = e
+
+    ri = [e2i[expr] for expr in expressions]
+
+    if build_dependencies:
+        dtype = sufficient_int_type(offset + nv)
+        dependencies = rows_to_crs(dependency_rows, nv, num_dependencies, dtype)
+    else:
+        dependencies = None
+
+    if build_shapes:
+        shapes = rows_to_crs(shape_rows, nv, num_shape_entries, int)
+    else:
+        shapes = None
+
+    return e2i, V, ri, dependencies, shapes
+
+
+def count_nodes_with_unique_post_traversal(expr, e2i=None, skip_terminal_modifiers=False):
+    """Number each node o in expr, child before parent.
+    Never visits a node twice."""
+    e2i, V, ri, dependencies, shapes = \
+        traverse_unique_post_order([expr], skip_terminal_modifiers, e2i)
     return e2i
 
 
@@ -65,41 +160,27 @@ def build_array_from_counts(e2i):
 
 
 def build_node_counts(expressions):
-    e2i = {}
-    for expr in expressions:
-        count_nodes_with_unique_post_traversal(expr, e2i, False)
+    e2i, V, ri, dependencies, shapes = \
+        traverse_unique_post_order(expressions, False)
     return e2i
 
 
 def build_scalar_node_counts(expressions):
     # Count unique expression nodes across multiple expressions
-    e2i = {}
-    for expr in expressions:
-        count_nodes_with_unique_post_traversal(expr, e2i, True)
+    e2i, V, ri, dependencies, shapes = \
+        traverse_unique_post_order(expressions, True)
     return e2i
 
 
 def build_graph_vertices(expressions):
-    # Count unique expression nodes
-    e2i = build_node_counts(expressions)
-
-    # Make a list of the nodes by their ordering
-    V = build_array_from_counts(e2i)
-
-    # Get vertex indices representing input expression roots
-    ri = [e2i[expr] for expr in expressions]
-
+    # Count unique expression nodes and make a list of the nodes by their ordering
+    e2i, V, ri, dependencies, shapes = \
+        traverse_unique_post_order(expressions, False)
     return e2i, V, ri
 
 
 def build_scalar_graph_vertices(expressions):
     # Count unique expression nodes across multiple expressions, treating modified terminals as a unit
-    e2i = build_scalar_node_counts(expressions)
-
-    # Make a list of the nodes by their ordering
-    V = build_array_from_counts(e2i)
-
-    # Get vertex indices representing input expression roots
-    ri = [e2i[expr] for expr in expressions]
-
+    e2i, V, ri, dependencies, shapes = \
+        traverse_unique_post_order(expressions, True)
     return e2i, V, ri
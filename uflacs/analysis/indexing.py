@@ -172,6 +172,56 @@ def _map_component_tensor_components(tensor, indexed, multiindex):
     return d2
 
 
+def map_product_arg_components(prod, n0, n1):
+    """Map each flattened total component of a product to one component of each operand.
+
+    Here n0 and n1 are the number of scalar components of the operands.
+    Returns a list of pairs (k0, k1) of operand components.
+    """
+    if n0 == 1:  # True scalar * something
+        return [(0, k1) for k1 in range(n1)]
+    if n1 == 1:  # Something * true scalar
+        return [(k0, 0) for k0 in range(n0)]
+
+    # Neither of operands are true scalars, map free index combinations
+    o0, o1 = prod.ufl_operands
+    fi = prod.ufl_free_indices
+    fid = prod.ufl_index_dimensions
+    ist0 = shape_to_strides(o0.ufl_index_dimensions)
+    ist1 = shape_to_strides(o1.ufl_index_dimensions)
+    indmap0 = [fi.index(i) for i in o0.ufl_free_indices]
+    indmap1 = [fi.index(i) for i in o1.ufl_free_indices]
+    return [(flatten_multiindex([ind[i] for i in indmap0], ist0),
+             flatten_multiindex([ind[i] for i in indmap1], ist1))
+            for ind in compute_indices(fid)]
+
+
+def map_index_sum_arg_components(index_sum):
+    """Map each flattened total component of an index sum to the summand components it sums over.
+
+    Returns a list with one list of summand components per component of index_sum.
+    """
+    summand, mi = index_sum.ufl_operands
+    ic = mi[0].count()
+    fi = summand.ufl_free_indices
+    fid = summand.ufl_index_dimensions
+    ipos = fi.index(ic)
+    d = fid[ipos]
+
+    # Compute "macro-dimensions" before and after i in the total shape of summand
+    predim = product(summand.ufl_shape) * product(fid[:ipos])
+    postdim = product(fid[ipos+1:])
+
+    # Remove the axis corresponding to the summation index
+    components = []
+    for i in range(predim):
+        iind = i * (postdim * d)
+        for k in range(postdim):
+            ind = iind + k
+            components.append([ind + j * postdim for j in range(d)])
+    return components
+
+
 def __map_indexed_to_arg_components(indexed):
     e1 = indexed
     assert isinstance(e1, Indexed)
@@ -20,6 +20,8 @@
 
 from __future__ import print_function # used in some debugging
 
+from contextlib import contextmanager
+
 from six.moves import zip
 from ufl.permutation import build_component_numbering
 from ufl.classes import (Terminal, FormArgument,
@@ -52,6 +54,10 @@ class ModifiedTerminal(object):
 
     """
 
+    __slots__ = ("expr", "terminal", "global_derivatives", "local_derivatives",
+                 "averaged", "restriction", "component", "flat_component",
+                 "reference_value", "_key", "_hash")
+
     def __init__(self, expr, terminal, global_derivatives, local_derivatives, averaged,
                  restriction, component, flat_component, reference_value):
         # The original expression
@@ -73,24 +79,35 @@ class ModifiedTerminal(object):
         # Evaluation method (alternative: { None, 'facet_midpoint', 'cell_midpoint', 'facet_avg', 'cell_avg' })
         self.averaged = averaged
 
+        # Precompute comparison key and hash, used heavily in dicts and sorting
+        self._key = (terminal, reference_value, component, global_derivatives,
+                     local_derivatives, averaged, restriction)
+        self._hash = hash(self._key)
+
+    def __reduce__(self):
+        "Pickle by constructor arguments, the key and hash are recomputed on unpickling."
+        return (ModifiedTerminal, (self.expr, self.terminal, self.global_derivatives,
+                                   self.local_derivatives, self.averaged, self.restriction,
+                                   self.component, self.flat_component, self.reference_value))
+
     def as_tuple(self):
-        t = self.terminal
-        c = self.component
-        rv = self.reference_value
-        gd = self.global_derivatives
-        ld = self.local_derivatives
-        a = self.averaged
-        r = self.restriction
-        return (t, rv, c, gd, ld, a, r)
+        return self._key
 
     def __hash__(self):
-        return hash(self.as_tuple())
+        return self._hash
 
     def __eq__(self, other):
-        return isinstance(other, ModifiedTerminal) and self.as_tuple() == other.as_tuple()
+        if self is other:
+            return True
+        return (isinstance(other, ModifiedTerminal)
+                and self._hash == other._hash
+                and self._key == other._key)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
     def __lt__(self, other):
-        return self.as_tuple() < other.as_tuple()
+        return self._key < other._key
 
     def __str__(self):
         s = []
@@ -122,9 +139,50 @@ def strip_modified_terminal(v):
     return v
 
 
+# Cache of analysed modified terminals keyed by id of the expression,
+# only active within a cached_modified_terminal_analysis() scope.
+# The cached ModifiedTerminal holds a reference to the expression,
+# so an id cannot be reused by another object while in the cache.
+_modified_terminal_cache = None
+
+
+@contextmanager
+def cached_modified_terminal_analysis():
+    """Context manager enabling memoization of analyse_modified_terminal.
+
+    Use this around a compilation to analyse each modified terminal
+    expression object only once. The cache is dropped on leaving the
+    outermost scope, nested scopes share the cache of the outer scope.
+    """
+    global _modified_terminal_cache
+    outer = _modified_terminal_cache
+    if outer is None:
+        _modified_terminal_cache = {}
+    try:
+        yield
+    finally:
+        if outer is None:
+            _modified_terminal_cache = None
+
+
 def analyse_modified_terminal(expr):
     """Analyse a so-called 'modified terminal' expression and return its properties in more compact form.
 
+    Memoized by expression identity within a cached_modified_terminal_analysis() scope.
+    """
+    cache = _modified_terminal_cache
+    if cache is None:
+        return _analyse_modified_terminal(expr)
+    mt = cache.get(id(expr))
+    if mt is None:
+        mt = _analyse_modified_terminal(expr)
+        cache[id(expr)] = mt
+    return mt
+
+
+def _analyse_modified_terminal(expr):
+    """Analyse a so-called 'modified terminal' expression and return its properties in more compact form.
+
     A modified terminal expression is an object of a Terminal subtype, wrapped in terminal modifier types.
 
     The wrapper types can include 0-* Grad or ReferenceGrad objects,
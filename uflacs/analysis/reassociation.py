@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011-2015 Martin Sandve Alnæs
+#
+# This file is part of UFLACS.
+#
+# UFLACS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UFLACS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Algorithms for reassociating and strength reducing operations in the scalar graph by loop level."""
+
+from six.moves import xrange as range
+from six.moves import zip
+from ufl import as_ufl
+from ufl.classes import Sum, Product, Division
+
+from uflacs.datastructures.arrays import int_array, object_array
+from uflacs.analysis.graph_vertices import traverse_unique_post_order
+
+
+def count_uses(dependencies, active):
+    "Return an array with the number of active vertices using each vertex."
+    uses = int_array(len(dependencies))
+    for i in range(len(dependencies)):
+        if active[i]:
+            for d in dependencies[i]:
+                uses[d] += 1
+    return uses
+
+
+def flatten_chain(i, V, dependencies, uses):
+    """Return the list of vertex indices of the operands of the chain of sums or products ending in vertex i.
+
+    Only operands of the same type as V[i] that are used by a single
+    vertex are flattened, such that reassociation does not duplicate
+    any computations.
+    """
+    optype = type(V[i])
+    operands = []
+    stack = list(reversed(dependencies[i]))
+    while stack:
+        j = stack.pop()
+        if type(V[j]) is optype and uses[j] == 1:
+            stack.extend(reversed(dependencies[j]))
+        else:
+            operands.append(j)
+    return operands
+
+
+def balanced_tree(optype, operands):
+    "Combine operands pairwise into a balanced binary tree of optype nodes."
+    operands = list(operands)
+    while len(operands) > 1:
+        pairs = [optype(operands[k], operands[k + 1])
+                 for k in range(0, len(operands) - 1, 2)]
+        if len(operands) % 2:
+            pairs.append(operands[-1])
+        operands = pairs
+    return operands[0]
+
+
+def rebalance_products(V, target_variables, dependencies, active, levels):
+    """Reassociate product trees such that loop invariant factors are multiplied first.
+
+    A product tree like (a*w)*(b*u) where a, b are invariant at an
+    outer loop level and u, w are not becomes (a*b)*(w*u), such that
+    a*b can be computed at the outer level. Factors are grouped by
+    loop level and the groups multiplied from the outermost level inwards.
+
+    Returns new (e2i, V, target_variables, dependencies), and the mapping
+    from old to new vertex indices of the target variables.
+    """
+    n = len(V)
+    e2i = dict((v, i) for i, v in enumerate(V))
+
+    # Targets are used outside of the graph and must not be flattened
+    uses = count_uses(dependencies, active)
+    for i in target_variables:
+        uses[i] += 1
+
+    rebuilt = object_array(n)
+    for i, v in enumerate(V):
+        if not active[i]:
+            continue
+
+        deps = dependencies[i]
+        if not len(deps):
+            # Modified terminal
+            rebuilt[i] = v
+
+        elif isinstance(v, Product):
+            factors = flatten_chain(i, V, dependencies, uses)
+            if sum(1 for j in factors if levels[j] < levels[i]) < 2:
+                # Nothing to gain, at most one factor is invariant in the loop level of this product
+                factors = deps
+
+            # Group factors by loop level, keeping their order within each group
+            groups = {}
+            for j in factors:
+                groups.setdefault(levels[j], []).append(rebuilt[j])
+
+            # Multiply groups from the outermost level inwards
+            f = None
+            for level in sorted(groups):
+                for g in groups[level]:
+                    f = g if f is None else Product(f, g)
+            rebuilt[i] = f
+
+        else:
+            rebuilt[i] = reconstruct_operator(v, e2i, rebuilt)
+
+    return rebuild_graph(rebuilt, target_variables)
+
+
+def reassociate_chains(V, target_variables, dependencies, active, levels):
+    """Reassociate chains of sums and products into balanced trees grouped by loop level.
+
+    A chain like ((((a + u) + b) + w) + x) where a, b are invariant at an
+    outer loop level becomes (a + b) + ((u + w) + x), such that a + b can
+    be computed at the outer level and the remaining terms are combined
+    in a tree of logarithmic instead of linear depth. Products are
+    handled the same way.
+
+    Returns new (e2i, V, target_variables, dependencies), and the mapping
+    from old to new vertex indices of the target variables.
+    """
+    n = len(V)
+    e2i = dict((v, i) for i, v in enumerate(V))
+
+    # Targets are used outside of the graph and must not be flattened
+    uses = count_uses(dependencies, active)
+    for i in target_variables:
+        uses[i] += 1
+
+    rebuilt = object_array(n)
+    for i, v in enumerate(V):
+        if not active[i]:
+            continue
+
+        deps = dependencies[i]
+        if not len(deps):
+            # Modified terminal
+            rebuilt[i] = v
+
+        elif isinstance(v, (Sum, Product)):
+            # Group operands by loop level, keeping their order within each group
+            groups = {}
+            for j in flatten_chain(i, V, dependencies, uses):
+                groups.setdefault(levels[j], []).append(rebuilt[j])
+
+            # Combine balanced trees of each group from the outermost level inwards
+            optype = type(v)
+            f = None
+            for level in sorted(groups):
+                g = balanced_tree(optype, groups[level])
+                f = g if f is None else optype(f, g)
+            rebuilt[i] = f
+
+        else:
+            rebuilt[i] = reconstruct_operator(v, e2i, rebuilt)
+
+    return rebuild_graph(rebuilt, target_variables)
+
+
+def reconstruct_operator(v, e2i, rebuilt):
+    "Reconstruct operator v with the rebuilt operands, reusing v if unchanged."
+    ops = [rebuilt[e2i[o]] if o in e2i else o for o in v.ufl_operands]
+    if all(a is b for a, b in zip(ops, v.ufl_operands)):
+        return v
+    else:
+        return v._ufl_expr_reconstruct_(*ops)
+
+
+def rebuild_graph(rebuilt, target_variables):
+    """Build the list representation of the graph of rebuilt target expressions.
+
+    Returns new (e2i, V, target_variables, dependencies), and the mapping
+    from old to new vertex indices of the target variables.
+    """
+    targets = [rebuilt[i] for i in target_variables]
+    new_e2i, new_V, new_targets, new_dependencies, shapes = \
+        traverse_unique_post_order(targets, skip_terminal_modifiers=True,
+                                   build_dependencies=True)
+    index_map = dict((i, new_e2i[rebuilt[i]]) for i in target_variables)
+    return new_e2i, new_V, new_targets, new_dependencies, index_map
+
+
+def reduce_divisions(V, target_variables, dependencies, active, levels):
+    """Rewrite divisions to multiplications with reciprocals computed at an outer loop level.
+
+    A division a/b is rewritten to a*(1/b) if b is invariant in the
+    loop level of the division, if b is the denominator of several
+    divisions, or if b is a literal. The reciprocal 1/b is
+    computed once at the loop level of b and shared by all divisions by b.
+
+    Returns new (e2i, V, target_variables, dependencies), and the mapping
+    from old to new vertex indices of the target variables.
+    """
+    n = len(V)
+    e2i = dict((v, i) for i, v in enumerate(V))
+
+    # Count the divisions by each denominator
+    num_divisions = int_array(n)
+    for i, v in enumerate(V):
+        if active[i] and isinstance(v, Division):
+            num_divisions[dependencies[i][1]] += 1
+
+    rebuilt = object_array(n)
+    reciprocals = {}
+    for i, v in enumerate(V):
+        if not active[i]:
+            continue
+
+        deps = dependencies[i]
+        if not len(deps):
+            # Modified terminal
+            rebuilt[i] = v
+            continue
+
+        if isinstance(v, Division):
+            a, b = deps
+            if levels[b] < levels[i] or num_divisions[b] > 1 or V[b]._ufl_is_literal_:
+                r = reciprocals.get(b)
+                if r is None:
+                    r = Division(as_ufl(1.0), rebuilt[b])
+                    reciprocals[b] = r
+                rebuilt[i] = Product(rebuilt[a], r)
+                continue
+
+        rebuilt[i] = reconstruct_operator(v, e2i, rebuilt)
+
+    return rebuild_graph(rebuilt, target_variables)
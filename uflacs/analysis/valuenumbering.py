@@ -19,19 +19,27 @@
 """Algorithms for value numbering within computational graphs."""
 
 from six.moves import xrange as range
-from ffc.log import warning
+from ffc.log import error, ffc_assert
 from ufl import product
 from ufl.permutation import compute_indices
 from ufl.corealg.multifunction import MultiFunction
 from ufl.classes import FormArgument
 from uflacs.analysis.indexing import map_indexed_arg_components, map_component_tensor_arg_components
+from uflacs.analysis.indexing import map_product_arg_components, map_index_sum_arg_components
 from uflacs.analysis.modified_terminals import analyse_modified_terminal
 
 
 class ValueNumberer(MultiFunction):
 
     """An algorithm to map the scalar components of an expression node to unique value numbers,
-    with fallthrough for types that can be mapped to the value numbers of their operands."""
+    with fallthrough for types that can be mapped to the value numbers of their operands.
+
+    Components of form arguments and modified terminals that are equal
+    by element or derivative symmetries share a single value number.
+    Scalar operators are value numbered by the operator type and the
+    value numbers of their operands, such that equal components such
+    as the symmetric off-diagonal components of A*A^T share a symbol.
+    """
 
     def __init__(self, e2i, V_sizes, V_symbols):
         MultiFunction.__init__(self)
@@ -40,6 +48,9 @@ class ValueNumberer(MultiFunction):
         self.V_sizes = V_sizes
         self.V_symbols = V_symbols
 
+        # Mapping from value keys of scalar operator components to symbols
+        self.value_keys = {}
+
     def new_symbols(self, n):
         "Generator for new symbols with a running counter."
         begin = self.symbol_count
@@ -56,22 +67,38 @@ class ValueNumberer(MultiFunction):
     def get_node_symbols(self, expr):
         return self.V_symbols[self.e2i[expr]]
 
+    def keyed_symbols(self, keys):
+        "Get symbols for a list of value keys, reusing the symbol of previously seen equal keys."
+        symbols = []
+        for key in keys:
+            s = self.value_keys.get(key)
+            if s is None:
+                s = self.new_symbol()
+                self.value_keys[key] = s
+            symbols.append(s)
+        return symbols
+
     def expr(self, v, i):
         "Create new symbols for expressions that represent new values."
         n = self.V_sizes[i]
         return self.new_symbols(n)
 
     def form_argument(self, v, i):
-        "Create new symbols for expressions that represent new values."
+        "Create new symbols for each component of a form argument not mapped by element symmetries."
         symmetry = v.ufl_element().symmetry()
 
-        if False and symmetry:
-            # FIXME: Ignoring symmetries for now, handle by creating only
-            # some new symbols and mapping the rest using the symmetry map.
-            actual_components = sorted(set(symmetry.values()))
-            m = len(actual_components)
-            actual_symbols = self.new_symbols(m)
-            symbols = mapping_of_actual_symbols_to_all_components(actual_symbols, symmetry)  # Need to implement this
+        if symmetry:
+            # Create symbols for the actual components only and map
+            # the other components to the symbols of their mapped component
+            mapped_symbols = {}
+            symbols = []
+            for c in compute_indices(v.ufl_shape):
+                mc = symmetry.get(c, c)
+                s = mapped_symbols.get(mc)
+                if s is None:
+                    s = self.new_symbol()
+                    mapped_symbols[mc] = s
+                symbols.append(s)
 
         else:
             n = self.V_sizes[i]
@@ -222,3 +249,48 @@ class ValueNumberer(MultiFunction):
     def variable(self, v, i):
         "Direct reuse of all symbols."
         return self.get_node_symbols(v.ufl_operands[0])
+
+    def sum(self, v, i):
+        "Number sum components by the unordered symbols of the terms."
+        a, b = [self.get_node_symbols(op) for op in v.ufl_operands]
+        keys = [("sum",) + tuple(sorted((sa, sb))) for sa, sb in zip(a, b)]
+        return self.keyed_symbols(keys)
+
+    def index_sum(self, v, i):
+        "Number index sum components by the unordered symbols of the terms, consistent with sum."
+        summand_symbols = self.get_node_symbols(v.ufl_operands[0])
+        keys = [("sum",) + tuple(sorted(summand_symbols[k] for k in c))
+                for c in map_index_sum_arg_components(v)]
+        return self.keyed_symbols(keys)
+
+    def product(self, v, i):
+        "Number product components by the unordered symbols of the factors."
+        a, b = [self.get_node_symbols(op) for op in v.ufl_operands]
+        keys = [("product",) + tuple(sorted((a[k0], b[k1])))
+                for k0, k1 in map_product_arg_components(v, len(a), len(b))]
+        return self.keyed_symbols(keys)
+
+    def division(self, v, i):
+        "Number division components by the symbols of the numerator and scalar denominator."
+        a, b = [self.get_node_symbols(op) for op in v.ufl_operands]
+        if len(b) != 1:
+            error("Expecting scalar divisor.")
+        keys = [("division", sa, b[0]) for sa in a]
+        return self.keyed_symbols(keys)
+
+    def scalar_operator(self, v, i):
+        "Number scalar operators by the operator type and the ordered symbols of the operands."
+        ops = [self.get_node_symbols(op) for op in v.ufl_operands]
+        if self.V_sizes[i] != 1 or any(len(op) != 1 for op in ops):
+            return self.expr(v, i)
+        key = (v._ufl_handler_name_,) + tuple(op[0] for op in ops)
+        return self.keyed_symbols([key])
+
+    math_function = scalar_operator
+    abs = scalar_operator
+    power = scalar_operator
+    min_value = scalar_operator
+    max_value = scalar_operator
+    atan_2 = scalar_operator
+    condition = scalar_operator
+    conditional = scalar_operator
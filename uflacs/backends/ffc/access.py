@@ -25,33 +25,31 @@ from ufl.checks import is_cellwise_constant
 from ffc.log import error
 from ffc.log import ffc_assert
 
-from uflacs.backends.ffc.common import FFCBackendSymbols
 # FIXME: Move these to FFCBackendSymbols
-from uflacs.backends.ffc.common import (names,
-                                        format_entity_name,
-                                        format_mt_name)
+from uflacs.backends.ffc.common import names, format_mt_name
 
 
 class FFCAccessBackend(MultiFunction):
     """FFC specific cpp formatter class."""
 
-    def __init__(self, ir, language, parameters):
+    def __init__(self, ir, language, symbols, parameters):
         MultiFunction.__init__(self)
 
         # Store ir and parameters
         self.ir = ir
         self.language = language
+        self.symbols = symbols
         self.parameters = parameters
 
+        # C type of defined values
+        self.scalar_type = str(self.parameters["scalar_type"])
+
         # Configure definitions behaviour
         self.physical_coordinates_known = self.ir["integral_type"] == "quadrature"
 
         # Need this for custom integrals
         #classname = make_classname(prefix, "finite_element", ir["element_numbers"][ufl_element])
 
-        coefficient_numbering = self.ir["uflacs"]["coefficient_numbering"]
-        self.symbols = FFCBackendSymbols(self.language, coefficient_numbering)
-
     def get_includes(self):
         "Return include statements to insert at top of file."
         includes = []
@@ -99,7 +97,7 @@ class FFCAccessBackend(MultiFunction):
         assert not (mt.global_derivatives or mt.local_derivatives)
         # NB! UFL doesn't retain float/int type information for zeros...
         L = self.language
-        return L.LiteralFloat(0.0)
+        return L.LiteralFloat(0.0, L.float_literal_suffix(self.scalar_type))
 
     def int_value(self, e, mt, tabledata, num_points):
         # We shouldn't have derivatives of constants left at this point
@@ -111,7 +109,7 @@ class FFCAccessBackend(MultiFunction):
         # We shouldn't have derivatives of constants left at this point
         assert not (mt.global_derivatives or mt.local_derivatives)
         L = self.language
-        return L.LiteralFloat(float(e))
+        return L.LiteralFloat(float(e), L.float_literal_suffix(self.scalar_type))
 
     def argument(self, e, mt, tabledata, num_points):
         L = self.language
@@ -121,7 +119,7 @@ class FFCAccessBackend(MultiFunction):
 
         # No need to store basis function value in its own variable, just get table value directly
         uname, begin, end = tabledata
-        entity = L.Symbol(format_entity_name(self.ir["entitytype"], mt.restriction))
+        entity = self.symbols.entity(self.ir["entitytype"], mt.restriction)
 
         iq = self.quadrature_loop_index()
         idof = self.argument_loop_index(mt.terminal.number())
@@ -233,7 +231,7 @@ class FFCAccessBackend(MultiFunction):
         cellname = mt.terminal.ufl_domain().ufl_cell().cellname()
         if cellname in ("interval", "triangle", "tetrahedron", "quadrilateral", "hexahedron"):
             tablename = "{0}_reference_facet_normals".format(cellname)
-            facet = L.Symbol(format_entity_name("facet", mt.restriction))
+            facet = self.symbols.entity("facet", mt.restriction)
             return L.ArrayAccess(tablename, (facet, mt.component[0]))
         else:
             error("Unhandled cell types {0}.".format(cellname))
@@ -243,7 +241,7 @@ class FFCAccessBackend(MultiFunction):
         cellname = mt.terminal.ufl_domain().ufl_cell().cellname()
         if cellname in ("triangle", "tetrahedron", "quadrilateral", "hexahedron"):
             tablename = "{0}_reference_facet_jacobian".format(cellname)
-            facet = L.Symbol(format_entity_name("facet", mt.restriction))
+            facet = self.symbols.entity("facet", mt.restriction)
             return L.ArrayAccess(tablename, (facet, mt.component[0], mt.component[1]))
         elif cellname == "interval":
             error("The reference facet jacobian doesn't make sense for interval cell.")
@@ -266,7 +264,7 @@ class FFCAccessBackend(MultiFunction):
         cellname = mt.terminal.ufl_domain().ufl_cell().cellname()
         if cellname in ("tetrahedron", "hexahedron"):
             tablename = "{0}_reference_edge_vectors".format(cellname)
-            facet = L.Symbol(format_entity_name("facet", mt.restriction))
+            facet = self.symbols.entity("facet", mt.restriction)
             return L.ArrayAccess(tablename, (facet, mt.component[0], mt.component[1]))
         elif cellname in ("interval", "triangle", "quadrilateral"):
             error("The reference cell facet edge vectors doesn't make sense for interval or triangle cell.")
@@ -288,7 +286,7 @@ class FFCAccessBackend(MultiFunction):
             error("Unhandled cell types {0}.".format(cellname))
 
         tablename = "{0}_facet_orientations".format(cellname)
-        facet = L.Symbol(format_entity_name("facet", mt.restriction))
+        facet = self.symbols.entity("facet", mt.restriction)
         return L.ArrayAccess(tablename, (facet,))
 
     def _expect_symbolic_lowering(self, e, mt, tabledata, num_points):
@@ -31,10 +31,17 @@ class FFCBackendSymbols(object):
         # Rules, make functions? (NB! Currently duplicated from names)
         self.restriction_postfix = {"+": "_0", "-": "_1", None: ""}  # TODO: Use this wherever we need it?
 
+        # (entitytype, restriction) -> int, for generating code specialized to fixed entity numbers
+        self.fixed_entities = {}
+
     # FIXME: Used in access: weights, points, ia, A, w, x, J
 
-    def entity(self, foo):
-        return self.S("entity")
+    def entity(self, entitytype, restriction):
+        "Entity index, a literal if the entity number is fixed."
+        entity = self.fixed_entities.get((entitytype, restriction))
+        if entity is not None:
+            return self.L.LiteralInt(entity)
+        return self.S(format_entity_name(entitytype, restriction))
 
     def x(self, quadloop):
         "Physical coordinates."
@@ -26,22 +26,25 @@ from ufl.checks import is_cellwise_constant
 from ffc.log import error
 from ffc.log import ffc_assert
 
-from uflacs.backends.ffc.common import FFCBackendSymbols
 # FIXME: Move these to FFCBackendSymbols
-from uflacs.backends.ffc.common import format_entity_name, ufc_restriction_postfix
+from uflacs.backends.ffc.common import ufc_restriction_postfix
 
 
 class FFCDefinitionsBackend(MultiFunction):
     """FFC specific code definitions."""
 
-    def __init__(self, ir, language, parameters):
+    def __init__(self, ir, language, symbols, parameters):
         MultiFunction.__init__(self)
 
         # Store ir and parameters
         self.ir = ir
         self.language = language
+        self.symbols = symbols
         self.parameters = parameters
 
+        # C type of defined values
+        self.scalar_type = str(self.parameters["scalar_type"])
+
         # FIXME: Make this configurable for easy experimentation with dolfin!
         # Coordinate dofs for each component are interleaved? Must match dolfin.
         self.interleaved_components = True # parameters["interleaved_coordinate_component_dofs"]
@@ -55,9 +58,6 @@ class FFCDefinitionsBackend(MultiFunction):
         # Need this for custom integrals
         #classname = make_classname(prefix, "finite_element", ir["element_numbers"][ufl_element])
 
-        coefficient_numbering = ir["uflacs"]["coefficient_numbering"]
-        self.symbols = FFCBackendSymbols(self.language, coefficient_numbering)
-
     def get_includes(self):
         "Return include statements to insert at top of file."
         includes = []
@@ -90,9 +90,9 @@ class FFCDefinitionsBackend(MultiFunction):
         else:
             # No need to store basis function value in its own variable,
             # just get table value directly
-            code += [L.VariableDecl("double", access, 0.0)]
+            code += [L.VariableDecl(self.scalar_type, access, 0.0)]
             uname, begin, end = tabledata
-            entity = format_entity_name(self.ir["entitytype"], mt.restriction)
+            entity = self.symbols.entity(self.ir["entitytype"], mt.restriction)
 
             # Empty loop needs to be skipped as zero tables may not be generated
             # FIXME: assert begin < end instead, and remove at earlier
@@ -116,6 +116,82 @@ class FFCDefinitionsBackend(MultiFunction):
 
         return code
 
+    def coefficients(self, terminal_data, precomputed=None):
+        """Return definition code for a list of varying modified coefficients.
+
+        The argument terminal_data is a list of (mt, tabledata, access).
+        Modified coefficients with the same terminal, restriction and dof
+        range are evaluated in a single loop over the coefficient dofs,
+        such that each dof value is loaded once for all components and
+        derivatives.
+
+        If precomputed is a tuple (name, num_points), the coefficients are
+        evaluated for all quadrature points in a separate loop storing the
+        values in an array name[num_points][num_values], and the
+        definitions read from this array.
+
+        Returns (precomputation code, definition code).
+        """
+        L = self.language
+
+        # Group modified coefficients, keeping the order of first appearance
+        groups = []
+        group_numbers = {}
+        for mt, tabledata, access in terminal_data:
+            uname, begin, end = tabledata
+            key = (mt.terminal, mt.restriction, begin, end)
+            if key not in group_numbers:
+                group_numbers[key] = len(groups)
+                groups.append((key, []))
+            groups[group_numbers[key]][1].append((mt, uname, access))
+
+        iq = self.symbols.quadrature_loop_index()
+        idof = self.symbols.coefficient_dof_sum_index()
+
+        precode = []
+        code = []
+        if precomputed is None:
+            for (terminal, restriction, begin, end), items in groups:
+                code += [L.VariableDecl(self.scalar_type, access, 0.0) for mt, uname, access in items]
+
+                # Empty loop needs to be skipped as zero tables may not be generated
+                if begin >= end:
+                    continue
+
+                entity = self.symbols.entity(self.ir["entitytype"], restriction)
+                dof_access = self.symbols.coefficient_dof_access(terminal, idof)
+                dof = L.Sub(idof, begin)
+                body = [L.AssignAdd(access, L.Mul(dof_access, L.ArrayAccess(uname, (entity, iq, dof))))
+                        for mt, uname, access in items]
+
+                # Loop to accumulate linear combinations of dofs and tables
+                code += [L.ForRange(idof, begin, end, body=body)]
+        else:
+            name, num_points = precomputed
+            num_values = sum(len(items) for key, items in groups)
+            precode += [L.ArrayDecl(self.scalar_type, name, (num_points, num_values), values=0)]
+
+            k = 0
+            body = []
+            for (terminal, restriction, begin, end), items in groups:
+                entity = self.symbols.entity(self.ir["entitytype"], restriction)
+                dof_access = self.symbols.coefficient_dof_access(terminal, idof)
+                dof = L.Sub(idof, begin)
+                accumulate = []
+                for mt, uname, access in items:
+                    value = L.ArrayAccess(name, (iq, k))
+                    code += [L.VariableDecl("const " + self.scalar_type, access, value)]
+                    accumulate += [L.AssignAdd(value, L.Mul(dof_access, L.ArrayAccess(uname, (entity, iq, dof))))]
+                    k += 1
+                if begin < end:
+                    body += [L.ForRange(idof, begin, end, body=accumulate)]
+
+            # Loop over all quadrature points to evaluate coefficients before the quadrature loop
+            if body:
+                precode += [L.ForRange(iq, 0, num_points, body=body)]
+
+        return precode, code
+
     def quadrature_weight(self, e, mt, tabledata, access):
         return []
 
@@ -168,7 +244,7 @@ class FFCDefinitionsBackend(MultiFunction):
         else:
             num_scalar_dofs = end - begin
 
-        entity = format_entity_name(self.ir["entitytype"], mt.restriction)
+        entity = self.symbols.entity(self.ir["entitytype"], mt.restriction)
         coefficient_dof = self.symbols.coefficient_dof_sum_index()
         if coordinate_element.degree() > 0:
             iq = self.symbols.quadrature_loop_index()
@@ -185,7 +261,7 @@ class FFCDefinitionsBackend(MultiFunction):
             accumulate = [L.AssignAdd(access, prod)]
 
             # Loop to accumulate linear combination of dofs and tables
-            code += [L.VariableDecl("double", access, 0.0)]
+            code += [L.VariableDecl(self.scalar_type, access, 0.0)]
             code += [L.ForRange(coefficient_dof, begin, end, body=accumulate)]
         else:
             # Inlined version (we know this is bounded by a small number)
@@ -199,7 +275,7 @@ class FFCDefinitionsBackend(MultiFunction):
                 #prods += [dof_access[idof] * uname[entity, iq, idof - begin]]
 
             # Inlined loop to accumulate linear combination of dofs and tables
-            code += [L.VariableDecl("const double", access, L.Sum(prods))]
+            code += [L.VariableDecl("const " + self.scalar_type, access, L.Sum(prods))]
 
         return code
 
@@ -256,7 +332,7 @@ class FFCDefinitionsBackend(MultiFunction):
         else:
             num_scalar_dofs = end - begin
 
-        entity = format_entity_name(self.ir["entitytype"], mt.restriction)
+        entity = self.symbols.entity(self.ir["entitytype"], mt.restriction)
         coefficient_dof = self.symbols.coefficient_dof_sum_index()
         if degree > 1:
             iq = self.symbols.quadrature_loop_index()
@@ -273,7 +349,7 @@ class FFCDefinitionsBackend(MultiFunction):
             accumulate = L.AssignAdd(access, prod)
 
             # Loop to accumulate linear combination of dofs and tables
-            code += [L.VariableDecl("double", access, 0.0)]
+            code += [L.VariableDecl(self.scalar_type, access, 0.0)]
             code += [L.ForRange(coefficient_dof, begin, end, body=accumulate)]
         else:
             # Inlined version:
@@ -285,7 +361,7 @@ class FFCDefinitionsBackend(MultiFunction):
                 prods += [L.Mul(dof_access[idof], table_access)]
 
             # Inlined loop to accumulate linear combination of dofs and tables
-            code += [L.VariableDecl("const double", access, L.Sum(prods))]
+            code += [L.VariableDecl("const " + self.scalar_type, access, L.Sum(prods))]
 
 
         return code
@@ -320,8 +396,8 @@ class FFCDefinitionsBackend(MultiFunction):
         # 0 means up and gives +1.0, 1 means down and gives -1.0.
         L = self.language
         co = "cell_orientation" + ufc_restriction_postfix(mt.restriction)
-        expr = L.VerbatimExpr("(" + co + " == 1) ? -1.0: +1.0;")
-        return [L.VariableDecl("const double", access, expr)]
+        expr = L.Conditional(L.EQ(co, 1), -1.0, 1.0)
+        return [L.VariableDecl("const " + self.scalar_type, access, expr)]
 
     def facet_orientation(self, e, mt, tabledata, access):
         # Constant table defined in ufc_geometry.h
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011-2015 Martin Sandve Alnæs
+#
+# This file is part of UFLACS.
+#
+# UFLACS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UFLACS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
+
+"""Numerical evaluation of the uflacs integral ir for batches of cells with numpy.
+
+This evaluates the same ir as the code generation, vertex by vertex
+of the scalar graph, with each value an array over cells and
+quadrature points. It serves as a compiler free reference for the
+generated tabulate_tensor code.
+"""
+
+import math
+
+import numpy
+
+from six import iteritems
+from six.moves import xrange as range
+
+from ufl.corealg.multifunction import MultiFunction
+from ufl.checks import is_cellwise_constant
+from ufl.permutation import build_component_numbering
+
+from ffc.log import error, ffc_assert
+
+from uflacs.analysis.modified_terminals import is_modified_terminal
+
+
+def reference_cell_geometry(cellname):
+    """Return reference geometry quantities of a simplex cell by UFC conventions.
+
+    Returns a dict with the reference cell and facet volumes, the
+    outward unit normals of each facet and the Jacobians of the
+    mappings from the reference facet to each facet of the reference cell.
+    """
+    tdim = {"interval": 1, "triangle": 2, "tetrahedron": 3}.get(cellname)
+    if tdim is None:
+        error("Unhandled cell type {0}.".format(cellname))
+
+    # Vertex v > 0 of the reference cell is the unit vector v-1
+    vertices = numpy.vstack([numpy.zeros(tdim), numpy.eye(tdim)])
+
+    # Facet f is opposite vertex f, with outward normal along
+    # the negative gradient of the barycentric coordinate of vertex f
+    gradients = numpy.vstack([-numpy.ones(tdim), numpy.eye(tdim)])
+    normals = -gradients / numpy.sqrt((gradients**2).sum(axis=1))[:, numpy.newaxis]
+
+    facet_jacobians = []
+    for f in range(tdim + 1):
+        fv = [v for v in range(tdim + 1) if v != f]
+        facet_jacobians.append((vertices[fv[1:]] - vertices[fv[0]]).T)
+
+    return {
+        "cell_volume": 1.0 / math.factorial(tdim),
+        "facet_volume": 1.0 / math.factorial(tdim - 1),
+        "facet_normals": normals,
+        "facet_jacobians": numpy.asarray(facet_jacobians),
+        }
+
+
+class FFCNumpyTerminalEvaluator(MultiFunction):
+    """Evaluate modified terminals for a batch of cells.
+
+    Handlers take (e, mt, tabledata) and return a value that
+    broadcasts to shape (num_cells, num_points).
+    """
+
+    def __init__(self, ir, num_points, data):
+        MultiFunction.__init__(self)
+        self.ir = ir
+        self.num_points = num_points
+        self.data = data
+
+        expr_ir = ir["uflacs"]["expr_ir"][num_points]
+        self.coefficient_numbering = ir["uflacs"]["coefficient_numbering"]
+        self.weights, self.points = ir["quadrature_rules"][num_points]
+
+        # Use the tables with quadrature weights folded in, as in the code generation
+        self.tables = dict(expr_ir["unique_tables"])
+        for name, table in iteritems(expr_ir["weighted_tables"]):
+            self.tables[name] = table * numpy.asarray(self.weights)[numpy.newaxis, :, numpy.newaxis]
+
+    def table(self, name, restriction):
+        "Return table values for the entity of each cell, with shape (num_cells or 1, num_points, num_dofs)."
+        table = self.tables[name]
+        if self.ir["entitytype"] == "cell":
+            return table[0][numpy.newaxis]
+        return table[self.data.entities[restriction]]
+
+    def expr(self, e, mt, tabledata):
+        error("Missing handler for type {0}.".format(e._ufl_class_.__name__))
+
+    # === Literal constants ===
+
+    def constant_value(self, e, mt, tabledata):
+        # We shouldn't have derivatives of constants left at this point
+        assert not (mt.global_derivatives or mt.local_derivatives)
+        return float(e)
+
+    def zero(self, e, mt, tabledata):
+        return 0.0
+
+    # === Form arguments ===
+
+    def coefficient(self, e, mt, tabledata):
+        c = self.coefficient_numbering[mt.terminal]
+        dofs = self.data.w[c]
+        if is_cellwise_constant(mt.terminal):
+            # Map component to flat dof index, with the second cell after the first one
+            vi2si, si2vi = build_component_numbering(mt.terminal.ufl_shape,
+                                                     mt.terminal.ufl_element().symmetry())
+            idof = mt.flat_component
+            if mt.restriction == "-":
+                idof += len(si2vi)
+            return dofs[:, idof, numpy.newaxis]
+
+        uname, begin, end = tabledata
+        if begin >= end:
+            return 0.0
+        return (dofs[:, numpy.newaxis, begin:end] * self.table(uname, mt.restriction)).sum(axis=-1)
+
+    # === Geometry ===
+
+    def quadrature_weight(self, e, mt, tabledata):
+        return numpy.asarray(self.weights)[numpy.newaxis, :]
+
+    def _coordinate_field(self, e, mt, tabledata):
+        "Evaluate a component of x or J as linear combination of coordinate dofs and tables."
+        uname, begin, end = tabledata
+        if begin >= end:
+            return 0.0
+        # Reorder interleaved coordinate dofs to blocks of components like the table dofs
+        gdim = mt.terminal.ufl_domain().geometric_dimension()
+        coordinate_dofs = self.data.coordinate_dofs[mt.restriction]
+        num_cells = coordinate_dofs.shape[0]
+        dofs = coordinate_dofs.reshape(num_cells, -1, gdim).transpose(0, 2, 1).reshape(num_cells, -1)
+        return (dofs[:, numpy.newaxis, begin:end] * self.table(uname, mt.restriction)).sum(axis=-1)
+
+    def spatial_coordinate(self, e, mt, tabledata):
+        ffc_assert(not (mt.global_derivatives or mt.local_derivatives),
+                   "Not expecting derivatives of SpatialCoordinates.")
+        ffc_assert(not mt.averaged, "Not expecting average of SpatialCoordinates.")
+        return self._coordinate_field(e, mt, tabledata)
+
+    def jacobian(self, e, mt, tabledata):
+        ffc_assert(not (mt.global_derivatives or mt.local_derivatives),
+                   "Not expecting derivatives of Jacobian.")
+        ffc_assert(not mt.averaged, "Not expecting average of Jacobian.")
+        return self._coordinate_field(e, mt, tabledata)
+
+    def cell_coordinate(self, e, mt, tabledata):
+        ffc_assert(self.ir["entitytype"] == "cell", "Expecting CellCoordinate only in cell integrals.")
+        return numpy.asarray(self.points)[numpy.newaxis, :, mt.flat_component]
+
+    def _reference_geometry(self, mt):
+        return reference_cell_geometry(mt.terminal.ufl_domain().ufl_cell().cellname())
+
+    def reference_cell_volume(self, e, mt, tabledata):
+        return self._reference_geometry(mt)["cell_volume"]
+
+    def reference_facet_volume(self, e, mt, tabledata):
+        return self._reference_geometry(mt)["facet_volume"]
+
+    def reference_normal(self, e, mt, tabledata):
+        normals = self._reference_geometry(mt)["facet_normals"]
+        facets = self.data.entities[mt.restriction]
+        return normals[facets, mt.component[0]][:, numpy.newaxis]
+
+    def cell_facet_jacobian(self, e, mt, tabledata):
+        jacobians = self._reference_geometry(mt)["facet_jacobians"]
+        facets = self.data.entities[mt.restriction]
+        return jacobians[facets, mt.component[0], mt.component[1]][:, numpy.newaxis]
+
+    def _expect_symbolic_lowering(self, e, mt, tabledata):
+        error("Expecting {0} to be replaced in symbolic preprocessing.".format(type(e)))
+    facet_normal = _expect_symbolic_lowering
+    cell_normal = _expect_symbolic_lowering
+    jacobian_inverse = _expect_symbolic_lowering
+    jacobian_determinant = _expect_symbolic_lowering
+    facet_jacobian = _expect_symbolic_lowering
+    facet_jacobian_inverse = _expect_symbolic_lowering
+    facet_jacobian_determinant = _expect_symbolic_lowering
+
+
+def _erf(x):
+    return numpy.vectorize(math.erf, otypes=[float])(x)
+
+_numpy_math_functions = {
+    "sqrt": numpy.sqrt,
+    "exp": numpy.exp,
+    "ln": numpy.log,
+    "cos": numpy.cos,
+    "sin": numpy.sin,
+    "tan": numpy.tan,
+    "cosh": numpy.cosh,
+    "sinh": numpy.sinh,
+    "tanh": numpy.tanh,
+    "acos": numpy.arccos,
+    "asin": numpy.arcsin,
+    "atan": numpy.arctan,
+    "erf": _erf,
+    }
+
+
+class NumpyOperatorEvaluator(MultiFunction):
+    """Evaluate scalar operators on numpy arrays of operand values.
+
+    Handlers take the operator and the values of its operands.
+    """
+
+    def expr(self, o, *ops):
+        error("Missing handler for type {0}.".format(o._ufl_class_.__name__))
+
+    def sum(self, o, a, b):
+        return a + b
+
+    def product(self, o, a, b):
+        return a * b
+
+    def division(self, o, a, b):
+        return numpy.true_divide(a, b)
+
+    def power(self, o, a, b):
+        return numpy.power(numpy.asarray(a, dtype=float), b)
+
+    def abs(self, o, a):
+        return numpy.abs(a)
+
+    def math_function(self, o, a):
+        f = _numpy_math_functions.get(o._name)
+        if f is None:
+            error("Unhandled math function {0}.".format(o._name))
+        return f(a)
+
+    def atan_2(self, o, a, b):
+        return numpy.arctan2(a, b)
+
+    def min_value(self, o, a, b):
+        return numpy.minimum(a, b)
+
+    def max_value(self, o, a, b):
+        return numpy.maximum(a, b)
+
+    def eq(self, o, a, b):
+        return numpy.equal(a, b)
+
+    def ne(self, o, a, b):
+        return numpy.not_equal(a, b)
+
+    def lt(self, o, a, b):
+        return numpy.less(a, b)
+
+    def le(self, o, a, b):
+        return numpy.less_equal(a, b)
+
+    def gt(self, o, a, b):
+        return numpy.greater(a, b)
+
+    def ge(self, o, a, b):
+        return numpy.greater_equal(a, b)
+
+    def and_condition(self, o, a, b):
+        return numpy.logical_and(a, b)
+
+    def or_condition(self, o, a, b):
+        return numpy.logical_or(a, b)
+
+    def not_condition(self, o, a):
+        return numpy.logical_not(a)
+
+    def conditional(self, o, c, t, f):
+        return numpy.where(c, t, f)
+
+
+class FFCNumpyIntegralData(object):
+    """Input data of a batch of cells in the layout of the ufc tabulate_tensor arguments.
+
+    Arrays are indexed by cell first, coordinate_dofs and entities
+    are keyed by restriction.
+    """
+
+    def __init__(self, integral_type, coordinate_dofs, w, entities):
+        if integral_type == "interior_facet":
+            cd0, cd1 = coordinate_dofs
+            self.coordinate_dofs = {"+": numpy.asarray(cd0), "-": numpy.asarray(cd1)}
+            e0, e1 = entities
+            self.entities = {"+": numpy.asarray(e0), "-": numpy.asarray(e1)}
+        elif integral_type in ("cell", "exterior_facet"):
+            self.coordinate_dofs = {None: numpy.asarray(coordinate_dofs)}
+            self.entities = {None: None if entities is None else numpy.asarray(entities)}
+        else:
+            error("Numerical evaluation of {0} integrals is not implemented.".format(integral_type))
+        self.w = [numpy.asarray(wc) for wc in w]
+        self.num_cells = next(iter(self.coordinate_dofs.values())).shape[0]
+
+
+def evaluate_expr_ir(ir, num_points, data, evaluate_terminal=None):
+    """Evaluate the vertices of the scalar graph of the integrand for num_points.
+
+    Returns a list with the value of each vertex of expr_ir["V"] as an
+    array of shape (num_cells, num_points), or None for vertices not used.
+    """
+    expr_ir = ir["uflacs"]["expr_ir"][num_points]
+    V = expr_ir["V"]
+    e2i = dict((v, i) for i, v in enumerate(V))
+
+    if evaluate_terminal is None:
+        evaluate_terminal = FFCNumpyTerminalEvaluator(ir, num_points, data)
+    evaluate_operator = NumpyOperatorEvaluator()
+
+    shape = (data.num_cells, num_points)
+    values = [None] * len(V)
+    for i, v in enumerate(V):
+        # Vertices neither piecewise nor varying are not active
+        if not (expr_ir["piecewise"][i] or expr_ir["varying"][i]):
+            continue
+        if is_modified_terminal(v):
+            mt = expr_ir["modified_terminals"][i]
+            value = evaluate_terminal(mt.terminal, mt, expr_ir["table_ranges"][i])
+        else:
+            ops = [values[e2i[op]] for op in v.ufl_operands]
+            value = evaluate_operator(v, *ops)
+        values[i] = numpy.broadcast_to(numpy.asarray(value, dtype=float), shape)
+    return values
+
+
+def evaluate_tabulate_tensor(ir, coordinate_dofs, w, entities=None):
+    """Evaluate the element tensor of an integral for a batch of cells.
+
+    Input arrays are indexed by cell first, each with the same
+    content as the corresponding ufc tabulate_tensor argument:
+
+    - coordinate_dofs: array (num_cells, num_coordinate_dofs),
+      a pair of such arrays for interior facet integrals.
+    - w: list with an array (num_cells, num_dofs) of dofs for each
+      coefficient, with the dofs of both cells for interior facet integrals.
+    - entities: None for cell integrals, array (num_cells,) of local facet
+      numbers for exterior facet integrals, a pair of such arrays for
+      interior facet integrals.
+
+    Returns the element tensors as an array with shape (num_cells,) + tensor shape.
+    """
+    integral_type = ir["integral_type"]
+    data = FFCNumpyIntegralData(integral_type, coordinate_dofs, w, entities)
+
+    # Tensor dimensions, arguments are restricted to either cell in interior facet integrals
+    dims = tuple(ir["prim_idims"])
+    if integral_type == "interior_facet":
+        dims = tuple(2 * d for d in dims)
+    A = numpy.zeros((data.num_cells,) + dims)
+
+    letters = "abcdefgh"
+    for num_points, expr_ir in iteritems(ir["uflacs"]["expr_ir"]):
+        evaluate_terminal = FFCNumpyTerminalEvaluator(ir, num_points, data)
+        values = evaluate_expr_ir(ir, num_points, data, evaluate_terminal)
+
+        for mas, i in iteritems(expr_ir["argument_factorization"]):
+            # Contract the monomial factor with the tables of each argument over quadrature points
+            operands = [values[i]]
+            subscripts = ["nq"]
+            iargs = []
+            block = [slice(None)] * (1 + len(dims))
+            for ma in mas:
+                mt = expr_ir["modified_arguments"][ma]
+                tabledata = expr_ir["modified_argument_table_ranges"][ma]
+                if tabledata is None or tabledata[1] >= tabledata[2]:
+                    operands = None
+                    break
+                uname, begin, end = tabledata
+                table = evaluate_terminal.table(uname, mt.restriction)
+                operands.append(numpy.broadcast_to(table, (data.num_cells, num_points, end - begin)))
+                iarg = mt.terminal.number()
+                iargs.append(iarg)
+                subscripts.append("nq" + letters[iarg])
+                block[1 + iarg] = slice(begin, end)
+            if operands is None:
+                # Zero contribution from empty table
+                continue
+
+            result = "n" + "".join(letters[iarg] for iarg in sorted(iargs))
+            A[tuple(block)] += numpy.einsum(",".join(subscripts) + "->" + result, *operands)
+
+    return A
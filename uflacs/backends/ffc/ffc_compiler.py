@@ -18,16 +18,42 @@
 
 """The FFC specific backend to the UFLACS form compiler algorithms."""
 
-def compile_tabulate_tensor_code(form, optimize=True):
+from uflacs.backends.ffc.parallel import parallel_map
+
+
+def _compile_integral_tabulate_tensor_code(itg_data, form_data, form_id, prefix, parameters, optimize):
+    "Compile a single integral to tabulate_tensor code, may be called in a separate process."
+    from ffc.cpp import set_float_formatting
+    from ffc.uflacsrepr import compute_integral_ir, optimize_integral_ir, generate_integral_code
+
+    # Float formatting is global state which must be set in each process
+    set_float_formatting(8)
+
+    # Just make a fixed choice of cubic default quadrature rule for this test code
+    itg_data.metadata["quadrature_degree"] = itg_data.metadata.get("quadrature_degree", 3)
+    itg_data.metadata["quadrature_rule"] = itg_data.metadata.get("quadrature_rule", "default")
+
+    # Call uflacs representation functions from ffc, which again calls the matching uflacs functions
+    element_numbers = None # FIXME
+    ir = compute_integral_ir(itg_data, form_data, form_id, element_numbers, parameters)
+    if optimize:
+        ir = optimize_integral_ir(ir, parameters)
+    code = generate_integral_code(ir, prefix, parameters)
+
+    # Return just the tabulate tensor part generated by uflacs
+    return code["tabulate_tensor"]
+
+
+def compile_tabulate_tensor_code(form, optimize=True, num_workers=0):
     """This function is basically a mock controller which allows emulating the behaviour of ffc,
     by joining compute_ir, optimize_ir, and generate_ir.
+
+    With num_workers > 1 the integrals are compiled in a pool of that many processes,
+    the order of the generated code is the same as for sequential compilation.
     """
     from ufl.algorithms import compute_form_data
-    from ffc.cpp import set_float_formatting
-    from ffc.uflacsrepr import compute_integral_ir, optimize_integral_ir, generate_integral_code
 
     # Fake the initialization necessary to get this running through
-    set_float_formatting(8)
     parameters = {"optimize": optimize, "restrict_keyword": ""}
     prefix = "uflacs_testing"
     form_id = 0
@@ -41,22 +67,90 @@ def compile_tabulate_tensor_code(form, optimize=True):
                                   do_apply_restrictions=True,
                                   )
 
-    tt_codes = []
-    for itg_data in form_data.integral_data:
-        # Just make a fixed choice of cubic default quadrature rule for this test code
-        itg_data.metadata["quadrature_degree"] = itg_data.metadata.get("quadrature_degree", 3)
-        itg_data.metadata["quadrature_rule"] = itg_data.metadata.get("quadrature_rule", "default")
-
-        # Call uflacs representation functions from ffc, which again calls the matching uflacs functions
-        element_numbers = None # FIXME
-        ir = compute_integral_ir(itg_data, form_data, form_id, element_numbers, parameters)
-        if optimize:
-            ir = optimize_integral_ir(ir, parameters)
-        code = generate_integral_code(ir, prefix, parameters)
-
-        # Store just the tabulate tensor part generated by uflacs
-        tt_codes.append(code["tabulate_tensor"])
+    args_list = [(itg_data, form_data, form_id, prefix, parameters, optimize)
+                 for itg_data in form_data.integral_data]
+    tt_codes = parallel_map(_compile_integral_tabulate_tensor_code, args_list, num_workers)
 
     # Just joint the tabulate tensor bodies and return
     code = ('\n' + '/' * 60 + '\n').join(tt_codes)
     return code
+
+
+def _entitytype(integral_type):
+    if integral_type in ("cell", "custom"):
+        return "cell"
+    elif integral_type.endswith("facet"):
+        return "facet"
+    elif integral_type == "vertex":
+        return "vertex"
+    raise RuntimeError("Unknown integral type {0}.".format(integral_type))
+
+
+def _normalize_cell_tables(psi_tables):
+    "Key cell tables by None as uflacs expects, some ffc versions use entity 0."
+    for element_tables in psi_tables.values():
+        for avg_tables in element_tables.values():
+            for avg, entity_tables in list(avg_tables.items()):
+                if list(entity_tables) == [0]:
+                    avg_tables[avg] = {None: entity_tables[0]}
+
+
+def _call(name, func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def compute_integral_irs(form, parameters, timer=None):
+    """Build the ir of each integral in form the way ffc does for uflacs.
+
+    This emulates the parts of the ffc integral representation
+    that uflacs uses, with the default quadrature rule of the
+    estimated degree of each integral.
+
+    Each phase is run through timer(name, func, *args, **kwargs)
+    if given, which makes it possible to measure the phases.
+
+    Returns form_data and a list of (itg_data, ir) for each integral.
+    """
+    from ufl.algorithms import compute_form_data
+    from ufl.classes import Jacobian
+    from ffc.fiatinterface import create_element
+    from ffc.quadrature.quadraturerepresentation import sort_integrals
+    from ffc.quadrature.tabulate_basis import tabulate_basis
+    from uflacs.backends.ffc.representation import compute_uflacs_integral_ir
+
+    timer = timer or _call
+
+    form_data = timer("form_data", compute_form_data, form,
+                      do_apply_function_pullbacks=True,
+                      do_apply_integral_scaling=True,
+                      do_apply_geometry_lowering=True,
+                      preserve_geometry_types=(Jacobian,),
+                      do_apply_restrictions=True)
+
+    argument_dims = [create_element(e).space_dimension() for e in form_data.argument_elements]
+
+    irs = []
+    for itg_data in form_data.integral_data:
+        # Use the maximal estimated degree as default quadrature degree
+        degree = max(itg.metadata()["estimated_polynomial_degree"] for itg in itg_data.integrals)
+        sorted_integrals = sort_integrals(itg_data.integrals, "default", degree)
+
+        integrals_dict, psi_tables, quadrature_rules = \
+            timer("tabulate_basis", tabulate_basis, sorted_integrals, form_data, itg_data)
+
+        integral_type = itg_data.integral_type
+        entitytype = _entitytype(integral_type)
+        if entitytype == "cell":
+            _normalize_cell_tables(psi_tables)
+
+        ir = {
+            "integral_type": integral_type,
+            "entitytype": entitytype,
+            "rank": form_data.rank,
+            "prim_idims": argument_dims,
+            "quadrature_rules": quadrature_rules,
+            }
+        ir["uflacs"] = timer("uflacs_ir", compute_uflacs_integral_ir,
+                             psi_tables, entitytype, integrals_dict, form_data, parameters)
+        irs.append((itg_data, ir))
+    return form_data, irs
@@ -18,21 +18,40 @@
 
 """FFC specific algorithms for the generation phase."""
 
+from ffc.log import error
+
 from uflacs.generation.integralgenerator import IntegralGenerator
+from uflacs.generation.costestimation import estimate_kernel_cost
 
 import uflacs.language.cnodes
+import uflacs.language.pynodes
 from uflacs.language.format_lines import format_indented_lines
 from uflacs.language.ufl_to_cnodes import UFL2CNodesTranslator
+from uflacs.language.ufl_to_pynodes import UFL2PyNodesTranslator
+from uflacs.backends.ffc.common import FFCBackendSymbols
 from uflacs.backends.ffc.access import FFCAccessBackend
 from uflacs.backends.ffc.definitions import FFCDefinitionsBackend
+from uflacs.backends.ffc.evaluation import reference_cell_geometry
+from uflacs.params import default_parameters
+
+# Language modules and their UFL translators, both languages share the CNodes AST
+languages = {
+    "cnodes": (uflacs.language.cnodes, UFL2CNodesTranslator),
+    "pynodes": (uflacs.language.pynodes, UFL2PyNodesTranslator),
+    }
 
 class FFCBackend(object):
     "Class collecting all aspects of the FFC backend."
-    def __init__(self, ir, parameters):
-        self.language = uflacs.language.cnodes
-        self.ufl_to_language = UFL2CNodesTranslator(self.language)
-        self.definitions = FFCDefinitionsBackend(ir, self.language, parameters)
-        self.access = FFCAccessBackend(ir, self.language, parameters)
+    def __init__(self, ir, parameters, language="cnodes"):
+        # Merge parameters with defaults once, shared by all parts of the backend and the generator
+        self.parameters = default_parameters()
+        self.parameters.update(parameters)
+        self.language, translator = languages[language]
+        self.ufl_to_language = translator(self.language)
+        coefficient_numbering = ir["uflacs"]["coefficient_numbering"]
+        self.symbols = FFCBackendSymbols(self.language, coefficient_numbering)
+        self.definitions = FFCDefinitionsBackend(ir, self.language, self.symbols, self.parameters)
+        self.access = FFCAccessBackend(ir, self.language, self.symbols, self.parameters)
 
 def generate_tabulate_tensor_code(ir, prefix, parameters):
 
@@ -40,7 +59,7 @@ def generate_tabulate_tensor_code(ir, prefix, parameters):
     backend = FFCBackend(ir, parameters)
 
     # Create code generator for integral body
-    ig = IntegralGenerator(ir, backend)
+    ig = IntegralGenerator(ir, backend, backend.parameters)
 
     # Generate code ast for the tabulate_tensor body
     parts = ig.generate()
@@ -54,10 +73,86 @@ def generate_tabulate_tensor_code(ir, prefix, parameters):
     includes.update(ig.get_includes())
     includes.update(backend.definitions.get_includes())
 
+    # Estimate operation counts and memory usage of the generated code
+    cost = estimate_kernel_cost(parts,
+                                backend.access.quadrature_loop_index(),
+                                ig.get_element_tensor_shape())
+
     # Format uflacs specific code structures into a single
     # string and place in dict before returning to ffc
     code = {
         "tabulate_tensor": body,
         "additional_includes_set": includes,
+        "cost_estimate": cost,
     }
     return code
+
+
+# Arguments of the Python tabulate_tensor for each integral type,
+# the same as in the ufc signatures
+_python_tabulate_tensor_arguments = {
+    "cell": "A, w, coordinate_dofs, cell_orientation=0",
+    "exterior_facet": "A, w, coordinate_dofs, facet, cell_orientation=0",
+    "interior_facet": ("A, w, coordinate_dofs_0, coordinate_dofs_1, facet_0, facet_1, "
+                       "cell_orientation_0=0, cell_orientation_1=0"),
+    "vertex": "A, w, coordinate_dofs, vertex, cell_orientation=0",
+    }
+
+def generate_reference_geometry_python():
+    "Generate Python definitions of the reference geometry tables in ufc_geometry.h for simplex cells."
+    L = uflacs.language.pynodes
+    parts = []
+    for cellname in ("interval", "triangle", "tetrahedron"):
+        g = reference_cell_geometry(cellname)
+        prefix = cellname + "_reference_"
+        parts += [L.VariableDecl("static const double", prefix + "cell_volume", g["cell_volume"]),
+                  L.VariableDecl("static const double", prefix + "facet_volume", g["facet_volume"]),
+                  L.ArrayDecl("static const double", prefix + "facet_normals",
+                              g["facet_normals"].shape, g["facet_normals"])]
+        if cellname != "interval":
+            parts += [L.ArrayDecl("static const double", prefix + "facet_jacobian",
+                                  g["facet_jacobians"].shape, g["facet_jacobians"])]
+    return L.format_python(parts)
+
+def generate_tabulate_tensor_python(ir, parameters):
+    """Generate the source of a Python module defining tabulate_tensor for a batch of cells.
+
+    The generated function takes the same arguments as the ufc
+    tabulate_tensor, with a trailing cell axis on each array:
+    A has shape (A_size, num_cells), w is a sequence with an array of
+    shape (num_dofs, num_cells) for each coefficient, coordinate_dofs
+    has shape (num_coordinate_dofs, num_cells), and entity numbers
+    are either ints or arrays of shape (num_cells,). The element
+    tensors of all cells are written to A in place.
+    """
+    integral_type = ir["integral_type"]
+    if integral_type not in _python_tabulate_tensor_arguments:
+        error("Python code generation is not implemented for {0} integrals.".format(integral_type))
+
+    # A switch over facet pairs can't be used when facets vary between cells
+    parameters = dict(parameters)
+    parameters["specialize_interior_facets"] = False
+
+    # Create FFC Python backend
+    backend = FFCBackend(ir, parameters, language="pynodes")
+
+    # Create code generator for integral body
+    ig = IntegralGenerator(ir, backend, backend.parameters)
+
+    # Generate code ast for the tabulate_tensor body
+    parts = ig.generate()
+
+    # Format code AST as a function in a module
+    body = backend.language.format_python(parts, 1)
+    imports = ["from __future__ import division", "import numpy"]
+    if "scipy.special." in body:
+        imports += ["import scipy.special"]
+    signature = "def tabulate_tensor({0}):".format(_python_tabulate_tensor_arguments[integral_type])
+    return "\n".join(imports + ["", generate_reference_geometry_python(), "", signature, body, ""])
+
+def compile_tabulate_tensor_python(ir, parameters):
+    "Generate and compile Python code for tabulate_tensor, returns the function."
+    code = generate_tabulate_tensor_python(ir, parameters)
+    namespace = {}
+    exec(compile(code, "<uflacs tabulate_tensor>", "exec"), namespace)
+    return namespace["tabulate_tensor"]
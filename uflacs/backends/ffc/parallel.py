@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011-2015 Martin Sandve Alnæs
+#
+# This file is part of UFLACS.
+#
+# UFLACS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UFLACS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
+
+"""Utilities for compiling independent integrals in parallel processes."""
+
+import multiprocessing
+
+from ffc.log import warning
+
+
+def num_parallel_workers(parameters):
+    """Return the number of worker processes requested by parameters.
+
+    The parameter 'parallel_workers' is interpreted as follows:
+    0 or 1 means sequential compilation in the current process,
+    n > 1 means a pool of n processes, and negative values
+    mean one process per available cpu.
+    """
+    n = int(parameters.get("parallel_workers", 0))
+    if n < 0:
+        n = multiprocessing.cpu_count()
+    return n
+
+
+def parallel_map(func, args_list, num_workers):
+    """Return [func(*args) for args in args_list], computed in a process pool if num_workers > 1.
+
+    The results are returned in the order of args_list, independently
+    of the order in which the worker processes finish. The function
+    must be defined at module level and its arguments and return values
+    must be picklable.
+    """
+    args_list = list(args_list)
+    num_workers = min(num_workers, len(args_list))
+    if num_workers <= 1:
+        return [func(*args) for args in args_list]
+
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        # Python 2 needs the 'futures' backport package
+        warning("Module concurrent.futures not available, compiling sequentially.")
+        return [func(*args) for args in args_list]
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(func, *args) for args in args_list]
+        return [f.result() for f in futures]
@@ -19,17 +19,20 @@
 """The FFC specific backend to the UFLACS form compiler algorithms."""
 
 from six import iteritems
+from six.moves import zip
 
 from ufl.algorithms import replace
+from ufl.classes import FormArgument
 from ufl.utils.sorting import sorted_by_count
 
 from ffc.log import ffc_assert
 
 from uflacs.params import default_parameters
 from uflacs.datastructures.arrays import object_array
-from uflacs.analysis.modified_terminals import analyse_modified_terminal
+from uflacs.analysis.modified_terminals import analyse_modified_terminal, cached_modified_terminal_analysis
 from uflacs.representation.compute_expr_ir import compute_expr_ir
 from uflacs.elementtables.terminaltables import build_element_tables, optimize_element_tables
+from uflacs.backends.ffc.parallel import parallel_map, num_parallel_workers
 
 
 def compute_uflacs_integral_ir(psi_tables, entitytype,
@@ -59,9 +62,10 @@ def compute_uflacs_integral_ir(psi_tables, entitytype,
         #uflacs_ir["coefficient_element"][f] = g.ufl_element()
         #uflacs_ir["coefficient_domain"][f] = g.ufl_domain()
 
-    # Build ir for each num_points/integrand
-    uflacs_ir["expr_ir"] = {}
-    for num_points in sorted(integrals_dict.keys()):
+    # Build ir for each num_points/integrand, optionally in parallel processes
+    all_num_points = sorted(integrals_dict.keys())
+    args_list = []
+    for num_points in all_num_points:
         integral = integrals_dict[num_points]
 
         # Get integrand
@@ -75,56 +79,108 @@ def compute_uflacs_integral_ir(psi_tables, entitytype,
         #       When coordinate field coefficient is removed I guess this issue will disappear?
         expr = replace(expr, form_data.function_replace_map) # FIXME: Still need to apply this mapping.
 
+        # Pass only the tables for this quadrature rule to keep the data sent to workers small
+        num_points_tables = {num_points: psi_tables[num_points]}
+        args_list.append((expr, num_points, num_points_tables, entitytype, parameters))
+
+    expr_irs = parallel_map(compute_uflacs_integrand_ir, args_list,
+                            num_parallel_workers(parameters))
+    uflacs_ir["expr_ir"] = dict(zip(all_num_points, expr_irs))
+
+    return uflacs_ir
+
+
+def compute_uflacs_integrand_ir(expr, num_points, psi_tables, entitytype, parameters):
+    """Build the uflacs ir for a single integrand expr evaluated in num_points quadrature points.
+
+    This is independent of other integrands and can be executed in a separate process.
+    """
+    # Analyse each modified terminal only once while building the ir
+    with cached_modified_terminal_analysis():
         # Build the core uflacs ir of expressions
         expr_ir = compute_expr_ir(expr, parameters)
-        uflacs_ir["expr_ir"][num_points] = expr_ir
-
-    for num_points in sorted(integrals_dict.keys()):
-        expr_ir = uflacs_ir["expr_ir"][num_points]
 
         # Build set of modified terminal ufl expressions
         V = expr_ir["V"]
         modified_terminals = [analyse_modified_terminal(V[i])
                               for i in expr_ir["modified_terminal_indices"]]
 
-        # Analyse modified terminals and store data about them
-        terminal_data = modified_terminals + expr_ir["modified_arguments"]
-
-        # Build tables needed by all modified terminals
-        # (currently build here means extract from ffc psi_tables)
-        #print '\n'.join([str(mt.expr) for mt in terminal_data])
-        tables, terminal_table_names = build_element_tables(psi_tables, num_points,
-                                                            entitytype, terminal_data)
-
-        # Optimize tables and get table name and dofrange for each modified terminal
-        unique_tables, terminal_table_ranges = optimize_element_tables(tables, terminal_table_names)
-        expr_ir["unique_tables"] = unique_tables
-
-        # Modify ranges for restricted form arguments (not geometry!)
-        # FIXME: Should not coordinate dofs get the same offset?
-        from ufl.classes import FormArgument
-        for i, mt in enumerate(terminal_data):
-            # TODO: Get the definition that - means added offset from somewhere
-            if mt.restriction == "-" and isinstance(mt.terminal, FormArgument):
-                # offset = number of dofs before table optimization
-                offset = int(tables[terminal_table_names[i]].shape[-1])
-                (unique_name, b, e) = terminal_table_ranges[i]
-                terminal_table_ranges[i] = (unique_name, b + offset, e + offset)
-
-        # Split into arguments and other terminals before storing in expr_ir
-        # TODO: Some tables are associated with num_points, some are not
-        #       (i.e. piecewise constant, averaged and x0)
-        n = len(expr_ir["modified_terminal_indices"])
-        m = len(expr_ir["modified_arguments"])
-        assert len(terminal_data) == n + m
-        assert len(terminal_table_ranges) == n + m
-        assert len(terminal_table_names) == n + m
-        expr_ir["modified_terminal_table_ranges"] = terminal_table_ranges[:n]
-        expr_ir["modified_argument_table_ranges"] = terminal_table_ranges[n:]
-
-        # Store table data in V indexing, this is used in integralgenerator
-        expr_ir["table_ranges"] = object_array(len(V))
-        expr_ir["table_ranges"][expr_ir["modified_terminal_indices"]] = \
-            expr_ir["modified_terminal_table_ranges"]
-
-    return uflacs_ir
+    # Store analysed modified terminals in V indexing, this is used in integralgenerator
+    expr_ir["modified_terminals"] = object_array(len(V))
+    for i, mt in zip(expr_ir["modified_terminal_indices"], modified_terminals):
+        expr_ir["modified_terminals"][i] = mt
+
+    # Analyse modified terminals and store data about them
+    terminal_data = modified_terminals + expr_ir["modified_arguments"]
+
+    # Build tables needed by all modified terminals
+    # (currently build here means extract from ffc psi_tables)
+    #print '\n'.join([str(mt.expr) for mt in terminal_data])
+    tables, terminal_table_names = build_element_tables(psi_tables, num_points,
+                                                        entitytype, terminal_data)
+
+    # Optimize tables and get table name and dofrange for each modified terminal
+    unique_tables, terminal_table_ranges = optimize_element_tables(tables, terminal_table_names)
+    expr_ir["unique_tables"] = unique_tables
+
+    # Modify ranges for restricted form arguments (not geometry!)
+    # FIXME: Should not coordinate dofs get the same offset?
+    for i, mt in enumerate(terminal_data):
+        # TODO: Get the definition that - means added offset from somewhere
+        if mt.restriction == "-" and isinstance(mt.terminal, FormArgument):
+            # offset = number of dofs before table optimization
+            offset = int(tables[terminal_table_names[i]].shape[-1])
+            (unique_name, b, e) = terminal_table_ranges[i]
+            terminal_table_ranges[i] = (unique_name, b + offset, e + offset)
+
+    # Split into arguments and other terminals before storing in expr_ir
+    # TODO: Some tables are associated with num_points, some are not
+    #       (i.e. piecewise constant, averaged and x0)
+    n = len(expr_ir["modified_terminal_indices"])
+    m = len(expr_ir["modified_arguments"])
+    assert len(terminal_data) == n + m
+    assert len(terminal_table_ranges) == n + m
+    assert len(terminal_table_names) == n + m
+    expr_ir["modified_terminal_table_ranges"] = terminal_table_ranges[:n]
+    expr_ir["modified_argument_table_ranges"] = terminal_table_ranges[n:]
+
+    # Use separate tables for the argument with quadrature weights folded into its tables
+    expr_ir["weighted_tables"] = build_weighted_tables(expr_ir)
+
+    # Store table data in V indexing, this is used in integralgenerator
+    expr_ir["table_ranges"] = object_array(len(V))
+    expr_ir["table_ranges"][expr_ir["modified_terminal_indices"]] = \
+        expr_ir["modified_terminal_table_ranges"]
+
+    return expr_ir
+
+
+def build_weighted_tables(expr_ir):
+    """Rename the tables of the weighted argument and return the tables to be weighted.
+
+    The values of the weighted tables are multiplied by the quadrature
+    weights in the generation phase where the weights are known.
+    Tables only used by the weighted argument are removed from unique_tables.
+
+    Returns a dict mapping weighted table names to unweighted table values.
+    """
+    weighted_tables = {}
+    if expr_ir["weighted_argument"] is None:
+        return weighted_tables
+
+    unique_tables = expr_ir["unique_tables"]
+    ranges = expr_ir["modified_argument_table_ranges"]
+    for i, mt in enumerate(expr_ir["modified_arguments"]):
+        if mt.terminal.number() == expr_ir["weighted_argument"] and ranges[i] is not None:
+            name, b, e = ranges[i]
+            wname = "{0}_W".format(name)
+            weighted_tables[wname] = unique_tables[name]
+            ranges[i] = (wname, b, e)
+
+    # Remove tables no longer used without weights
+    used = set(r[0] for r in expr_ir["modified_terminal_table_ranges"] if r is not None)
+    used.update(r[0] for r in ranges if r is not None)
+    for name in list(unique_tables):
+        if name not in used:
+            del unique_tables[name]
+    return weighted_tables
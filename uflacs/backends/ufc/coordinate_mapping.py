@@ -18,6 +18,19 @@
 
 from uflacs.backends.ufc.generator import ufc_generator
 
+# Cells where a degree 1 coordinate element gives an affine mapping
+affine_cells = ("interval", "triangle", "tetrahedron")
+
+# Defaults for the newton solver in compute_reference_coordinates,
+# tolerance is for |dX| in reference coordinates. The simplified
+# newton method only converges linearly and needs more iterations.
+default_newton_tolerance = 1e-12
+default_newton_max_iterations = 20
+default_simplified_newton_max_iterations = 100
+
+# Number of points solved for together in compute_reference_coordinates
+newton_block_size = 16
+
 ### Code generation utilities:
 
 def generate_compute_ATA(L, ATA, A, m, n, index_prefix=""):
@@ -98,6 +111,22 @@ def adj_expr_3x3(A):
              A[0, 1]*A[2, 0] - A[0, 0]*A[2, 1],
              A[0, 0]*A[1, 1] - A[0, 1]*A[1, 0]]]
 
+def generate_assign_determinant(L, detJ, J, gdim, tdim, cell_orientation):
+    "Generate code to assign the (pseudo-)determinant of J to detJ."
+    # TODO: Call Eigen instead?
+    if gdim == tdim:
+        return L.Assign(detJ, det_nn(J, gdim))
+    elif tdim == 1:
+        return L.Assign(detJ, cell_orientation*pdet_m1(L, J, gdim))
+    #elif tdim == 2 and gdim == 3:
+    #    return L.Assign(detJ, cell_orientation*pdet_32(A)) # Possible optimization not implemented here
+    else:
+        JTJ = L.Symbol("JTJ")
+        return L.Scope([
+            generate_compute_ATA(L, JTJ, J, gdim, tdim),
+            L.Assign(detJ, cell_orientation*L.Call("sqrt", det_nn(JTJ, tdim))),
+            ])
+
 def generate_assign_inverse(L, K, J, detJ, gdim, tdim):
     if gdim == tdim:
         if gdim == 1:
@@ -148,6 +177,44 @@ def generate_assign_inverse(L, K, J, detJ, gdim, tdim):
                 ]
             return L.StatementList(code)
 
+def generate_geometry_from_basis(L, x, J, detJ, K, phi, dphi, coordinate_dofs,
+                                 num_dofs, gdim, tdim, cell_orientation):
+    """Generate code to compute x, J, detJ, K at one point from coordinate element basis values phi[d] and derivatives dphi[j, d].
+
+    If J is None, only x is computed.
+    """
+    # Loop indices
+    i = L.Symbol("i")
+    j = L.Symbol("j")
+    d = L.Symbol("d")
+
+    if J is None:
+        return L.StatementList([
+            L.ForRange(i, 0, gdim, body=L.Assign(x[i], 0.0)),
+            L.ForRange(d, 0, num_dofs, body=
+                L.ForRange(i, 0, gdim, body=
+                    L.AssignAdd(x[i], coordinate_dofs[d, i]*phi[d]))),
+            ])
+
+    # Accumulate x and J in a single loop over the coordinate dofs
+    code = [
+        L.Comment("Compute x and J"),
+        L.ForRange(i, 0, gdim, body=L.StatementList([
+            L.Assign(x[i], 0.0),
+            L.ForRange(j, 0, tdim, body=L.Assign(J[i, j], 0.0)),
+            ])),
+        L.ForRange(d, 0, num_dofs, body=
+            L.ForRange(i, 0, gdim, body=L.StatementList([
+                L.AssignAdd(x[i], coordinate_dofs[d, i]*phi[d]),
+                L.ForRange(j, 0, tdim, body=
+                    L.AssignAdd(J[i, j], coordinate_dofs[d, i]*dphi[j, d])),
+                ]))),
+        L.Comment("Compute detJ and K"),
+        generate_assign_determinant(L, detJ, J, gdim, tdim, cell_orientation),
+        generate_assign_inverse(L, K, J, detJ, gdim, tdim),
+        ]
+    return L.StatementList(code)
+
 
 class ufc_coordinate_mapping(ufc_generator):
     def __init__(self):
@@ -227,6 +294,7 @@ class ufc_coordinate_mapping(ufc_generator):
                 L.Comment("Compute basis values of coordinate element"),
                 L.Call(func, args),
                 L.Comment("Compute x"),
+                L.ForRange(i, 0, gdim, body=L.Assign(x[ip, i], 0.0)),
                 L.ForRange(i, 0, gdim, body=
                     L.ForRange(d, 0, num_dofs, body=
                         L.AssignAdd(x[ip, i], coordinate_dofs[d, i]*phi[d]))),
@@ -236,7 +304,8 @@ class ufc_coordinate_mapping(ufc_generator):
 
     def compute_reference_coordinates(self, L, ir):
         degree = ir["coordinate_element_degree"]
-        if degree == 1:
+        cellname = ir["cell_shape"]
+        if degree == 1 and cellname in affine_cells:
             # Special case optimized for affine mesh (possibly room for further optimization)
             return self._compute_reference_coordinates_affine(L, ir)
         else:
@@ -244,6 +313,11 @@ class ufc_coordinate_mapping(ufc_generator):
             return self._compute_reference_coordinates_newton(L, ir)
 
     def _compute_reference_coordinates_affine(self, L, ir): # TODO: Test!
+        """Computes X = K0 (x - x0) in closed form.
+
+        The mapping is affine, so x0 = x(X=0) and K0 = inverse(J)
+        are computed once for the cell and reused for all points.
+        """
         # Dimensions
         gdim = ir["geometric_dimension"]
         tdim = ir["topological_dimension"]
@@ -267,6 +341,7 @@ class ufc_coordinate_mapping(ufc_generator):
 
         # Input cell data
         coordinate_dofs = L.FlattenedArray(L.Symbol("coordinate_dofs"), dims=(num_dofs, gdim))
+        cell_orientation = L.Symbol("cell_orientation")
 
         # Tables of coordinate basis function values and derivatives at
         # X=0 and X=midpoint available through ir. This is useful in
@@ -313,24 +388,25 @@ class ufc_coordinate_mapping(ufc_generator):
         K0 = L.Symbol("K0")
         compute_K0 = [
             L.ArrayDecl("double", detJ0, sizes=(1,)),
-            L.Call("compute_jacobian_determinants", (detJ0, 1, J0)),
+            L.Call("compute_jacobian_determinants", (detJ0, 1, J0, cell_orientation)),
             L.ArrayDecl("double", K0, sizes=(tdim*gdim,)),
             L.Call("compute_jacobian_inverses", (K0, 1, J0, detJ0)),
             ]
+        K0f = L.FlattenedArray(K0, dims=(tdim, gdim))
 
         # Compute X = K0*(x-x0) for each physical point x
         compute_X = [
             L.ForRange(ip, 0, num_points, body=
                 L.ForRange(j, 0, tdim, body=
-                    L.ForRange(i, 0, gdim, body=
-                        L.AssignAdd(X[ip, j], K0[j, i]*(x[ip, i] - x0[i]))))),
+                    L.Assign(X[ip, j], L.Sum([K0f[j, ii]*(x[ip, ii] - x0[ii])
+                                              for ii in range(gdim)])))),
             ]
 
         # Stitch it together
         code = L.StatementList(table_decls + compute_x0 + compute_J0 + compute_K0 + compute_X)
         return code
 
-    def _compute_reference_coordinates_newton(self, L, ir): # TODO: Test! TODO: Determine stopping criteria to use.
+    def _compute_reference_coordinates_newton(self, L, ir): # TODO: Test!
         """Solves x(X) = x0 for X.
 
         Find X such that, given x0,
@@ -364,6 +440,22 @@ class ufc_coordinate_mapping(ufc_generator):
                 dX = Kk (x0 - xk)
                 Xk += dX
                 if dX sufficiently small: break
+
+        The points are processed in blocks. All points start at the
+        midpoint, where x and K are computed once for the cell from
+        tabulated basis values. In each iteration, the coordinate
+        element basis is evaluated in one call for all points in the
+        block that have not yet converged, and converged points are
+        dropped. If any point has not converged within the maximal
+        number of iterations, a std::runtime_error is thrown.
+
+        The solver can be configured by the optional ir entries
+        "newton_simplified", "newton_tolerance" and
+        "newton_max_iterations". These are not produced by the
+        representation stage, callers add them to the ir to override
+        the module level defaults. With ir["newton_simplified"] the
+        initial K at the midpoint is reused in all iterations and only
+        x(Xk) is evaluated, with a larger default iteration limit.
         """
         # Dimensions
         gdim = ir["geometric_dimension"]
@@ -371,20 +463,33 @@ class ufc_coordinate_mapping(ufc_generator):
         cellname = ir["cell_shape"]
         num_points = L.Symbol("num_points")
 
-        degree = ir["coordinate_element_degree"]
+        # Number of dofs for a scalar component
+        num_dofs = ir["num_scalar_coordinate_element_dofs"]
 
-        # Computing table one point at a time instead of vectorized
-        # over num_points will allow skipping dynamic allocation
-        one_point = 1
+        # Variables for stopping criteria, optionally supplied by the caller in ir
+        simplified = ir.get("newton_simplified", False)
+        tolerance = ir.get("newton_tolerance", default_newton_tolerance)
+        if simplified:
+            max_iter = ir.get("newton_max_iterations", default_simplified_newton_max_iterations)
+        else:
+            max_iter = ir.get("newton_max_iterations", default_newton_max_iterations)
+
+        # Call static functions on element class, matching compute_geometry
+        scalar_coordinate_element_classname = ir["scalar_coordinate_finite_element_classname"]
+        values_func = "%s::_evaluate_reference_basis" % (scalar_coordinate_element_classname,)
+        derivatives_func = "%s::_evaluate_reference_basis_derivatives" % (scalar_coordinate_element_classname,)
 
         # Loop indices
-        ip = L.Symbol("ip") # point
-        i = L.Symbol("i")   # gdim
-        j = L.Symbol("j")   # tdim
-        k = L.Symbol("k")   # iteration
+        ip0 = L.Symbol("ip0") # first point in block
+        ib = L.Symbol("ib")   # point in block
+        a = L.Symbol("a")     # active point in block
+        i = L.Symbol("i")     # gdim
+        j = L.Symbol("j")     # tdim
+        k = L.Symbol("k")     # iteration
+        d = L.Symbol("d")     # dof
 
         # Input cell data
-        coordinate_dofs = L.Symbol("coordinate_dofs")
+        coordinate_dofs = L.FlattenedArray(L.Symbol("coordinate_dofs"), dims=(num_dofs, gdim))
         cell_orientation = L.Symbol("cell_orientation")
 
         # Output geometry
@@ -393,114 +498,166 @@ class ufc_coordinate_mapping(ufc_generator):
         # Input geometry
         x = L.FlattenedArray(L.Symbol("x"), dims=(num_points, gdim))
 
-        # Find X=Xk such that xk(Xk) = x or F(Xk) = xk(Xk) - x = 0.
-        # Newtons method is then:
-        #   X0 = cell midpoint
-        #   dF/dX dX = -F
-        #   Xk = Xk + dX
-        # Note that
-        #   dF/dX = dx/dX = J
-        # giving
-        #   inverse(dF/dX) = K
-        # such that dX = -K*(xk(Xk) - x)
-
-        # Newtons method is then:
-        # for each ip:
-        #   xgoal = x[ip]
-        #   X0 = cell midpoint
-        #   until convergence:
-        #       K = K(Xk)
-        #       dX = K*(xk(Xk) - x)
-        #       Xk -= dX
-        #   X[ip] = Xk
-
-        # Symbols for arrays used below
-        Xk = L.Symbol("Xk")
-        xgoal = L.Symbol("xgoal")
-        dX = L.Symbol("dX")
-        xk = L.Symbol("xk")
-        J = L.Symbol("J")
-        detJ = L.Symbol("detJ")
-        K = L.Symbol("K")
-
         # Symbol for ufc_geometry cell midpoint definition
         mp = L.Symbol("%s_midpoint" % cellname)
 
-        # Variables for stopping criteria
-        # TODO: Check if these are good convergence criteria, e.g. is epsilon=1e-6 and iterations=degree sufficient?
-        max_iter = L.LiteralInt(2*degree)
-        epsilon = L.LiteralFloat(1e-14)
-        # TODO: Could also easily make criteria input if desired
-        #max_iter = L.Symbol("iterations")
-        #epsilon = L.Symbol("epsilon")
-        dX2 = L.Symbol("dX2")
-
-        # Wrap K as flattened array for convenient indexing Kf[j,i]
-        Kf = L.FlattenedArray(K, dims=(tdim, gdim))
-
-        # declare xgoal = x[ip]
-        # declare Xk = initial value
-        newton_init = [
-            L.Comment("Declare xgoal to hold the current x coordinate value"),
-            L.ArrayDecl("const double", xgoal, (gdim,), values=[x[ip][iv] for iv in range(gdim)]),
-            L.Comment("Declare Xk iterate with initial value equal to reference cell midpoint"),
-            L.ArrayDecl("double", Xk, (tdim,), values=[mp[c] for c in range(tdim)]),
+        # Tables of coordinate basis function values and derivatives at midpoint
+        tables = ir["tables"]
+        assert tables["xm"].shape == (num_dofs,)
+        assert tables["Jm"].shape == (tdim, num_dofs)
+        phi_Xm = L.Symbol("phi_Xm")
+        dphi_Xm = L.Symbol("dphi_Xm")
+        table_decls = [
+            L.ArrayDecl("static const double", phi_Xm, sizes=tables["xm"].shape, values=tables["xm"]),
+            L.ArrayDecl("static const double", dphi_Xm, sizes=tables["Jm"].shape, values=tables["Jm"]),
             ]
 
-        # TODO: Use ir["tables"]["xm|Jm"] to compute x(Xm) and J(Xm) for an optimized first iteration
-
-        part1 = [
-            L.Comment("Declare intermediate arrays to hold results of compute_geometry call"),
-            L.ArrayDecl("double", xk, (gdim,)),
-            L.ArrayDecl("double", J, (gdim*tdim,)),
-            L.ArrayDecl("double", detJ, (1,)),
-            L.ArrayDecl("double", K, (tdim*gdim,)),
+        # Compute xm = x(Xm), Jm = J(Xm) and Km = inverse(Jm) once for the cell
+        xm = L.Symbol("xm")
+        Jm = L.Symbol("Jm")
+        detJm = L.Symbol("detJm")
+        Km = L.Symbol("Km")
+        compute_midpoint_geometry = [
+            L.Comment("Compute geometry at the reference cell midpoint, the initial iterate of all points"),
+            L.ArrayDecl("double", xm, sizes=(gdim,), values=0),
+            L.ForRange(i, 0, gdim, body=
+                L.ForRange(d, 0, num_dofs, body=
+                    L.AssignAdd(xm[i], coordinate_dofs[d, i] * phi_Xm[d]))),
+            L.ArrayDecl("double", Jm, sizes=(gdim*tdim,), values=0),
+            L.ForRange(i, 0, gdim, body=
+                L.ForRange(j, 0, tdim, body=
+                    L.ForRange(d, 0, num_dofs, body=
+                        L.AssignAdd(Jm[i*tdim + j], coordinate_dofs[d, i] * dphi_Xm[j, d])))),
+            L.ArrayDecl("double", detJm, sizes=(1,)),
+            L.Call("compute_jacobian_determinants", (detJm, 1, Jm, cell_orientation)),
+            L.ArrayDecl("double", Km, sizes=(tdim*gdim,)),
+            L.Call("compute_jacobian_inverses", (Km, 1, Jm, detJm)),
+            ]
 
-            L.Comment("Compute K = J^-1 for one point, (J and detJ are only used as"),
-            L.Comment("intermediate storage inside compute_geometry, not used out here"),
-            L.Call("compute_geometry",
-                   (xk, J, detJ, K, one_point,
-                    Xk, coordinate_dofs, cell_orientation)),
+        # Block arrays, indexed by point in block (Xk) or by active point (Xa, xa, phi, dphi, Ja, detJa, Ka)
+        block_size = newton_block_size
+        num_block_points = L.Symbol("num_block_points")
+        num_active = L.Symbol("num_active")
+        num_unconverged = L.Symbol("num_unconverged")
+        active = L.Symbol("active")
+        Xk = L.Symbol("Xk")
+        Xa = L.Symbol("Xa")
+        xa = L.Symbol("xa")
+        Ja = L.Symbol("Ja")
+        detJa = L.Symbol("detJa")
+        Ka = L.Symbol("Ka")
+        phi = L.Symbol("phi")
+        dphi = L.Symbol("dphi")
+        Xkf = L.FlattenedArray(Xk, dims=(block_size, tdim))
+        Xaf = L.FlattenedArray(Xa, dims=(block_size, tdim))
+        xaf = L.FlattenedArray(xa, dims=(block_size, gdim))
+        Jaf = L.FlattenedArray(Ja, dims=(block_size, gdim, tdim))
+        Kaf = L.FlattenedArray(Ka, dims=(block_size, tdim, gdim))
+        Kmf = L.FlattenedArray(Km, dims=(tdim, gdim))
+        phif = L.FlattenedArray(phi, dims=(block_size, num_dofs))
+        dphif = L.FlattenedArray(dphi, dims=(block_size, tdim, num_dofs))
+        block_decls = [
+            L.ArrayDecl("int", active, (block_size,)),
+            L.ArrayDecl("double", Xk, (block_size*tdim,)),
+            L.ArrayDecl("double", Xa, (block_size*tdim,)),
+            L.ArrayDecl("double", xa, (block_size*gdim,)),
+            L.ArrayDecl("double", phi, (block_size*num_dofs,)),
             ]
+        if not simplified:
+            block_decls += [
+                L.ArrayDecl("double", dphi, (block_size*tdim*num_dofs,)),
+                L.ArrayDecl("double", Ja, (block_size*gdim*tdim,)),
+                L.ArrayDecl("double", detJa, (block_size,)),
+                L.ArrayDecl("double", Ka, (block_size*tdim*gdim,)),
+                ]
 
-        # Newton body with stopping criteria |dX|^2 < epsilon
-        newton_body = part1 + [
-            L.Comment("Declare dX increment to be computed, initialized to zero"),
-            L.ArrayDecl("double", dX, (tdim,), values=0.0),
+        # Start all points at the midpoint
+        init_body = [
+            L.Assign(active[ib], ib),
+            L.ForRange(j, 0, tdim, body=L.Assign(Xkf[ib, j], mp[j])),
+            L.ForRange(i, 0, gdim, body=L.Assign(xaf[ib, i], xm[i])),
+            ]
+        if not simplified:
+            init_body += [
+                L.ForRange(j, 0, tdim, body=
+                    L.ForRange(i, 0, gdim, body=
+                        L.Assign(Kaf[ib, j, i], Kmf[j, i]))),
+                ]
+        newton_init = [
+            L.VariableDecl("int", num_active, num_block_points),
+            L.ForRange(ib, 0, num_block_points, body=L.StatementList(init_body)),
+            ]
 
+        # Newton update of each active point, compacting the list of unconverged points
+        K = Kmf if simplified else Kaf[a]
+        dX = L.Symbol("dX")
+        dX2 = L.Symbol("dX2")
+        ip = ip0 + L.Symbol("ib")
+        update_body = [
+            L.VariableDecl("const int", ib, active[a]),
             L.Comment("Compute dX[j] = sum_i K_ji * (x_i - x(Xk)_i)"),
-            L.ForRange(j, 0, tdim, body=
-                       L.ForRange(i, 0, gdim, body=
-                                  L.AssignAdd(dX[j], Kf[j,i]*(xgoal[i] - xk[i])))),
-
-            L.Comment("Compute |dX|^2"),
-            L.VariableDecl("double", dX2, value=0.0),
-            L.ForRange(j, 0, tdim, body=L.AssignAdd(dX2, dX[j]*dX[j])),
-
-            L.Comment("Break if converged (before X += dX such that X,J,detJ,K are consistent)"),
-            L.If(L.LT(dX2, epsilon), L.Break()),
-
+            L.ArrayDecl("double", dX, (tdim,), values=[
+                L.Sum([K[jj, ii] * (x[ip, ii] - xaf[a, ii]) for ii in range(gdim)])
+                for jj in range(tdim)]),
             L.Comment("Update Xk += dX"),
-            L.ForRange(j, 0, tdim, body=L.AssignAdd(Xk[j], dX[j])),
+            L.ForRange(j, 0, tdim, body=L.AssignAdd(Xkf[ib, j], dX[j])),
+            L.Comment("Keep point if not converged, i.e. |dX|^2 >= tolerance^2"),
+            L.VariableDecl("const double", dX2, L.Sum([dX[jj]*dX[jj] for jj in range(tdim)])),
+            L.If(L.GE(dX2, tolerance*tolerance),
+                 L.Assign(active[L.PostIncrement(num_unconverged)], ib)),
             ]
 
-        # Use this instead for fixed iteration number
-        alternative_newton_body = part1 + [
-            L.Comment("Compute Xk[j] += sum_i K_ji * (x_i - x(Xk)_i)"),
-            L.ForRange(j, 0, tdim, body=
-                       L.ForRange(i, 0, gdim, body=
-                                  L.AssignAdd(Xk[j], Kf[j,i]*(xgoal[i] - xk[i])))),
+        # Evaluate the coordinate element basis at all unconverged points in one call
+        evaluate_code = [
+            L.ForRange(a, 0, num_active, body=
+                L.ForRange(j, 0, tdim, body=
+                    L.Assign(Xaf[a, j], Xkf[active[a], j]))),
+            L.Call(values_func, (phi, num_active, Xa)),
             ]
+        if simplified:
+            evaluate_code += [
+                L.ForRange(a, 0, num_active, body=
+                    generate_geometry_from_basis(L, xaf[a], None, None, None, phif[a], None,
+                                                 coordinate_dofs, num_dofs, gdim, tdim, cell_orientation)),
+                ]
+        else:
+            evaluate_code += [
+                L.Call(derivatives_func, (dphi, num_active, Xa)),
+                L.ForRange(a, 0, num_active, body=
+                    generate_geometry_from_basis(L, xaf[a], Jaf[a], detJa[a], Kaf[a], phif[a], dphif[a],
+                                                 coordinate_dofs, num_dofs, gdim, tdim, cell_orientation)),
+                ]
 
-        # Loop until convergence
-        newton_loop = L.ForRange(k, 0, max_iter, body=newton_body)
+        newton_loop = L.ForRange(k, 0, max_iter, body=L.StatementList([
+            L.VariableDecl("int", num_unconverged, 0),
+            L.ForRange(a, 0, num_active, body=L.StatementList(update_body)),
+            L.Assign(num_active, num_unconverged),
+            L.Comment("Stop when all points in block have converged"),
+            L.If(L.Or(L.EQ(num_active, 0), L.EQ(k, max_iter - 1)), L.Break()),
+            L.Comment("Evaluate x(Xk)%s at unconverged points" % ("" if simplified else " and K(Xk)")),
+            evaluate_code,
+            ]))
 
-        # X[ip] = Xk
-        newton_finish = L.ForRange(j, 0, tdim, body=L.Assign(X[ip][j], Xk[j]))
+        # Points still active after the last iteration have not converged
+        newton_check = L.If(L.GT(num_active, 0),
+            L.Throw("std::runtime_error", "compute_reference_coordinates: Newton solver did not converge"))
 
-        # Carry out newton loop for each point
-        code = L.ForRange(ip, 0, num_points,
-                          body=L.StatementList([newton_init, newton_loop, newton_finish]))
+        # X[ip] = Xk
+        newton_finish = L.ForRange(ib, 0, num_block_points, body=
+            L.ForRange(j, 0, tdim, body=L.Assign(X[ip, j], Xkf[ib, j])))
+
+        # Carry out newton loop for each block of points
+        code = L.StatementList(table_decls + compute_midpoint_geometry + block_decls + [
+            L.For(L.VariableDecl("int", ip0, 0), L.LT(ip0, num_points), L.AssignAdd(ip0, block_size),
+                  body=L.StatementList([
+                L.VariableDecl("const int", num_block_points,
+                               L.Conditional(L.LT(num_points - ip0, block_size), num_points - ip0, block_size)),
+                newton_init,
+                newton_loop,
+                newton_check,
+                newton_finish,
+                ]))
+            ])
         return code
 
     def compute_jacobians(self, L, ir): # FIXME: Implement evaluate_reference_basis_derivatives
@@ -555,6 +712,9 @@ class ufc_coordinate_mapping(ufc_generator):
                 L.Comment("Compute basis derivatives of coordinate element"),
                 L.Call(func, args),
                 L.Comment("Compute J"),
+                L.ForRange(i, 0, gdim, body=
+                    L.ForRange(j, 0, tdim, body=
+                        L.Assign(J[ip, i, j], 0.0))),
                 L.ForRange(i, 0, gdim, body=
                     L.ForRange(j, 0, tdim, body=
                         L.ForRange(d, 0, num_dofs, body=
@@ -579,19 +739,8 @@ class ufc_coordinate_mapping(ufc_generator):
         J = L.FlattenedArray(L.Symbol("J"), dims=(num_points, gdim, tdim))
         cell_orientation = L.Symbol("cell_orientation")
 
-        # Assign det expression to detJ # TODO: Call Eigen instead?
-        if gdim == tdim:
-            body = L.Assign(detJ, det_nn(J[ip], gdim))
-        elif tdim == 1:
-            body = L.Assign(detJ, cell_orientation*pdet_m1(A, gdim))
-        #elif tdim == 2 and gdim == 3:
-        #    body = L.Assign(detJ, cell_orientation*pdet_32(A)) # Possible optimization not implemented here
-        else:
-            JTJ = L.Symbol("JTJ")
-            body = L.StatementList([
-                generate_compute_ATA(L, JTJ, J[ip], gdim, tdim),
-                L.Assign(detJ, cell_orientation*L.Call("sqrt", det_nn(JTJ, tdim))),
-                ])
+        # Assign det expression to detJ
+        body = generate_assign_determinant(L, detJ, J[ip], gdim, tdim, cell_orientation)
 
         # Carry out for all points
         loop = L.ForRange(ip, 0, num_points, body=body)
@@ -621,31 +770,157 @@ class ufc_coordinate_mapping(ufc_generator):
         # Carry out for all points
         return L.ForRange(ip, 0, num_points, body=body)
 
-    def compute_geometry(self, L, ir): # Output looks good on inspection. TODO: Test!
+    def compute_geometry(self, L, ir):
+        degree = ir["coordinate_element_degree"]
+        cellname = ir["cell_shape"]
+        if degree == 1 and cellname in affine_cells:
+            # Special case with constant J, detJ and K computed once per cell
+            return self._compute_geometry_affine(L, ir)
+        else:
+            # General case evaluating the coordinate element at each point
+            return self._compute_geometry_nonaffine(L, ir)
+
+    def _compute_geometry_affine(self, L, ir):
+        """Computes x, J, detJ, K for an affine cell in one pass.
+
+        J, detJ and K are computed once from the tabulated basis
+        derivatives at X=0 and copied to each point, and x = x0 + J X.
+        """
+        # Dimensions
+        gdim = ir["geometric_dimension"]
+        tdim = ir["topological_dimension"]
+        num_points = L.Symbol("num_points")
+        num_dofs = ir["num_scalar_coordinate_element_dofs"]
+
+        # Loop indices
+        ip = L.Symbol("ip")
+        i = L.Symbol("i")
+        j = L.Symbol("j")
+        d = L.Symbol("d")
+
         # Output geometry
-        x = L.Symbol("x")
-        J = L.Symbol("J")
+        x = L.FlattenedArray(L.Symbol("x"), dims=(num_points, gdim))
+        J = L.FlattenedArray(L.Symbol("J"), dims=(num_points, gdim, tdim))
         detJ = L.Symbol("detJ")
-        K = L.Symbol("K")
+        K = L.FlattenedArray(L.Symbol("K"), dims=(num_points, tdim, gdim))
+
+        # Input geometry
+        X = L.FlattenedArray(L.Symbol("X"), dims=(num_points, tdim))
+
+        # Input cell data
+        coordinate_dofs = L.FlattenedArray(L.Symbol("coordinate_dofs"), dims=(num_dofs, gdim))
+        cell_orientation = L.Symbol("cell_orientation")
+
+        # Tables of coordinate basis function values and derivatives at X=0
+        tables = ir["tables"]
+        assert tables["x0"].shape == (num_dofs,)
+        assert tables["J0"].shape == (tdim, num_dofs)
+        phi_X0 = L.Symbol("phi_X0")
+        dphi_X0 = L.Symbol("dphi_X0")
+        table_decls = [
+            L.ArrayDecl("static const double", phi_X0, sizes=tables["x0"].shape, values=tables["x0"]),
+            L.ArrayDecl("static const double", dphi_X0, sizes=tables["J0"].shape, values=tables["J0"]),
+            ]
+
+        # Compute constant geometry x0 = x(X=0), J0, detJ0 and K0
+        x0 = L.Symbol("x0")
+        J0 = L.Symbol("J0")
+        detJ0 = L.Symbol("detJ0")
+        K0 = L.Symbol("K0")
+        J0f = L.FlattenedArray(J0, dims=(gdim, tdim))
+        K0f = L.FlattenedArray(K0, dims=(tdim, gdim))
+        compute_cell_geometry = [
+            L.Comment("Compute constant geometry of affine cell"),
+            L.ArrayDecl("double", x0, sizes=(gdim,), values=0),
+            L.ArrayDecl("double", J0, sizes=(gdim*tdim,), values=0),
+            L.ForRange(d, 0, num_dofs, body=
+                L.ForRange(i, 0, gdim, body=L.StatementList([
+                    L.AssignAdd(x0[i], coordinate_dofs[d, i] * phi_X0[d]),
+                    L.ForRange(j, 0, tdim, body=
+                        L.AssignAdd(J0f[i, j], coordinate_dofs[d, i] * dphi_X0[j, d])),
+                    ]))),
+            L.VariableDecl("double", detJ0),
+            generate_assign_determinant(L, detJ0, J0f, gdim, tdim, cell_orientation),
+            L.ArrayDecl("double", K0, sizes=(tdim*gdim,)),
+            generate_assign_inverse(L, K0f, J0f, detJ0, gdim, tdim),
+            ]
+
+        # Compute x = x0 + J0 X and copy J0, detJ0 and K0 for each point
+        point_body = [
+            L.Assign(x[ip, ii], x0[ii] + L.Sum([J0f[ii, jj]*X[ip, jj] for jj in range(tdim)]))
+            for ii in range(gdim)
+            ]
+        point_body += [
+            L.ForRange(i, 0, gdim, body=
+                L.ForRange(j, 0, tdim, body=
+                    L.Assign(J[ip, i, j], J0f[i, j]))),
+            L.Assign(detJ[ip], detJ0),
+            L.ForRange(j, 0, tdim, body=
+                L.ForRange(i, 0, gdim, body=
+                    L.Assign(K[ip, j, i], K0f[j, i]))),
+            ]
+
+        code = L.StatementList(table_decls + compute_cell_geometry + [
+            L.ForRange(ip, 0, num_points, body=L.StatementList(point_body))
+            ])
+        return code
+
+    def _compute_geometry_nonaffine(self, L, ir):
+        """Computes x, J, detJ, K for a general cell in one pass.
+
+        The coordinate element basis values and derivatives are
+        evaluated once per point, then x and J are accumulated
+        in a single loop over the coordinate dofs and detJ and K
+        are computed from J directly.
+        """
+        num_dofs = ir["num_scalar_coordinate_element_dofs"]
+        scalar_coordinate_element_classname = ir["scalar_coordinate_finite_element_classname"]
 
         # Dimensions
+        gdim = ir["geometric_dimension"]
+        tdim = ir["topological_dimension"]
         num_points = L.Symbol("num_points")
 
+        # Loop index
+        ip = L.Symbol("ip")
+
+        # Output geometry
+        x = L.FlattenedArray(L.Symbol("x"), dims=(num_points, gdim))
+        J = L.FlattenedArray(L.Symbol("J"), dims=(num_points, gdim, tdim))
+        detJ = L.Symbol("detJ")
+        K = L.FlattenedArray(L.Symbol("K"), dims=(num_points, tdim, gdim))
+
         # Input geometry
-        X = L.Symbol("X")
+        X = L.FlattenedArray(L.Symbol("X"), dims=(num_points, tdim))
 
         # Input cell data
-        coordinate_dofs = L.Symbol("coordinate_dofs")
+        coordinate_dofs = L.FlattenedArray(L.Symbol("coordinate_dofs"), dims=(num_dofs, gdim))
         cell_orientation = L.Symbol("cell_orientation")
 
-        # All arguments
-        args = (x, J, detJ, K, num_points, X, coordinate_dofs, cell_orientation)
+        # Computing table one point at a time instead of using
+        # num_points will allow skipping dynamic allocation
+        one_point = 1
+
+        # Call static functions on element class, matching compute_physical_coordinates and compute_jacobians
+        values_func = "%s::_evaluate_reference_basis" % (scalar_coordinate_element_classname,)
+        derivatives_func = "%s::_evaluate_reference_basis_derivatives" % (scalar_coordinate_element_classname,)
 
-        # Just chain calls to other functions here
-        code = [
-            L.Call("compute_physical_coordinates", (x, num_points, X, coordinate_dofs, cell_orientation)),
-            L.Call("compute_jacobians", (J, num_points, X, coordinate_dofs, cell_orientation)),
-            L.Call("compute_jacobian_determinants", (detJ, num_points, J)),
-            L.Call("compute_jacobian_inverses", (K, num_points, J, detJ)),
-            ]
-        return L.StatementList(code)
+        # Symbols for local basis values and derivatives tables
+        phi_sym = L.Symbol("phi")
+        dphi_sym = L.Symbol("dphi")
+        phi = L.FlattenedArray(phi_sym, dims=(num_dofs,)) # FIXME: Match evaluate_reference_basis array layout
+        dphi = L.FlattenedArray(dphi_sym, dims=(tdim, num_dofs)) # FIXME: Match array layout of evaluate_reference_basis_derivatives
+
+        # For each point, evaluate the basis once and compute all geometry
+        code = L.StatementList([
+            L.ArrayDecl("double", phi_sym, (one_point*num_dofs,)),
+            L.ArrayDecl("double", dphi_sym, (one_point*tdim*num_dofs,)),
+            L.ForRange(ip, 0, num_points, body=L.StatementList([
+                L.Comment("Compute basis values and derivatives of coordinate element"),
+                L.Call(values_func, (phi_sym, one_point, L.AddressOf(X[ip, 0]))),
+                L.Call(derivatives_func, (dphi_sym, one_point, L.AddressOf(X[ip, 0]))),
+                generate_geometry_from_basis(L, x[ip], J[ip], detJ[ip], K[ip], phi, dphi,
+                                             coordinate_dofs, num_dofs, gdim, tdim, cell_orientation),
+                ]))
+            ])
+        return code
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2015 Martin Sandve Alnæs
+#
+# This file is part of UFLACS.
+#
+# UFLACS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UFLACS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
+
+"""Detection and aliasing of structurally identical ufc classes.
+
+Mixed elements often contain many identical subelements, and
+generating a full class for each of them produces identical
+function bodies many times over. This module computes a structural
+signature for generator ir, used by ufc_generator.generate_to_streams
+to emit code for one representative of each group of identical ir
+objects, with C++ typedefs for the rest.
+"""
+
+import hashlib
+
+import numpy
+
+from six import iteritems, string_types
+
+
+def _canonical(value, aliases):
+    "Build a hashable canonical representation of an ir value."
+    if isinstance(value, string_types):
+        return aliases.get(value, value)
+    elif isinstance(value, dict):
+        return ("dict",) + tuple(sorted((repr(k), _canonical(v, aliases)) for k, v in iteritems(value)))
+    elif isinstance(value, (list, tuple)):
+        return ("seq",) + tuple(_canonical(v, aliases) for v in value)
+    elif isinstance(value, numpy.ndarray):
+        return ("array", value.dtype.str, value.shape, tuple(value.flat))
+    else:
+        return repr(value)
+
+
+def ir_structural_signature(ir, aliases=None, ignore=("classname",)):
+    """Compute a signature string for ir, ignoring the given keys.
+
+    Strings found in aliases (mapping classname -> classname) are
+    replaced before computing the signature, such that classes
+    referring to equivalent subclasses get the same signature.
+    """
+    aliases = aliases or {}
+    items = dict((k, v) for k, v in iteritems(ir) if k not in ignore)
+    canonical = _canonical(items, aliases)
+    return hashlib.sha1(repr(canonical).encode("utf-8")).hexdigest()
+
+
+def _substitute_aliases(value, aliases):
+    "Return a copy of ir value with aliased classnames replaced."
+    if isinstance(value, string_types):
+        return aliases.get(value, value)
+    elif isinstance(value, dict):
+        return dict((k, _substitute_aliases(v, aliases)) for k, v in iteritems(value))
+    elif isinstance(value, list):
+        return [_substitute_aliases(v, aliases) for v in value]
+    elif isinstance(value, tuple):
+        return tuple(_substitute_aliases(v, aliases) for v in value)
+    else:
+        return value
+
+
+def deduplicate_irs(irs):
+    """Find groups of structurally identical ir objects.
+
+    Returns (unique_irs, aliases), where unique_irs is a list of the
+    first ir of each group in the original order, with references to
+    aliased classnames replaced, and aliases maps the classname of each
+    removed ir to the classname of its representative.
+
+    Identifying two classes may make their parents identical, so this
+    is repeated until no more aliases are found.
+    """
+    irs = list(irs)
+    aliases = {}
+    while True:
+        representatives = {}
+        new_aliases = {}
+        for ir in irs:
+            classname = ir["classname"]
+            if classname in aliases:
+                continue
+            sig = ir_structural_signature(ir, aliases)
+            target = representatives.setdefault(sig, classname)
+            if target != classname:
+                new_aliases[classname] = target
+        if not new_aliases:
+            break
+        aliases.update(new_aliases)
+        # Resolve chains of aliases, a representative may itself have become an alias
+        for classname, target in list(aliases.items()):
+            while target in aliases:
+                target = aliases[target]
+            aliases[classname] = target
+
+    unique_irs = [_substitute_aliases(ir, aliases) for ir in irs
+                  if ir["classname"] not in aliases]
+    return unique_irs, aliases
+
+
+def generate_alias(classname, target_classname):
+    "Generate header and implementation code making classname an alias of target_classname."
+    h = "\ntypedef %s %s;\n" % (target_classname, classname)
+    cpp = ""
+    return h, cpp
+
@@ -22,6 +22,227 @@
 from uflacs.backends.ufc.generator import ufc_generator
 from uflacs.backends.ufc.utils import generate_return_new_switch
 
+# Elements with more dofs than this get table-driven tabulate_dofs code
+max_unrolled_tabulate_dofs = 32
+
+
+def _entity_blocks(subelement_dofs, is_subelement_real):
+    """Build the blocks of consecutive global dofs numbered by tabulate_dofs.
+
+    There is one block for each Real subelement and for each entity
+    dimension of each other subelement with dofs, in the order they
+    are numbered.
+
+    Returns a list with one tuple (cell_entity_dim, num_dofs_per_mesh_entity)
+    for each block, where cell_entity_dim is None for Real subelements.
+    """
+    blocks = []
+    for (subelement_index, entity_dofs) in enumerate(subelement_dofs):
+        if is_subelement_real[subelement_index]:
+            blocks.append((None, 1))
+            continue
+        for (cell_entity_dim, dofs_on_cell_entity) in enumerate(entity_dofs):
+            num_dofs_per_mesh_entity = len(dofs_on_cell_entity[0])
+            assert all(num_dofs_per_mesh_entity == len(dofs)
+                       for dofs in dofs_on_cell_entity)
+            if num_dofs_per_mesh_entity > 0:
+                blocks.append((cell_entity_dim, num_dofs_per_mesh_entity))
+    return blocks
+
+
+def generate_tabulate_dofs_unrolled(L, subelement_dofs, num_dofs_per_subelement, need_offset, is_subelement_real):
+    "Generate tabulate_dofs code with one assignment per local dof."
+    # Input arguments
+    entity_indices = L.Symbol("entity_indices")
+    num_mesh_entities = L.Symbol("num_global_entities")
+
+    # Output arguments
+    dofs_variable = L.Symbol("dofs")
+
+    # Collect code pieces in list
+    code = []
+
+    # Declare offset if needed
+    if need_offset:
+        offset = L.Symbol("offset")
+        code.append(L.VariableDecl("std::size_t", offset, value=0))
+    else:
+        offset = 0
+
+    # Generate code for each element
+    subelement_offset = 0
+    for (subelement_index, entity_dofs) in enumerate(subelement_dofs):
+
+        # Handle is_subelement_real (Space of reals)
+        if is_subelement_real[subelement_index]:
+            assert num_dofs_per_subelement[subelement_index] == 1
+            code.append(L.Assign(dofs_variable[subelement_offset], offset))
+            if need_offset:
+                code.append(L.AssignAdd(offset, 1))
+            subelement_offset += 1
+            continue
+
+        # Generate code for each degree of freedom for each dimension
+        for (cell_entity_dim, dofs_on_cell_entity) in enumerate(entity_dofs):
+            num_dofs_per_mesh_entity = len(dofs_on_cell_entity[0])
+            assert all(num_dofs_per_mesh_entity == len(dofs)
+                       for dofs in dofs_on_cell_entity)
+
+            # Ignore if no dofs for this dimension
+            if num_dofs_per_mesh_entity == 0:
+                continue
+
+            # For each cell entity of this dimension
+            for (cell_entity_index, dofs) in enumerate(dofs_on_cell_entity):
+                # dofs is a list of the local dofs that live on this cell entity
+
+                # find offset for this particular mesh entity
+                entity_offset = len(dofs) * entity_indices[cell_entity_dim, cell_entity_index]
+
+                for (j, dof) in enumerate(dofs):
+                    # dof is the local dof index on the subelement
+                    # j is the local index of dof among the dofs on this particular cell/mesh entity
+                    local_dof_index = subelement_offset + dof
+                    global_dof_index = offset + entity_offset + j
+                    code.append(L.Assign(dofs_variable[local_dof_index], global_dof_index))
+
+            # Update offset corresponding to mesh entity:
+            if need_offset:
+                code.append(L.AssignAdd(offset, num_dofs_per_mesh_entity * num_mesh_entities[cell_entity_dim]))
+
+        subelement_offset += num_dofs_per_subelement[subelement_index]
+
+    return L.StatementList(code)
+
+
+def generate_tabulate_dofs_table(L, subelement_dofs, num_dofs_per_subelement, need_offset, is_subelement_real):
+    """Generate tabulate_dofs code with a loop over static tables of the local dofs.
+
+    Each local dof k is numbered
+
+        dofs[k] = block_offsets[b] + n * entity_indices[d][i] + j
+
+    where b = dof_blocks[k] is the block of consecutive global dofs
+    for its subelement and entity dimension d = dof_entity_dims[k],
+    n is the number of dofs per mesh entity in this block,
+    i = dof_entity_indices[k] is the cell entity index of the dof
+    and j = dof_entity_offsets[k] is its index among the dofs of the entity.
+    Only the block offsets depend on the mesh and are computed at run time.
+    """
+    # Input arguments
+    entity_indices = L.Symbol("entity_indices")
+    num_mesh_entities = L.Symbol("num_global_entities")
+
+    # Output arguments
+    dofs_variable = L.Symbol("dofs")
+
+    # Build tables
+    blocks = _entity_blocks(subelement_dofs, is_subelement_real)
+    num_dofs = sum(num_dofs_per_subelement)
+    dof_blocks = [0]*num_dofs
+    dof_entity_dims = [0]*num_dofs
+    dof_entity_indices = [0]*num_dofs
+    dof_entity_offsets = [0]*num_dofs
+    block = 0
+    subelement_offset = 0
+    for (subelement_index, entity_dofs) in enumerate(subelement_dofs):
+        if is_subelement_real[subelement_index]:
+            # Real dofs get n = 0 and a valid dummy entity
+            dof_blocks[subelement_offset] = block
+            block += 1
+            subelement_offset += 1
+            continue
+        for (cell_entity_dim, dofs_on_cell_entity) in enumerate(entity_dofs):
+            if len(dofs_on_cell_entity[0]) == 0:
+                continue
+            for (cell_entity_index, dofs) in enumerate(dofs_on_cell_entity):
+                for (j, dof) in enumerate(dofs):
+                    k = subelement_offset + dof
+                    dof_blocks[k] = block
+                    dof_entity_dims[k] = cell_entity_dim
+                    dof_entity_indices[k] = cell_entity_index
+                    dof_entity_offsets[k] = j
+            block += 1
+        subelement_offset += num_dofs_per_subelement[subelement_index]
+    assert block == len(blocks)
+    num_blocks = len(blocks)
+    block_sizes = [(0 if dim is None else n) for dim, n in blocks]
+
+    # Symbols for tables
+    dof_blocks_sym = L.Symbol("dof_blocks")
+    dof_entity_dims_sym = L.Symbol("dof_entity_dims")
+    dof_entity_indices_sym = L.Symbol("dof_entity_indices")
+    dof_entity_offsets_sym = L.Symbol("dof_entity_offsets")
+    block_sizes_sym = L.Symbol("block_entity_dofs")
+    block_offsets = L.Symbol("block_offsets")
+    k = L.Symbol("k")
+
+    code = [
+        L.ArrayDecl("static const int", dof_blocks_sym, (num_dofs,), values=dof_blocks),
+        L.ArrayDecl("static const int", dof_entity_dims_sym, (num_dofs,), values=dof_entity_dims),
+        L.ArrayDecl("static const int", dof_entity_indices_sym, (num_dofs,), values=dof_entity_indices),
+        L.ArrayDecl("static const int", dof_entity_offsets_sym, (num_dofs,), values=dof_entity_offsets),
+        L.ArrayDecl("static const int", block_sizes_sym, (num_blocks,), values=block_sizes),
+        ]
+
+    # Compute offsets of each block from the number of mesh entities
+    code += [L.ArrayDecl("std::size_t", block_offsets, (num_blocks,))]
+    code += [L.Assign(block_offsets[0], 0)]
+    for b in range(1, num_blocks):
+        dim, n = blocks[b - 1]
+        if dim is None:
+            size = 1
+        else:
+            size = n * num_mesh_entities[dim]
+        code += [L.Assign(block_offsets[b], block_offsets[b - 1] + size)]
+
+    # Number all dofs in a tight loop
+    b = dof_blocks_sym[k]
+    entity_index = L.ArrayAccess(entity_indices, (dof_entity_dims_sym[k], dof_entity_indices_sym[k]))
+    code += [
+        L.ForRange(k, 0, num_dofs, body=
+            L.Assign(dofs_variable[k], block_offsets[b] + block_sizes_sym[b] * entity_index
+                     + dof_entity_offsets_sym[k]))
+        ]
+    return L.StatementList(code)
+
+
+def generate_tabulate_dofs_blocked(L, generate, entity_dofs, num_subelement_dofs, block_size):
+    """Generate tabulate_dofs code for an element with block_size equal subelements.
+
+    The dofs of the first subelement are tabulated with the given
+    generator, and the dofs of subelement s are the same shifted by s
+    times the global dimension of a subelement.
+    """
+    # Input arguments
+    num_mesh_entities = L.Symbol("num_global_entities")
+
+    # Output arguments
+    dofs_variable = L.Symbol("dofs")
+
+    # Tabulate dofs of first subelement
+    blocks = _entity_blocks([entity_dofs], [False])
+    need_offset = len(blocks) > 1
+    code = [generate(L, [entity_dofs], [num_subelement_dofs], need_offset, [False])]
+
+    # Global dimension of a subelement
+    subelement_dimension = L.Symbol("subelement_dimension")
+    sizes = [L.LiteralInt(n) * num_mesh_entities[dim] for dim, n in blocks]
+    dimension = sum(sizes[1:], sizes[0])
+    code += [L.VariableDecl("const std::size_t", subelement_dimension, dimension)]
+
+    # Copy dofs to the other subelements with shifted global numbers
+    s = L.Symbol("s")
+    k = L.Symbol("k")
+    code += [
+        L.ForRange(s, 1, block_size, body=
+            L.ForRange(k, 0, num_subelement_dofs, body=
+                L.Assign(dofs_variable[s*num_subelement_dofs + k],
+                         dofs_variable[k] + s*subelement_dimension)))
+        ]
+    return L.StatementList(code)
+
+
 class ufc_dofmap(ufc_generator):
     def __init__(self):
         ufc_generator.__init__(self, "dofmap")
@@ -72,14 +293,9 @@ class ufc_dofmap(ufc_generator):
 
     def tabulate_dofs(self, L, ir):
 
-        # Input arguments
-        entity_indices = L.Symbol("entity_indices")
-        num_mesh_entities = L.Symbol("num_global_entities")
-
         # Output arguments
         dofs_variable = L.Symbol("dofs")
 
-
         ir = ir["tabulate_dofs"]
         if ir is None: # What is this supposed to mean?
             return L.Assign(dofs_variable[0], 0)
@@ -99,60 +315,28 @@ class ufc_dofmap(ufc_generator):
 
         #entity_dofs =? entity_dofs[d][i][:] # dofs on entity (d,i)
 
-        # Collect code pieces in list
-        code = []
-
-        # Declare offset if needed
-        if need_offset:
-            offset = L.Symbol("offset")
-            code.append(L.VariableDecl("std::size_t", offset, value=0))
-        else:
-            offset = 0
-
-        # Generate code for each element
-        subelement_offset = 0
-        for (subelement_index, entity_dofs) in enumerate(subelement_dofs):
-
-            # Handle is_subelement_real (Space of reals)
-            if is_subelement_real[subelement_index]:
-                assert num_dofs_per_subelement[subelement_index] == 1
-                code.append(L.Assign(dofs_variable[subelement_offset], offset))
-                if need_offset:
-                    code.append(L.AssignAdd(offset, 1))
-                subelement_offset += 1
-                continue
-
-            # Generate code for each degree of freedom for each dimension
-            for (cell_entity_dim, dofs_on_cell_entity) in enumerate(entity_dofs):
-                num_dofs_per_mesh_entity = len(dofs_on_cell_entity[0])
-                assert all(num_dofs_per_mesh_entity == len(dofs)
-                           for dofs in dofs_on_cell_entity)
-
-                # Ignore if no dofs for this dimension
-                if num_dofs_per_mesh_entity == 0:
-                    continue
-
-                # For each cell entity of this dimension
-                for (cell_entity_index, dofs) in enumerate(dofs_on_cell_entity):
-                    # dofs is a list of the local dofs that live on this cell entity
-
-                    # find offset for this particular mesh entity
-                    entity_offset = len(dofs) * entity_indices[cell_entity_dim, cell_entity_index]
-
-                    for (j, dof) in enumerate(dofs):
-                        # dof is the local dof index on the subelement
-                        # j is the local index of dof among the dofs on this particular cell/mesh entity
-                        local_dof_index = subelement_offset + dof
-                        global_dof_index = offset + entity_offset + j
-                        code.append(L.Assign(dofs_variable[local_dof_index], global_dof_index))
-
-                # Update offset corresponding to mesh entity:
-                if need_offset:
-                    code.append(L.AssignAdd(offset, num_dofs_per_mesh_entity * num_mesh_entities[cell_entity_dim]))
-
-            subelement_offset += num_dofs_per_subelement[subelement_index]
-
-        return L.StatementList(code)
+        # Use straight-line code for small elements and static tables for large elements
+        def select_generator(num_dofs):
+            if num_dofs <= max_unrolled_tabulate_dofs:
+                return generate_tabulate_dofs_unrolled
+            else:
+                return generate_tabulate_dofs_table
+        num_dofs = sum(num_dofs_per_subelement)
+
+        # Large elements with equal non-Real subelements, i.e. vector elements,
+        # only tabulate the dofs of the first subelement explicitly
+        block_size = len(subelement_dofs)
+        is_blocked = (block_size > 1 and num_dofs > max_unrolled_tabulate_dofs
+                      and not any(is_subelement_real)
+                      and all(entity_dofs == subelement_dofs[0] for entity_dofs in subelement_dofs)
+                      and all(n == num_dofs_per_subelement[0] for n in num_dofs_per_subelement))
+        if is_blocked:
+            generate = select_generator(num_dofs_per_subelement[0])
+            return generate_tabulate_dofs_blocked(L, generate, subelement_dofs[0],
+                                                  num_dofs_per_subelement[0], block_size)
+
+        generate = select_generator(num_dofs)
+        return generate(L, subelement_dofs, num_dofs_per_subelement, need_offset, is_subelement_real)
 
     def tabulate_facet_dofs(self, L, ir):
         all_facet_dofs = ir["tabulate_facet_dofs"]
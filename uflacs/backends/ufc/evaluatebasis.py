@@ -74,14 +74,78 @@ TODO: Add these to ufc::finite_element:
 
 import math
 
+# Number of points to compute basisvalues for before contracting with the coefficients
+point_block_size = 8
+
+# Unroll the contraction with the coefficients if the coefficient matrix has at most this many entries
+max_unrolled_contraction_size = 64
+
+
+def _build_coefficient_matrices(dofs_data, reference_value_size):
+    """Stack expansion coefficients of all dofs into one matrix per embedded degree.
+
+    Rows of coefficients that are equal are stored only once.
+
+    Returns a list with one tuple
+
+        (embedded_degree, num_members, coefficients, coefficient_rows, value_offsets)
+
+    for each embedded degree, where coefficients is the list of unique rows,
+    and for each component of each dof using this degree the value at
+    the flat offset value_offsets[k] into the (num_dofs, reference_value_size)
+    values of a point is the product of coefficients[coefficient_rows[k]]
+    and the basisvalues. Also returns the sorted list of flat offsets of
+    values not computed by any dof, which are always zero.
+    """
+    matrices = {}
+    degrees = []
+    covered = set()
+    for idof, dof_data in enumerate(dofs_data):
+        embedded_degree = dof_data["embedded_degree"]
+        num_components = dof_data["num_components"]
+        num_members = dof_data["num_expansion_members"]
+        reference_offset = dof_data["reference_offset"]
+
+        if embedded_degree not in matrices:
+            degrees.append(embedded_degree)
+            matrices[embedded_degree] = (num_members, [], {}, [], [])
+        num_members, coefficients, row_numbers, coefficient_rows, value_offsets = matrices[embedded_degree]
+
+        for c in range(num_components):
+            row = tuple(float(v) for v in dof_data["coeffs"][c])
+            assert len(row) == num_members
+            k = row_numbers.get(row)
+            if k is None:
+                k = len(coefficients)
+                row_numbers[row] = k
+                coefficients.append(row)
+            coefficient_rows.append(k)
+            offset = idof*reference_value_size + reference_offset + c
+            value_offsets.append(offset)
+            covered.add(offset)
+
+    result = []
+    for embedded_degree in degrees:
+        num_members, coefficients, row_numbers, coefficient_rows, value_offsets = matrices[embedded_degree]
+        result.append((embedded_degree, num_members, coefficients, coefficient_rows, value_offsets))
+
+    zero_offsets = sorted(set(range(len(dofs_data)*reference_value_size)) - covered)
+    return result, zero_offsets
+
+
 def generate_evaluate_reference_basis(L, data):
-    """Generate code to evaluate element basisfunctions at an arbitrary point on the reference element.
+    """Generate code to evaluate element basisfunctions at arbitrary points on the reference element.
 
     The value(s) of the basisfunction is/are computed as in FIAT as
     the dot product of the coefficients (computed at compile time)
     and basisvalues which are dependent on the coordinate and thus
     have to be computed at run time.
 
+    The points are processed in blocks: the basisvalues of each
+    embedded degree are computed for all points in a block, then
+    contracted with a single matrix of the stacked expansion
+    coefficients of all dofs, in which equal rows are merged.
+
     The function should work for all elements supported by FIAT, but
     it remains untested for tensor valued elements.
 
@@ -92,7 +156,7 @@ def generate_evaluate_reference_basis(L, data):
     """
     # Cutoff for feature to disable generation of this code (consider removing after benchmarking final result)
     if isinstance(data, str):
-        return L.Throw("evaluate_reference_basis: %s" % data)
+        return L.Throw("std::runtime_error", "evaluate_reference_basis: %s" % data)
 
     # Get some known dimensions
     element_cellname = data["cellname"]
@@ -100,6 +164,7 @@ def generate_evaluate_reference_basis(L, data):
     tdim = data["topological_dimension"]
     reference_value_size = data["reference_value_size"]
     num_dofs = len(data["dofs_data"])
+    point_value_size = num_dofs*reference_value_size
 
     # Input geometry
     num_points = L.Symbol("num_points")
@@ -107,115 +172,122 @@ def generate_evaluate_reference_basis(L, data):
 
     # Output values
     reference_values = L.Symbol("reference_values")
-    ref_values = L.FlattenedArray(reference_values, dims=(num_points, num_dofs, reference_value_size))
 
     # NB! This symbol refers to the FIAT reference coordinate!
     Y = L.Symbol("Y")
 
     # Loop indices
-    ip = L.Symbol("ip")
+    ip0 = L.Symbol("ip0")
+    ib = L.Symbol("ib")
     k = L.Symbol("k")
-    c = L.Symbol("c")
+    u = L.Symbol("u")
     r = L.Symbol("r")
 
+    # Number of points in current block
+    block_size = point_block_size
+    num_block_points = L.Symbol("num_block_points")
 
-    # Generate code with static tables of expansion coefficients
-    tables_code = []
-    coefficients_for_dof = []
-    for idof, dof_data in enumerate(data["dofs_data"]):
-        num_components = dof_data["num_components"]
-        num_members = dof_data["num_expansion_members"]
-        fiat_coefficients = dof_data["coeffs"]
+    # Flat offset of the values of current point
+    ip = ip0 + ib
+    values_offset = ip*point_value_size
 
-        # TODO: Check if any fiat_coefficients tables in expansion_coefficients are equal and reuse instead of declaring new.
+    # Build stacked coefficient matrices with equal rows merged
+    matrices, zero_offsets = _build_coefficient_matrices(data["dofs_data"], reference_value_size)
 
-        # Create separate variable name for coefficients table for each dof
-        coefficients = L.Symbol("coefficients%d" % idof)
+    tables_code = []
+    block_decls = []
+    basisvalues_code = []
+    contraction_code = []
+    for embedded_degree, num_members, coefficients_values, coefficient_rows_values, value_offsets_values in matrices:
+        num_unique = len(coefficients_values)
+        num_rows = len(value_offsets_values)
 
         # Create static table with expansion coefficients computed by FIAT compile time.
+        coefficients = L.Symbol("coefficients%d" % embedded_degree)
         tables_code += [L.ArrayDecl("static const double", coefficients,
-                                    (num_components, num_members), values=fiat_coefficients)]
+                                    (num_unique, num_members), values=coefficients_values)]
 
-        # Store symbol reference for this dof
-        coefficients_for_dof.append(coefficients)
-
-
-    # Reset values[:] to 0
-    reset_values_code = [
-        L.ForRange(k, 0, num_points*num_dofs*reference_value_size, body=
-            L.Assign(reference_values[k], 0.0))
-        ]
+        # Tables mapping each computed value to its coefficient row and its offset in the values of a point
+        if coefficient_rows_values == list(range(num_rows)):
+            coefficient_row = k
+        else:
+            coefficient_rows = L.Symbol("coefficient_rows%d" % embedded_degree)
+            tables_code += [L.ArrayDecl("static const int", coefficient_rows,
+                                        (num_rows,), values=coefficient_rows_values)]
+            coefficient_row = coefficient_rows[k]
+        if value_offsets_values == list(range(num_rows)):
+            value_offset = k
+        else:
+            value_offsets = L.Symbol("value_offsets%d" % embedded_degree)
+            tables_code += [L.ArrayDecl("static const int", value_offsets,
+                                        (num_rows,), values=value_offsets_values)]
+            value_offset = value_offsets[k]
+
+        # Block of basisvalues for all points in a block
+        basisvalues_block = L.Symbol("basisvalues%d" % embedded_degree)
+        block_decls += [L.ArrayDecl("double", basisvalues_block, (block_size*num_members,))]
+        basisvalues = L.FlattenedArray(basisvalues_block, dims=(block_size, num_members))[ib]
+
+        # Generate code to compute table of basisvalues for one point
+        bfcode = _generate_compute_basisvalues(L, basisvalues, Y, element_cellname, embedded_degree, num_members)
+        basisvalues_code += [L.StatementList(bfcode)]
+
+        # Products of unique coefficient rows and basisvalues of one point
+        mapped = L.Symbol("mapped%d" % embedded_degree)
+        if num_unique*num_members <= max_unrolled_contraction_size:
+            contraction_code += [L.ArrayDecl("double", mapped, (num_unique,))]
+            contraction_code += [
+                L.Assign(mapped[j], L.Sum([coefficients[j, jr] * basisvalues[jr]
+                                           for jr in range(num_members)]))
+                for j in range(num_unique)
+                ]
+        else:
+            contraction_code += [
+                L.ArrayDecl("double", mapped, (num_unique,), values=0),
+                L.ForRange(u, 0, num_unique, body=
+                    L.ForRange(r, 0, num_members, body=
+                        L.AssignAdd(mapped[u], coefficients[u, r] * basisvalues[r])))
+                ]
 
+        # Scatter products into values
+        contraction_code += [
+            L.ForRange(k, 0, num_rows, body=
+                L.Assign(reference_values[values_offset + value_offset], mapped[coefficient_row]))
+            ]
+
+    # Values not computed from any dof (e.g. other subelement components of mixed elements) are zero
+    if zero_offsets:
+        zero_offsets_table = L.Symbol("zero_offsets")
+        tables_code += [L.ArrayDecl("static const int", zero_offsets_table,
+                                    (len(zero_offsets),), values=zero_offsets)]
+        contraction_code += [
+            L.ForRange(k, 0, len(zero_offsets), body=
+                L.Assign(reference_values[values_offset + zero_offsets_table[k]], 0.0))
+            ]
 
     # Mapping from UFC reference cell coordinate X to FIAT reference cell coordinate Y
     fiat_coordinate_mapping = L.ArrayDecl("const double", Y, (tdim,),
                                           values=[2.0*X[ip*tdim + jj]-1.0 for jj in range(tdim)])
 
-
-    # Generate code to compute tables of basisvalues
-    basisvalues_code = []
-    basisvalues_for_degree = {}
-    for idof, dof_data in enumerate(data["dofs_data"]):
-        embedded_degree = dof_data["embedded_degree"]
-        num_members = dof_data["num_expansion_members"]
-
-        if embedded_degree not in basisvalues_for_degree:
-            basisvalues = L.Symbol("basisvalues%d" % embedded_degree)
-            bfcode = _generate_compute_basisvalues(L, basisvalues, Y, element_cellname, embedded_degree, num_members)
-            basisvalues_code += [L.StatementList(bfcode)]
-
-            # Store symbol reference for this degree
-            basisvalues_for_degree[embedded_degree] = basisvalues
-
-
-    # Accumulate products of basisvalues and coefficients into values
-    accumulation_code = []
-    for idof, dof_data in enumerate(data["dofs_data"]):
-        embedded_degree = dof_data["embedded_degree"]
-        num_components = dof_data["num_components"]
-        num_members = dof_data["num_expansion_members"]
-
-        # In ffc representation, this is extracted per dof (but will coincide for some dofs of piola mapped elements):
-        reference_offset = dof_data["reference_offset"]
-
-        # Select the right basisvalues for this dof
-        basisvalues = basisvalues_for_degree[embedded_degree]
-
-        # Select the right coefficients for this dof
-        coefficients = coefficients_for_dof[idof]
-
-        # Generate basis accumulation loop
-        if num_components > 1:
-            accumulation_code += [
-                L.ForRange(c, 0, num_components, body=
-                    L.ForRange(r, 0, num_members, body=
-                        L.AssignAdd(ref_values[ip, idof, reference_offset + c],
-                                    coefficients[c,r] * basisvalues[r])))
-                ]
-        elif num_members > 1:
-            accumulation_code += [
-                L.ForRange(r, 0, num_members, body=
-                    L.AssignAdd(ref_values[ip, idof, reference_offset], coefficients[0, r] * basisvalues[r]))
-                ]
-        else:
-            accumulation_code += [
-                L.AssignAdd(ref_values[ip, idof, reference_offset], coefficients[0, 0] * basisvalues[0])
-                ]
-
-        # FIXME: Move this mapping to its own ufc function e.g. finite_element::apply_element_mapping(reference_values, J, K)
-        #code += _generate_apply_mapping_to_computed_values(L, dof_data) # Only works for affine (no-op)
+    # FIXME: Move this mapping to its own ufc function e.g. finite_element::apply_element_mapping(reference_values, J, K)
+    #code += _generate_apply_mapping_to_computed_values(L, dof_data) # Only works for affine (no-op)
 
     # Stitch it all together
     code = L.StatementList(
         tables_code +
-        reset_values_code +
-        [L.ForRange(ip, 0, num_points, body=L.StatementList([
-            L.Comment("Map from UFC reference coordinate X to FIAT reference coordinate Y"),
-            fiat_coordinate_mapping,
-            L.Comment("Compute basisvalues for each relevant embedded degree"),
-            basisvalues_code,
-            L.Comment("Accumulate products of coefficients and basisvalues"),
-            accumulation_code,
+        block_decls +
+        [L.For(L.VariableDecl("int", ip0, 0), L.LT(ip0, num_points), L.AssignAdd(ip0, block_size),
+               body=L.StatementList([
+            L.VariableDecl("const int", num_block_points,
+                           L.Conditional(L.LT(num_points - ip0, block_size), num_points - ip0, block_size)),
+            L.Comment("Compute basisvalues for each relevant embedded degree at each point in block"),
+            L.ForRange(ib, 0, num_block_points, body=L.StatementList([
+                L.Comment("Map from UFC reference coordinate X to FIAT reference coordinate Y"),
+                fiat_coordinate_mapping,
+                basisvalues_code,
+                ])),
+            L.Comment("Contract basisvalues with stacked coefficients for each point in block"),
+            L.ForRange(ib, 0, num_block_points, body=L.StatementList(contraction_code)),
             ]))])
     return code
 
@@ -244,8 +316,8 @@ def _jrc(a, b, n):
 def _generate_compute_interval_basisvalues(L, basisvalues, Y, embedded_degree, num_members):
     # FIAT_NEW.expansions.LineExpansionSet.
 
-    # Create zero-initialized array for with basisvalues
-    code = [L.ArrayDecl("double", basisvalues, (num_members,), values=0)]
+    # The basisvalues array is declared by the caller
+    code = []
 
     # FIAT_NEW.jacobi.eval_jacobi_batch(a,b,n,xs)
     # for ii in range(result.shape[1]):
@@ -290,9 +362,8 @@ def _generate_compute_interval_basisvalues(L, basisvalues, Y, embedded_degree, n
     #    results[k,:] = psitilde_as[k,:] * math.sqrt( k + 0.5 )
 
     # Scale values
-    p = L.Symbol("p")
-    code += [L.ForRange(p, 0, embedded_degree + 1,
-                        body=L.AssignMul(basisvalues[p], L.Sqrt(0.5 + p)))]
+    for r in range(0, embedded_degree + 1):
+        code += [L.AssignMul(basisvalues[r], math.sqrt(0.5 + r))]
     return code
 
 def _generate_compute_triangle_basisvalues(L, basisvalues, Y, embedded_degree, num_members):
@@ -301,8 +372,8 @@ def _generate_compute_triangle_basisvalues(L, basisvalues, Y, embedded_degree, n
     def _idx2d(p, q):
         return (p + q)*(p + q + 1)//2 + q
 
-    # Create zero-initialized array for with basisvalues
-    code = [L.ArrayDecl("double", basisvalues, (num_members,), values=0)]
+    # The basisvalues array is declared by the caller
+    code = []
 
     # Compute helper factors
     # FIAT_NEW code
@@ -413,8 +484,8 @@ def _generate_compute_tetrahedron_basisvalues(L, basisvalues, Y, embedded_degree
     # factor4 = 0.5 * ( 1 - z )
     # factor5 = factor4 ** 2
 
-    # Create zero-initialized array for with basisvalues
-    code = [L.ArrayDecl("double", basisvalues, (num_members,), values=0)]
+    # The basisvalues array is declared by the caller
+    code = []
 
     # The initial value basisvalues 0 is always 1.0.
     # FIAT_NEW code
@@ -19,18 +19,86 @@
 # Note: Most of the code in this file is a direct translation from the old implementation in FFC
 
 
+import numpy
+
 from ufl import product
 from uflacs.backends.ufc.generator import ufc_generator
 from uflacs.backends.ufc.utils import generate_return_new_switch
 
-def affine_weights(dim): # FIXME: This is used where we still assume an affine mesh. Get rid of all places that use it.
-    "Compute coefficents for mapping from reference to physical element"
-    if dim == 1:
-        return lambda X: (1.0 - X[0], X[0])
-    elif dim == 2:
-        return lambda X: (1.0 - X[0] - X[1], X[0], X[1])
-    elif dim == 3:
-        return lambda X: (1.0 - X[0] - X[1] - X[2], X[0], X[1], X[2])
+# Cells where the affine vertex basis maps reference points to physical points
+affine_cells = ("interval", "triangle", "tetrahedron")
+
+
+def affine_vertex_weights(points):
+    """Evaluate the affine vertex basis functions of a simplex in reference points.
+
+    Returns an array of shape (num_points, tdim + 1), such that the
+    physical points are the product of this matrix with the vertex
+    coordinates.
+    """
+    X = numpy.asarray(points, dtype=numpy.float64)
+    return numpy.hstack((1.0 - X.sum(axis=1).reshape((-1, 1)), X))
+
+
+def generate_compute_dof_points(L, x, points, gdim, coordinate_dofs, cellname, coordinate_mapping=None):
+    """Generate code computing physical points x[num_points][gdim] from reference points.
+
+    Uses a static vertex weight matrix for affine simplex cells, and
+    the batched compute_physical_coordinates of the given coordinate
+    mapping class otherwise.
+    """
+    num_points = len(points)
+    if coordinate_mapping is not None:
+        tdim = len(points[0])
+        X = L.Symbol("dof_reference_coordinates")
+        cm = L.Symbol("cm")
+        return [
+            L.ArrayDecl("static const double", X, (num_points*tdim,), values=numpy.asarray(points).flatten()),
+            L.VariableDecl("const " + coordinate_mapping, cm),
+            L.Call("cm.compute_physical_coordinates", (x, num_points, X, coordinate_dofs)),
+            ]
+
+    if cellname not in affine_cells:
+        return None
+
+    weights = affine_vertex_weights(points)
+    num_vertices = weights.shape[1]
+    W = L.Symbol("dof_vertex_weights")
+    x = L.FlattenedArray(x, dims=(num_points, gdim))
+    ip = L.Symbol("ip")
+    i = L.Symbol("i")
+    return [
+        L.ArrayDecl("static const double", W, weights.shape, values=weights),
+        L.ForRange(ip, 0, num_points, body=
+            L.ForRange(i, 0, gdim, body=
+                L.Assign(x[ip][i], L.Sum([W[ip, k] * coordinate_dofs[gdim*k + i]
+                                          for k in range(num_vertices)])))),
+        ]
+
+
+def _flat_dof_weights(dofs, offsets, points, value_size):
+    """Build compressed tables of the weights of each dof on the values at the unique points.
+
+    Returns (offsets, indices, weights), where dof j is the sum of
+    weights[k] * values[indices[k]] for k in range(offsets[j], offsets[j+1]),
+    and values[ip*value_size + c] is component c of the function at point ip.
+    The component of each dof is its physical offset plus the component
+    within the subelement. Returns None if a component cannot be flattened.
+    """
+    point_numbers = dict((X, ip) for ip, X in enumerate(points))
+    weight_offsets = [0]
+    indices = []
+    weights = []
+    for pt_dict, offset in zip(dofs, offsets):
+        for X in sorted(pt_dict):
+            for w, comp in pt_dict[X]:
+                if len(comp) > 1:
+                    return None
+                c = offset + (comp[0] if comp else 0)
+                indices.append(point_numbers[X] * value_size + c)
+                weights.append(w)
+        weight_offsets.append(len(indices))
+    return weight_offsets, indices, weights
 
 
 class ufc_finite_element(ufc_generator):
@@ -87,7 +155,7 @@ class ufc_finite_element(ufc_generator):
 
     def evaluate_reference_basis(self, L, ir): # FIXME: NEW implement!
         from uflacs.backends.ufc.evaluatebasis import generate_evaluate_reference_basis
-        return generate_evaluate_reference_basis(ir["evaluate_reference_basis"])
+        return generate_evaluate_reference_basis(L, ir["evaluate_reference_basis"])
 
     def evaluate_reference_basis_derivatives(self, L, ir): # FIXME: NEW implement!
         data = ir["evaluate_reference_basis_derivatives"]
@@ -119,29 +187,75 @@ class ufc_finite_element(ufc_generator):
         return "FIXME"
 
     def evaluate_dofs(self, L, ir):
-        # FIXME: port this, then translate into reference version
-        """
-        - evaluate_dof needs to be split into invert_mapping + evaluate_dof or similar?
-
-          f = M fhat;  nu(f) = nu(M fhat) = nuhat(M^-1 f) = sum_i w_i M^-1 f(x_i)
-
-          // Get fixed set of points on reference element
-          num_points = element->num_dof_evaluation_points();
-          double X[num_points*tdim];
-          element->tabulate_dof_evaluation_points(X);
+        """Generate evaluate_dofs for elements with point evaluation dofs.
 
-          // Compute geometry in these points
-          domain->compute_geometry(reference_points, num_point, X, J, detJ, K, coordinate_dofs, cell_orientation);
+        The function is evaluated once in each unique dof point,
+        and the dofs are computed by contracting the function values
+        with a static table of dof weights.
 
-          // Computed by dolfin
-          for ip
-            fvalues[ip][:] = f.evaluate(point[ip])[:];
+        Note: the more general case should be split into invert_mapping + evaluate_dof:
 
-          // Finally: nu_j(f) = sum_component sum_ip weights[j][ip][component] fvalues[ip][component]
-          element->evaluate_dofs(fdofs, fvalues, J, detJ, K)
+          f = M fhat;  nu(f) = nu(M fhat) = nuhat(M^-1 f) = sum_i w_i M^-1 f(x_i)
         """
+        data = ir["evaluate_dof"]
+        dofs = data["dofs"]
+        value_size = data["physical_value_size"]
+        gdim = data["geometric_dimension"]
+
+        # Only affinely mapped point evaluations are supported for now
+        if (any(pt_dict is None for pt_dict in dofs)
+            or any(m != "affine" for m in data["mappings"])
+            or data["reference_value_size"] != value_size):
+            msg = "evaluate_dofs is not implemented for this element"
+            return L.Throw("std::runtime_error", msg)
+
+        points = sorted(set(X for pt_dict in dofs for X in pt_dict))
+        num_points = len(points)
+        tables = _flat_dof_weights(dofs, data["physical_offsets"], points, value_size)
+        if tables is None:
+            msg = "evaluate_dofs is not implemented for this element"
+            return L.Throw("std::runtime_error", msg)
+        offsets, indices, weights = tables
+
+        # Arguments
+        values = L.Symbol("values")
+        coordinate_dofs = L.Symbol("coordinate_dofs")
+        c = L.Symbol("c")
+
+        # Physical dof points
+        x = L.Symbol("x")
+        compute_points = generate_compute_dof_points(L, x, points, gdim, coordinate_dofs,
+                                                     ir["cell_shape"], ir.get("coordinate_mapping"))
+        if compute_points is None:
+            msg = "evaluate_dofs is not implemented for this cell"
+            return L.Throw("std::runtime_error", msg)
+
+        # Function values in all points
+        vals = L.Symbol("vals")
+        ip = L.Symbol("ip")
+        j = L.Symbol("j")
+        k = L.Symbol("k")
 
-        return "FIXME" + ir["evaluate_dofs"]
+        W_offsets = L.Symbol("dof_weight_offsets")
+        W_indices = L.Symbol("dof_weight_indices")
+        W = L.Symbol("dof_weights")
+
+        code = [L.ArrayDecl("double", x, (num_points * gdim,))]
+        code += compute_points
+        code += [
+            L.ArrayDecl("double", vals, (num_points * value_size,)),
+            L.ForRange(ip, 0, num_points, body=
+                L.Call("f.evaluate", (vals + value_size*ip, x + gdim*ip, c))),
+            L.ArrayDecl("static const int", W_offsets, (len(offsets),), values=offsets),
+            L.ArrayDecl("static const int", W_indices, (len(indices),), values=indices),
+            L.ArrayDecl("static const double", W, (len(weights),), values=weights),
+            L.ForRange(j, 0, len(dofs), body=[
+                L.Assign(values[j], 0.0),
+                L.ForRange(k, W_offsets[j], W_offsets[j + 1], body=
+                    L.AssignAdd(values[j], W[k] * vals[W_indices[k]])),
+                ]),
+            ]
+        return L.StatementList(code)
 
     def interpolate_vertex_values(self, L, ir): # FIXME: port this
         # FIXME: port this, then translate into reference version
@@ -154,60 +268,31 @@ class ufc_finite_element(ufc_generator):
         """
         pass
 
-    def tabulate_dof_coordinates(self, L, ir): # FIXME: port this
-        # TODO: For a transition period, let finite_element and dofmap depend on a class affine_<cellname>_domain?
+    def tabulate_dof_coordinates(self, L, ir):
         # TODO: Call _tabulate_dof_reference_coordinates to tabulate X[ndofs][tdim],
-        # then call affine_domain::compute_physical_coordinates(x, X, coordinate_dofs)
-
+        # then call compute_physical_coordinates in the caller instead
+        cellname = ir["cell_shape"]
+        coordinate_mapping = ir.get("coordinate_mapping")
         ir = ir["tabulate_dof_coordinates"]
 
         # Raise error if tabulate_dof_coordinates is ill-defined
         if not ir:
             msg = "tabulate_dof_coordinates is not defined for this element"
-            return L.Comment(msg) #L.Raise(msg) # TODO: Error handling
+            return L.Throw("std::runtime_error", msg)
 
         # Extract coordinates and cell dimension
         gdim = ir["gdim"]
-        tdim = ir["tdim"]
         points = ir["points"]
 
-        # Output argument
-        dof_coordinates = L.FlattenedArray(L.Symbol("dof_coordinates"), dims=(len(points), gdim))
-
-        # Input argument
+        # Arguments
+        dof_coordinates = L.Symbol("dof_coordinates")
         coordinate_dofs = L.Symbol("coordinate_dofs")
 
-        # Reference coordinates
-        dof_reference_coordinates = L.Symbol("dof_reference_coordinates")
-        dof_reference_coordinate_values = [X[j] for X in points for j in range(tdim)]
-
-        # Loop indices
-        i = L.Symbol("i")
-        k = L.Symbol("k")
-        ip = L.Symbol("ip")
-
-        # Basis symbol
-        phi = L.Symbol("phi")
-
-        # TODO: This code assumes an affine coordinate field. Ok for now in here, this function must be removed anyway.
-        # Create code for evaluating affine coordinate basis functions
-        num_scalar_xdofs = tdim + 1
-        cg1_basis = affine_weights(tdim)
-        phi_values = [phi_comp for X in points for phi_comp in cg1_basis(X)]
-        assert len(phi_values) == len(points) * num_scalar_xdofs
-
-        code = [
-            L.ArrayDecl("static const double", dof_reference_coordinates,
-                        (len(points) * tdim,),
-                        values=dof_reference_coordinate_values),
-            L.ArrayDecl("const double", phi,
-                        (len(points) * num_scalar_xdofs,),
-                        values=phi_values),
-            L.ForRange(ip, 0, len(points), body=
-                L.ForRange(i, 0, gdim, body=
-                    L.ForRange(k, 0, num_scalar_xdofs, body=
-                        L.AssignAdd(dof_coordinates[ip][i], coordinate_dofs[gdim*k + i] * phi[ip*num_scalar_xdofs + k])))),
-            ]
+        code = generate_compute_dof_points(L, dof_coordinates, points, gdim, coordinate_dofs,
+                                           cellname, coordinate_mapping)
+        if code is None:
+            msg = "tabulate_dof_coordinates is not implemented for this cell"
+            return L.Throw("std::runtime_error", msg)
         return L.StatementList(code)
 
     def num_sub_elements(self, L, ir):
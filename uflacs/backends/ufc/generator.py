@@ -28,6 +28,7 @@ import ffc.backends.ufc
 
 from uflacs.language.format_lines import format_indented_lines
 from uflacs.backends.ufc.templates import *
+from uflacs.backends.ufc.deduplication import deduplicate_irs, generate_alias
 
 #__all__ = (["ufc_form", "ufc_dofmap", "ufc_finite_element", "ufc_integral"]
 #           + ["ufc_%s_integral" % integral_type for integral_type in integral_types])
@@ -47,6 +48,39 @@ integral_name_templates = (
     )
 
 
+_template_keywords_regex = re.compile(r"%\(([a-zA-Z0-9_]*)\)")
+
+
+def _parse_template_keywords(basename):
+    """Extract keyword sets from the ufc templates for basename.
+
+    Returns (header_keywords, implementation_keywords, combined_keywords, keywords).
+    """
+    ufc_templates = ffc.backends.ufc.templates
+    r = _template_keywords_regex
+    header_keywords = frozenset(r.findall(ufc_templates[basename + "_header"]))
+    implementation_keywords = frozenset(r.findall(ufc_templates[basename + "_implementation"]))
+    combined_keywords = frozenset(r.findall(ufc_templates[basename + "_combined"]))
+
+    keywords = tuple(sorted(header_keywords | implementation_keywords))
+
+    # Do some ufc interface template checking, to catch bugs early when we change the ufc interface templates
+    if set(keywords) != set(combined_keywords):
+        a = set(header_keywords) - set(combined_keywords)
+        b = set(implementation_keywords) - set(combined_keywords)
+        c = set(combined_keywords) - set(keywords)
+        msg = "Templates do not have matching sets of keywords:"
+        if a:
+            msg += "\n  Header template keywords '%s' are not in the combined template." % (sorted(a),)
+        if b:
+            msg += "\n  Implementation template keywords '%s' are not in the combined template." % (sorted(b),)
+        if c:
+            msg += "\n  Combined template keywords '%s' are not in the header or implementation templates." % (sorted(c),)
+        error(msg)
+
+    return header_keywords, implementation_keywords, combined_keywords, keywords
+
+
 class ufc_generator(object):
     """Common functionality for code generators producing ufc classes.
 
@@ -54,44 +88,62 @@ class ufc_generator(object):
     It automatically extracts template keywords and inserts the results
     from calls to self.<keyword>(language, ir), or the value of ir[keyword]
     if there is no self.<keyword>.
+
+    The template keywords are parsed once for each template and shared
+    by all generator instances. If strict_checks is true, the generator
+    functions of each class are checked against the template keywords
+    the first time the class generates code. Set it to False to skip
+    the checks in production.
     """
+
+    # Check generator functions against template keywords (useful when changing ufc)
+    strict_checks = True
+
+    # Keyword sets for each template basename, shared by all instances
+    _template_keywords_cache = {}
+
+    # Generator classes already checked against their templates
+    _checked_classes = set()
+
     def __init__(self, basename):
         ufc_templates = ffc.backends.ufc.templates
         self._header_template = ufc_templates[basename + "_header"]
         self._implementation_template = ufc_templates[basename + "_implementation"]
         self._combined_template = ufc_templates[basename + "_combined"]
 
-        r = re.compile(r"%\(([a-zA-Z0-9_]*)\)")
-        self._header_keywords = set(r.findall(self._header_template))
-        self._implementation_keywords = set(r.findall(self._implementation_template))
-        self._combined_keywords = set(r.findall(self._combined_template))
-
-        self._keywords = sorted(self._header_keywords | self._implementation_keywords)
-
-        # Do some ufc interface template checking, to catch bugs early when we change the ufc interface templates
-        if set(self._keywords) != set(self._combined_keywords):
-            a = set(self._header_keywords) - set(self._combined_keywords)
-            b = set(self._implementation_keywords) - set(self._combined_keywords)
-            c = set(self._combined_keywords) - set(self._keywords)
-            msg = "Templates do not have matching sets of keywords:"
-            if a:
-                msg += "\n  Header template keywords '%s' are not in the combined template." % (sorted(a),)
-            if b:
-                msg += "\n  Implementation template keywords '%s' are not in the combined template." % (sorted(b),)
-            if c:
-                msg += "\n  Combined template keywords '%s' are not in the header or implementation templates." % (sorted(c),)
-            error(msg)
+        keywords = ufc_generator._template_keywords_cache.get(basename)
+        if keywords is None:
+            keywords = _parse_template_keywords(basename)
+            ufc_generator._template_keywords_cache[basename] = keywords
+        (self._header_keywords, self._implementation_keywords,
+         self._combined_keywords, self._keywords) = keywords
+
+    def _check_generator_functions(self):
+        "Warn about mismatches between generator functions and template keywords."
+        # Get all attributes of subclass class (skip "_foo")
+        attrs = set(name for name in dir(self) if not (name.startswith("_") or name.startswith("generate")))
+        # Get all attributes of this base class (skip "_foo" and "generate*")
+        base_attrs = set(name for name in dir(ufc_generator) if not (name.startswith("_") or name.startswith("generate")))
+        # The template keywords should not contain any names not among the class attributes
+        missing = set(self._keywords) - attrs
+        if missing:
+            warning("*** Missing generator functions:\n%s" % ('\n'.join(map(str, sorted(missing))),))
+        # The class attributes should not contain any names not among the template keywords
+        # (this is strict, a useful check when changing ufc, but can be dropped)
+        unused = attrs - set(self._keywords) - base_attrs - set(("strict_checks",))
+        if unused:
+            warning("*** Unused generator functions:\n%s" % ('\n'.join(map(str, sorted(unused))),))
 
     def generate_snippets(self, L, ir):
         "Generate code snippets for each keyword found in templates."
         snippets = {}
         for kw in self._keywords:
             # Check that attribute self.<keyword> is available
-            if not hasattr(self, kw):
+            method = getattr(self, kw, None)
+            if method is None:
                 error("Missing handler for keyword '%s' in class %s." % (kw, self.__class__.__name__))
 
             # Call self.<keyword>(L, ir) to get value
-            method = getattr(self, kw)
             value = method(L, ir)
 
             # Indent body and format to str
@@ -102,20 +154,12 @@ class ufc_generator(object):
             # Store formatted code in snippets dict
             snippets[kw] = value
 
-        # Error checking (can detect some bugs early when changing the ufc interface)
-        # Get all attributes of subclass class (skip "_foo")
-        attrs = set(name for name in dir(self) if not (name.startswith("_") or name.startswith("generate")))
-        # Get all attributes of this base class (skip "_foo" and "generate*")
-        base_attrs = set(name for name in dir(ufc_generator) if not (name.startswith("_") or name.startswith("generate")))
-        # The template keywords should not contain any names not among the class attributes
-        missing = set(self._keywords) - attrs
-        if missing:
-            warning("*** Missing generator functions:\n%s" % ('\n'.join(map(str, sorted(missing))),))
-        # The class attributes should not contain any names not among the template keywords
-        # (this is strict, a useful check when changing ufc, but can be dropped)
-        unused = attrs - set(self._keywords) - base_attrs
-        if unused:
-            warning("*** Unused generator functions:\n%s" % ('\n'.join(map(str, sorted(unused))),))
+        # Error checking (can detect some bugs early when changing the ufc interface),
+        # only done once for each generator class
+        cls = self.__class__
+        if self.strict_checks and cls not in ufc_generator._checked_classes:
+            ufc_generator._checked_classes.add(cls)
+            self._check_generator_functions()
 
         # Return snippets, a dict of code strings
         return snippets
@@ -128,6 +172,40 @@ class ufc_generator(object):
         cpp = self._implementation_template % snippets
         return h, cpp
 
+    def generate_to_streams(self, L, irs, header_stream, implementation_stream=None, deduplicate=False):
+        """Render the classes for a sequence of ir objects, writing directly to streams.
+
+        If implementation_stream is None, the combined header and
+        implementation template is written to header_stream.
+
+        With deduplicate, only one class is rendered for each group of
+        structurally identical ir objects, followed by typedefs making
+        the classnames of the others aliases of it.
+        """
+        irs = list(irs)
+        aliases = {}
+        if deduplicate:
+            unique_irs, aliases = deduplicate_irs(irs)
+        else:
+            unique_irs = irs
+
+        for ir in unique_irs:
+            snippets = self.generate_snippets(L, ir)
+            if implementation_stream is None:
+                header_stream.write(self._combined_template % snippets)
+            else:
+                header_stream.write(self._header_template % snippets)
+                implementation_stream.write(self._implementation_template % snippets)
+
+        if aliases:
+            for ir in irs:
+                classname = ir["classname"]
+                if classname in aliases:
+                    h, cpp = generate_alias(classname, aliases[classname])
+                    header_stream.write(h)
+                    if implementation_stream is not None:
+                        implementation_stream.write(cpp)
+
     def classname(self, L, ir):
         "Return classname."
         return ir["classname"]
@@ -197,12 +197,12 @@ def optimize_element_tables(tables, terminal_table_names):
     return unique_tables, terminal_table_ranges
 
 # TODO: This seems to be unused, remove?
-def generate_element_table_definitions(L, tables):
+def generate_element_table_definitions(L, tables, typename="double"):
     "Format a dict of name->table into code."
     code = []
     for name in sorted(tables):
         table = tables[name]
         if product(table.shape) > 0:
-            code += [L.ArrayDecl("static const double",
+            code += [L.ArrayDecl("static const " + typename,
                                  name, table.shape, table)]
     return code
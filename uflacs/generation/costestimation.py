@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011-2015 Martin Sandve Alnæs
+#
+# This file is part of UFLACS.
+#
+# UFLACS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UFLACS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
+
+"""Static estimation of operation counts and memory footprint of generated code.
+
+Walks a CNodes statement tree and counts floating point operations,
+weighting loop bodies by their trip counts. Index arithmetic inside
+array accesses is integer arithmetic and is not counted.
+"""
+
+from six import iteritems
+
+from ufl import product
+
+import uflacs.language.cnodes as L
+
+
+# Size in bytes of the scalar types we emit declarations for,
+# assuming x86-64 where long double is padded to 16 bytes
+_type_sizes = {
+    "long double": 16,
+    "double": 8,
+    "float": 4,
+    "int": 4,
+    "bool": 1,
+    }
+
+# Qualifiers that don't change the size of a type
+_type_qualifiers = ("static", "const", "constexpr", "volatile")
+
+
+def typename_size(typename):
+    "Return size in bytes of a (possibly qualified) scalar type name, defaulting to double."
+    base = " ".join(w for w in typename.split() if w not in _type_qualifiers)
+    return _type_sizes.get(base, 8)
+
+
+def empty_operation_counts():
+    return {"add": 0, "mul": 0, "div": 0, "call": 0}
+
+
+def add_operation_counts(target, source, factor=1):
+    for k, v in iteritems(source):
+        target[k] += factor * v
+    return target
+
+
+def max_operation_counts(counts_list):
+    result = empty_operation_counts()
+    for counts in counts_list:
+        for k, v in iteritems(counts):
+            result[k] = max(result[k], v)
+    return result
+
+
+def count_flops(counts):
+    "Return the sum of floating point add, multiply and division operations."
+    return counts["add"] + counts["mul"] + counts["div"]
+
+
+# Operation category for each counted expression node type
+_expr_op_categories = {
+    L.Add: "add",
+    L.Sub: "add",
+    L.Neg: "add",
+    L.AssignAdd: "add",
+    L.AssignSub: "add",
+    L.Mul: "mul",
+    L.AssignMul: "mul",
+    L.Div: "div",
+    L.AssignDiv: "div",
+    L.Call: "call",
+    }
+
+
+def count_expr_operations(expr, counts):
+    "Accumulate operation counts for a single evaluation of expr into counts."
+    if isinstance(expr, L.ArrayAccess):
+        # Integer index computations are not floating point work
+        return counts
+
+    cat = _expr_op_categories.get(type(expr))
+    if cat is not None:
+        counts[cat] += 1
+
+    if isinstance(expr, L.BinOp):
+        count_expr_operations(expr.lhs, counts)
+        count_expr_operations(expr.rhs, counts)
+    elif isinstance(expr, L.NaryOp):
+        if isinstance(expr, L.Sum):
+            counts["add"] += len(expr.args) - 1
+        elif isinstance(expr, L.Product):
+            counts["mul"] += len(expr.args) - 1
+        for arg in expr.args:
+            count_expr_operations(arg, counts)
+    elif isinstance(expr, L.UnaryOp):
+        count_expr_operations(expr.arg, counts)
+    elif isinstance(expr, L.Call):
+        for arg in expr.arguments:
+            count_expr_operations(arg, counts)
+    elif isinstance(expr, L.Conditional):
+        count_expr_operations(expr.condition, counts)
+        count_expr_operations(expr.true, counts)
+        count_expr_operations(expr.false, counts)
+    return counts
+
+
+def _trip_count(loop):
+    if isinstance(loop.begin, L.LiteralInt) and isinstance(loop.end, L.LiteralInt):
+        return max(0, loop.end.value - loop.begin.value)
+    return None
+
+
+class CostEstimator(object):
+    """Estimate operation counts and memory usage of a CNodes statement tree.
+
+    The quadrature loop is recognized by its loop index symbol,
+    which lets the estimator report costs per quadrature point
+    in addition to the total cost per cell.
+    """
+
+    def __init__(self, quadrature_index=None):
+        if quadrature_index is not None:
+            quadrature_index = L.as_symbol(quadrature_index).name
+        self.quadrature_index = quadrature_index
+
+        # num_points -> operation counts for a single quadrature point
+        self.per_point = {}
+
+        # Static tables and stack allocated arrays by name
+        self.tables = {}
+        self.temporaries = {}
+        self.temporary_bytes = 0
+
+        # Number of loops with trip counts not known at compile time,
+        # counted as a single iteration
+        self.unknown_trip_counts = 0
+
+    def _record_quadrature_point(self, num_points, counts):
+        pc = self.per_point.get(num_points)
+        if pc is None:
+            pc = empty_operation_counts()
+            self.per_point[num_points] = pc
+        add_operation_counts(pc, counts)
+
+    def _is_single_point_setup(self, st):
+        # The generator emits 'const int iq = 0;' followed by a Scope for a single quadrature point
+        return (isinstance(st, L.VariableDecl)
+                and st.symbol.name == self.quadrature_index
+                and isinstance(st.value, L.LiteralInt))
+
+    def count(self, node):
+        "Return operation counts for a single execution of statement node."
+        counts = empty_operation_counts()
+
+        if isinstance(node, L.StatementList):
+            single_point = False
+            for st in node.statements:
+                c = self.count(st)
+                if single_point and isinstance(st, L.Scope):
+                    self._record_quadrature_point(1, c)
+                single_point = self._is_single_point_setup(st)
+                add_operation_counts(counts, c)
+
+        elif isinstance(node, L.ForRange):
+            body = self.count(node.body)
+            trip = _trip_count(node)
+            if trip is None:
+                self.unknown_trip_counts += 1
+                trip = 1
+            if node.index.name == self.quadrature_index:
+                self._record_quadrature_point(trip, body)
+            add_operation_counts(counts, body, trip)
+
+        elif isinstance(node, (L.Scope, L.Namespace, L.Else)):
+            add_operation_counts(counts, self.count(node.body))
+
+        elif isinstance(node, (L.If, L.ElseIf, L.While, L.Do)):
+            count_expr_operations(node.condition, counts)
+            add_operation_counts(counts, self.count(node.body))
+
+        elif isinstance(node, L.Switch):
+            # Only one case is executed, estimate the most expensive one
+            cases = [self.count(body) for value, body in node.cases]
+            if node.default is not None:
+                cases.append(self.count(node.default))
+            add_operation_counts(counts, max_operation_counts(cases))
+
+        elif isinstance(node, L.Statement):
+            count_expr_operations(node.expr, counts)
+
+        elif isinstance(node, L.VariableDecl):
+            if node.value is not None:
+                count_expr_operations(node.value, counts)
+
+        elif isinstance(node, L.ArrayDecl):
+            size = product(node.sizes)
+            if "static" in node.typename.split():
+                self.tables[node.symbol.name] = size * typename_size(node.typename)
+            else:
+                self.temporaries[node.symbol.name] = size
+                self.temporary_bytes += size * typename_size(node.typename)
+
+        return counts
+
+
+def estimate_kernel_cost(code, quadrature_index, element_tensor_shape):
+    """Estimate the cost of a generated tabulate_tensor body.
+
+    Returns a dict with operation counts per cell and per quadrature point
+    (keyed by number of points), static table sizes in bytes, stack
+    temporary array sizes, and the element tensor size.
+    """
+    estimator = CostEstimator(quadrature_index)
+    per_cell = estimator.count(L.as_cstatement(code))
+
+    A_size = product(element_tensor_shape)
+    return {
+        "operations_per_cell": per_cell,
+        "flops_per_cell": count_flops(per_cell),
+        "operations_per_point": estimator.per_point,
+        "tables": estimator.tables,
+        "table_bytes": sum(estimator.tables.values()),
+        "temporaries": estimator.temporaries,
+        "temporary_bytes": estimator.temporary_bytes,
+        "element_tensor_size": A_size,
+        "element_tensor_bytes": 8 * A_size,
+        "unknown_trip_counts": estimator.unknown_trip_counts,
+        }
@@ -23,19 +23,50 @@ from six.moves import zip
 from six.moves import xrange as range
 
 from ufl import product
-from ufl.classes import ConstantValue
+from ufl.classes import ConstantValue, Coefficient, QuadratureWeight
+from ufl.checks import is_cellwise_constant
+
+import numpy
 
 from ffc.log import error
 
-from uflacs.analysis.modified_terminals import analyse_modified_terminal, is_modified_terminal
+from uflacs.params import default_parameters
+from uflacs.elementtables.table_utils import strip_table_zeros
+
+
+def tiled_accumulation_is_profitable(num_points, block_size, num_monomials, max_tile_size):
+    """Estimate if accumulating a dofblock in a local tile reduces memory traffic.
+
+    Accumulating directly into the element tensor loads and stores each
+    block entry in every quadrature point. A tile is reset, accumulated
+    in registers or cache, and added to the element tensor once, at the
+    cost of storing the monomial factors for each quadrature point.
+    """
+    if num_points <= 1 or block_size > max_tile_size:
+        return False
+    direct_cost = 2 * num_points * block_size
+    tiled_cost = 3 * block_size + num_points * num_monomials
+    return tiled_cost < direct_cost
 
 
 class IntegralGenerator(object):
 
-    def __init__(self, ir, backend):
+    def __init__(self, ir, backend, parameters=None):
         # Store ir
         self.ir = ir
 
+        # Store parameters, already merged with the defaults by the caller
+        if parameters is None:
+            parameters = default_parameters()
+        self.parameters = parameters
+
+        # C types of intermediate values and of static tables
+        self.scalar_type = str(self.parameters["scalar_type"])
+        self.table_type = str(self.parameters["table_type"] or self.scalar_type)
+        for typename in (self.scalar_type, self.table_type):
+            if typename not in ("double", "float", "long double"):
+                error("Invalid floating point type '{0}'.".format(typename))
+
         # Consistency check on quadrature rules
         nps1 = sorted(iterkeys(ir["uflacs"]["expr_ir"]))
         nps2 = sorted(iterkeys(ir["quadrature_rules"]))
@@ -61,8 +92,19 @@ class IntegralGenerator(object):
         # - language: for translating ufl operators to target language
         # - definintions: for defining backend specific variables
         # - access: for accessing backend specific variables
+        # - symbols: for naming backend specific symbols
         self.backend = backend
 
+        # num_points -> argument table ranges overriding
+        # modified_argument_table_ranges in the current kernel variant
+        self._argument_table_ranges = {}
+
+        # num_points -> set of monomials (argument_factorization keys) or
+        # tiled dofblocks whose contribution is assigned rather than added to
+        # the element tensor, computed along with the tensor reset in generate_tensor_reset
+        self._assigned_monomials = {}
+        self._assigned_tiles = {}
+
     def generate_using_statements(self):
         L = self.backend.language
         return [L.Using(name) for name in sorted(self._using_names)]
@@ -72,6 +114,10 @@ class IntegralGenerator(object):
         includes.update(self.backend.definitions.get_includes())
         return sorted(includes)
 
+    def get_element_tensor_shape(self):
+        "Return shape of the element tensor, with doubled dimensions for interior facet integrals."
+        return tuple(self._A_shape)
+
     def generate(self):
         """Generate entire tabulate_tensor body.
 
@@ -85,7 +131,21 @@ class IntegralGenerator(object):
         parts += self.backend.definitions.initial()
         parts += self.generate_quadrature_tables()
         parts += self.generate_element_tables()
-        parts += self.generate_tensor_reset()
+
+        if self.specialize_interior_facets():
+            parts += self.generate_interior_facet_switch()
+        else:
+            parts += self.generate_tensor_reset()
+            parts += self.generate_integrals()
+
+        parts += self.generate_finishing_statements()
+
+        return L.StatementList(parts)
+
+    def generate_integrals(self):
+        "Generate piecewise computations and quadrature loops for each quadrature rule."
+        L = self.backend.language
+        parts = []
 
         # If we have integrals with different number of quadrature points,
         # we wrap each integral in a separate scope, avoiding having to
@@ -97,6 +157,12 @@ class IntegralGenerator(object):
         # Reset variables, separate sets for quadrature loop
         self.vaccesses = { num_points: {} for num_points in all_num_points }
 
+        # Code to be inserted before each quadrature loop
+        self._quadrature_preloop = { num_points: [] for num_points in all_num_points }
+
+        # Accumulations using products hoisted out of the innermost argument loop
+        self._hoisted_accumulations = {}
+
         for num_points in all_num_points:
             pp = self.generate_piecewise_partition(num_points)
             ql = self.generate_quadrature_loops(num_points)
@@ -105,10 +171,104 @@ class IntegralGenerator(object):
                 parts += [L.Scope([pp, ql])]
             else:
                 parts += [pp, ql]
+        return parts
 
-        parts += self.generate_finishing_statements()
+    def num_table_entities(self):
+        "Return the number of entities in the element tables, or None if there are no tables."
+        expr_irs = self.ir["uflacs"]["expr_ir"]
+        sizes = set(table.shape[0]
+                    for num_points in expr_irs
+                    for table in self.get_unique_tables(num_points).values())
+        return max(sizes) if sizes else None
+
+    def specialize_interior_facets(self):
+        "Check if interior facet integrals should be specialized for each facet pair."
+        return (self.ir["integral_type"] == "interior_facet"
+                and self.parameters["specialize_interior_facets"]
+                and self.num_table_entities() is not None)
+
+    def generate_interior_facet_switch(self):
+        """Generate a variant of the integrals for each pair of facets, selected by switch statements.
+
+        Within each variant the facet numbers are literals, and argument
+        dof ranges are narrowed to the nonzero columns of the tables on the
+        given facets, such that blocks of the element tensor which are zero
+        for this facet pair are skipped.
+        """
+        L = self.backend.language
+        symbols = self.backend.symbols
+        num_facets = self.num_table_entities()
+        facet0 = symbols.entity("facet", "+")
+        facet1 = symbols.entity("facet", "-")
+
+        outer_cases = []
+        for f0 in range(num_facets):
+            inner_cases = []
+            for f1 in range(num_facets):
+                entities = {"+": f0, "-": f1}
+                symbols.fixed_entities = {("facet", r): f for r, f in iteritems(entities)}
+                self._argument_table_ranges = {
+                    num_points: self.specialized_argument_table_ranges(num_points, entities)
+                    for num_points in self.ir["uflacs"]["expr_ir"]
+                    }
+                try:
+                    body = self.generate_tensor_reset() + self.generate_integrals()
+                finally:
+                    symbols.fixed_entities = {}
+                    self._argument_table_ranges = {}
+                inner_cases.append((f1, L.StatementList(body)))
+            outer_cases.append((f0, L.Switch(facet1, inner_cases)))
+
+        parts = [L.Comment("Kernel variants specialized for each pair of facets"),
+                 L.Switch(facet0, outer_cases)]
+        return parts
 
-        return L.StatementList(parts)
+    def specialized_argument_table_ranges(self, num_points, entities):
+        """Narrow argument table ranges to the nonzero table columns on fixed entities.
+
+        The entities argument maps restriction to entity number.
+        """
+        expr_ir = self.ir["uflacs"]["expr_ir"][num_points]
+        tables = self.get_unique_tables(num_points)
+        MA = expr_ir["modified_arguments"]
+        ranges = []
+        for ma, (uname, begin, end) in enumerate(expr_ir["modified_argument_table_ranges"]):
+            entity = entities.get(MA[ma].restriction)
+            if entity is not None and begin < end:
+                b, e, unused = strip_table_zeros(tables[uname][entity])
+                begin, end = begin + b, begin + e
+            ranges.append((uname, begin, end))
+        return ranges
+
+    def get_argument_table_ranges(self, num_points):
+        "Return the (name, begin, end) ranges of argument tables used to build dofblocks."
+        ranges = self._argument_table_ranges.get(num_points)
+        if ranges is None:
+            ranges = self.ir["uflacs"]["expr_ir"][num_points]["modified_argument_table_ranges"]
+        return ranges
+
+    def get_unique_tables(self, num_points):
+        "Return the element tables for num_points, including tables with quadrature weights folded in."
+        expr_ir = self.ir["uflacs"]["expr_ir"][num_points]
+        weighted_tables = expr_ir.get("weighted_tables")
+        if not weighted_tables:
+            return expr_ir["unique_tables"]
+        weights = numpy.asarray(self.ir["quadrature_rules"][num_points][0])
+        tables = dict(expr_ir["unique_tables"])
+        for name, table in iteritems(weighted_tables):
+            tables[name] = table * weights[numpy.newaxis, :, numpy.newaxis]
+        return tables
+
+    def quadrature_weights_needed(self, num_points):
+        "Check if the quadrature weights are used by the integrand, they are not if folded into tables."
+        expr_ir = self.ir["uflacs"]["expr_ir"].get(num_points)
+        if expr_ir is None:
+            return True
+        for i, mt in enumerate(expr_ir["modified_terminals"]):
+            if (mt is not None and isinstance(mt.terminal, QuadratureWeight)
+                    and (expr_ir["piecewise"][i] or expr_ir["varying"][i])):
+                return True
+        return False
 
     def generate_quadrature_tables(self):
         "Generate static tables of quadrature points and weights."
@@ -134,11 +294,12 @@ class IntegralGenerator(object):
             wname = self.backend.access.weights_array_name(num_points)
             pname = self.backend.access.points_array_name(num_points)
 
-            parts += [L.ArrayDecl("static const double", wname, num_points, weights)]
+            if self.quadrature_weights_needed(num_points):
+                parts += [L.ArrayDecl("static const " + self.table_type, wname, num_points, weights)]
             if pdim > 0:
                 # Flatten array:
                 points = points.reshape(product(points.shape))
-                parts += [L.ArrayDecl("static const double", pname, num_points * pdim, points)]
+                parts += [L.ArrayDecl("static const " + self.table_type, pname, num_points * pdim, points)]
 
         return parts
 
@@ -152,7 +313,7 @@ class IntegralGenerator(object):
                   L.Comment("Table dimensions: num_entities, num_points, num_dofs")]
         expr_irs = self.ir["uflacs"]["expr_ir"]
         for num_points in sorted(expr_irs):
-            tables = expr_irs[num_points]["unique_tables"]
+            tables = self.get_unique_tables(num_points)
 
             comment = "Definitions of {0} tables for {1} quadrature points".format(len(tables), num_points)
             parts += [L.Comment(comment)]
@@ -160,26 +321,129 @@ class IntegralGenerator(object):
             for name in sorted(tables):
                 table = tables[name]
                 if product(table.shape) > 0:
-                    parts += [L.ArrayDecl("static const double", name, table.shape, table)]
+                    parts += [L.ArrayDecl("static const " + self.table_type, name, table.shape, table)]
         return parts
 
+    def get_monomial_dofblocks(self, num_points):
+        """Return list of (monomial, dofblock) for the monomials contributing to the element tensor.
+
+        Monomials with an empty dofrange for any argument are skipped.
+        """
+        expr_ir = self.ir["uflacs"]["expr_ir"][num_points]
+        MATR = self.get_argument_table_ranges(num_points)
+        monomials = []
+        for mas in sorted(expr_ir["argument_factorization"]):
+            dofblock = tuple(tuple(MATR[j][1:3]) for j in mas)
+            if all(dofrange[0] != dofrange[1] for dofrange in dofblock):
+                monomials.append((mas, dofblock))
+        return monomials
+
+    def get_tiled_dofblocks(self, num_points):
+        """Return the sorted list of dofblocks accumulated in local tiles.
+
+        Tiles are only used if enabled by the parameter enable_tiled_accumulation,
+        and for dofblocks where the cost model estimates a reduction of memory traffic.
+        """
+        if not self.parameters["enable_tiled_accumulation"] or self.ir["rank"] == 0:
+            return []
+        max_tile_size = self.parameters["max_tile_size"]
+        num_monomials = {}
+        for mas, dofblock in self.get_monomial_dofblocks(num_points):
+            num_monomials[dofblock] = num_monomials.get(dofblock, 0) + 1
+        return [dofblock for dofblock in sorted(num_monomials)
+                if tiled_accumulation_is_profitable(num_points,
+                                                    product([e - b for b, e in dofblock]),
+                                                    num_monomials[dofblock],
+                                                    max_tile_size)]
+
+    def analyse_tensor_blocks(self):
+        """Analyse which blocks of the element tensor are written by the monomials.
+
+        Returns (assigned_monomials, assigned_tiles, assigned), where
+        assigned_monomials and assigned_tiles map num_points to the set of
+        monomials and tiled dofblocks that can assign instead of add
+        their contribution, and assigned is a boolean array with the shape
+        of the element tensor marking the entries written by assignment.
+
+        A monomial can be assigned when it is evaluated without a quadrature
+        loop and no entry of its dofblock is written before it in the
+        generated code. For each num_points, the monomials accumulated
+        directly are emitted first in order of dofblock and argument
+        factorization key, followed by the tiled dofblocks which are
+        written once after the quadrature loop.
+        """
+        expr_irs = self.ir["uflacs"]["expr_ir"]
+
+        written = numpy.zeros(self._A_shape, dtype=bool)
+        assigned = numpy.zeros(self._A_shape, dtype=bool)
+        assigned_monomials = {}
+        assigned_tiles = {}
+
+        def block_slices(dofblock):
+            return tuple(slice(b, e) for b, e in dofblock)
+
+        for num_points in sorted(expr_irs):
+            assigned_monomials[num_points] = set()
+            assigned_tiles[num_points] = set()
+
+            tiled = self.get_tiled_dofblocks(num_points)
+            monomials = sorted(self.get_monomial_dofblocks(num_points), key=lambda x: (x[1], x[0]))
+            for mas, dofblock in monomials:
+                if dofblock in tiled:
+                    continue
+                sl = block_slices(dofblock)
+                if num_points == 1 and not numpy.any(written[sl]):
+                    assigned_monomials[num_points].add(mas)
+                    assigned[sl] = True
+                written[sl] = True
+
+            for dofblock in tiled:
+                sl = block_slices(dofblock)
+                if not numpy.any(written[sl]):
+                    assigned_tiles[num_points].add(dofblock)
+                    assigned[sl] = True
+                written[sl] = True
+
+        return assigned_monomials, assigned_tiles, assigned
+
     def generate_tensor_reset(self):
-        "Generate statements for resetting the element tensor to zero."
-        L = self.backend.language
+        """Generate statements for resetting the element tensor to zero.
 
-        # Could move this to codeutils or backend
-        def memzero(ptrname, size): # FIXME: Make CStatement Memzero
-            tmp = "memset({ptrname}, 0, {size} * sizeof(*{ptrname}));"
-            code = tmp.format(ptrname=ptrname, size=size)
-            return L.VerbatimStatement(code)
+        Entries that are written by assignment are not reset. If the
+        remaining entries do not form a few contiguous ranges, the
+        entire tensor is reset instead.
+        """
+        L = self.backend.language
 
         # Compute tensor size
         A_size = product(self._A_shape)
         A = self.backend.access.element_tensor_name()
 
+        # Find entries that need a reset
+        self._assigned_monomials, self._assigned_tiles, assigned = self.analyse_tensor_blocks()
+        reset = numpy.logical_not(assigned.reshape(A_size))
+
+        # Find contiguous ranges of entries to reset
+        ranges = []
+        for i in numpy.nonzero(reset)[0]:
+            if ranges and ranges[-1][1] == i:
+                ranges[-1][1] = i + 1
+            else:
+                ranges.append([i, i + 1])
+
         parts = []
-        parts += [L.Comment("Reset element tensor")]
-        parts += [memzero(A, A_size)]
+        if not ranges:
+            parts += [L.Comment("Every entry of the element tensor is assigned, no reset needed")]
+        elif len(ranges) > self.parameters["max_tensor_reset_ranges"] or ranges == [[0, A_size]]:
+            parts += [L.Comment("Reset element tensor")]
+            parts += [L.MemZero(A, A_size)]
+        else:
+            parts += [L.Comment("Reset entries of element tensor not assigned below")]
+            for b, e in ranges:
+                if e - b == 1:
+                    parts += [L.Assign(L.ArrayAccess(A, int(b)), 0.0)]
+                else:
+                    parts += [L.MemZero(A, int(e - b), int(b))]
         return parts
 
     def generate_quadrature_loops(self, num_points):
@@ -187,9 +451,22 @@ class IntegralGenerator(object):
         L = self.backend.language
         parts = []
 
+        # Prepare storage of monomial factors for tiled accumulation
+        tiled = self.get_tiled_dofblocks(num_points)
+        self._tile_factors = self.get_tile_factors(num_points, tiled)
+        if self._tile_factors:
+            fw = self.tile_factors_array_name(num_points)
+            parts += [L.Comment("Monomial factors in each quadrature point for tiled accumulation"),
+                      L.ArrayDecl(self.scalar_type, fw, (num_points, len(self._tile_factors)))]
+
         body = self.generate_quadrature_body(num_points)
         iq = self.backend.access.quadrature_loop_index()
 
+        # Precomputations for all quadrature points, collected while generating the body
+        if self._quadrature_preloop[num_points]:
+            parts += [L.Comment("Coefficients evaluated in all quadrature points")]
+            parts += self._quadrature_preloop[num_points]
+
         if num_points == 1:
             # Wrapping body in Scope to avoid thinking about scoping issues
             # TODO: Specialize generated code with iq=0 instead of defining iq here.
@@ -199,6 +476,10 @@ class IntegralGenerator(object):
 
         else:
             parts += [L.ForRange(iq, 0, num_points, body=body)]
+
+        # Accumulate tiled dofblocks after the quadrature loop
+        for dofblock in tiled:
+            parts += self.generate_tiled_accumulation(num_points, dofblock)
         return parts
 
     def generate_quadrature_body(self, num_points):
@@ -210,16 +491,88 @@ class IntegralGenerator(object):
         if parts:
             parts = [L.Comment("Quadrature loop body setup (num_points={0})".format(num_points))] + parts
 
-        # Compute single argument partitions outside of the dofblock loops
-        for iarg in range(self.ir["rank"]):
-            for dofrange in []:  # TODO: Move f*arg0 out here
-                parts += self.generate_argument_partition(num_points, iarg, dofrange)
+        # Store monomial factors used in tiled dofblocks
+        parts += self.generate_tile_factors_storage(num_points)
 
         # Nested argument loops and accumulation into element tensor
         parts += self.generate_quadrature_body_dofblocks(num_points)
 
         return parts
 
+    def tile_factors_array_name(self, num_points):
+        return "fw{0}".format(num_points)
+
+    def get_tile_factors(self, num_points, tiled):
+        """Return sorted list of the varying monomial factors (V indices) used in tiled dofblocks.
+
+        Piecewise constant factors are accessed directly in the tiled
+        accumulation and need no storage.
+        """
+        expr_ir = self.ir["uflacs"]["expr_ir"][num_points]
+        AF = expr_ir["argument_factorization"]
+        varying = expr_ir["varying"]
+        factors = set()
+        for mas, dofblock in self.get_monomial_dofblocks(num_points):
+            if dofblock in tiled and varying[AF[mas]]:
+                factors.add(AF[mas])
+        return sorted(factors)
+
+    def generate_tile_factors_storage(self, num_points):
+        "Generate storage of varying monomial factors for tiled accumulation in the quadrature loop body."
+        L = self.backend.language
+        parts = []
+        V = self.ir["uflacs"]["expr_ir"][num_points]["V"]
+        fw = self.tile_factors_array_name(num_points)
+        iq = self.backend.access.quadrature_loop_index()
+        for k, factor_index in enumerate(self._tile_factors):
+            fexpr = self.vaccesses[num_points][V[factor_index]]
+            parts += [L.Assign(L.ArrayAccess(fw, (iq, k)), fexpr)]
+        return parts
+
+    def generate_tiled_accumulation(self, num_points, dofblock):
+        """Generate accumulation of a dofblock into a local tile in a separate quadrature loop.
+
+        The tile is added to (or assigned to) the element tensor after the loop.
+        """
+        L = self.backend.language
+        expr_ir = self.ir["uflacs"]["expr_ir"][num_points]
+        V = expr_ir["V"]
+        fw = self.tile_factors_array_name(num_points)
+        iq = self.backend.access.quadrature_loop_index()
+
+        # Access to stored varying factors
+        factor_accesses = {V[factor_index]: L.ArrayAccess(fw, (iq, k))
+                           for k, factor_index in enumerate(self._tile_factors)}
+
+        # Tile indexing relative to the dofblock
+        tile = L.Symbol("BT")
+        tile_shape = tuple(e - b for b, e in dofblock)
+        idofs = [self.backend.access.argument_loop_index(i) for i in range(self.ir["rank"])]
+        tile_access = L.ArrayAccess(tile, tuple(L.Sub(idof, b) for idof, (b, e) in zip(idofs, dofblock)))
+
+        # Accumulate all monomials of this dofblock in the tile
+        body = [L.AssignAdd(tile_access, prod)
+                for args, prod in self.get_monomial_products(num_points, dofblock, factor_accesses)]
+        for iarg in reversed(range(self.ir["rank"])):
+            body = L.ForRange(idofs[iarg], dofblock[iarg][0], dofblock[iarg][1], body=body)
+        accumulate = L.ForRange(iq, 0, num_points, body=body)
+
+        # Write tile to element tensor
+        A_access = self.backend.access.element_tensor_entry(idofs, self._A_shape)
+        if dofblock in self._assigned_tiles.get(num_points, ()):
+            write = L.Assign(A_access, tile_access)
+        else:
+            write = L.AssignAdd(A_access, tile_access)
+        for iarg in reversed(range(self.ir["rank"])):
+            write = L.ForRange(idofs[iarg], dofblock[iarg][0], dofblock[iarg][1], body=write)
+
+        parts = [L.Comment("Tiled accumulation of dofblock {0}".format(", ".join("[{0}, {1})".format(b, e)
+                                                                               for b, e in dofblock))),
+                 L.Scope([L.ArrayDecl(self.scalar_type, tile, tile_shape, values=0),
+                          accumulate,
+                          write])]
+        return parts
+
     def generate_quadrature_body_dofblocks(self, num_points, outer_dofblock=()):
         parts = []
         L = self.backend.language
@@ -232,57 +585,73 @@ class IntegralGenerator(object):
             return parts
         assert iarg < self.ir["rank"]
 
-        expr_ir = self.ir["uflacs"]["expr_ir"][num_points]
-        # tuple(modified_argument_indices) -> code_index
-        AF = expr_ir["argument_factorization"]
-
-        # modified_argument_index -> (tablename, dofbegin, dofend)
-        MATR = expr_ir["modified_argument_table_ranges"]
-
-        # Find dofranges at this loop level iarg starting with outer_dofblock
+        # Find dofranges at this loop level iarg starting with outer_dofblock,
+        # skipping dofblocks accumulated in tiles after the quadrature loop
+        tiled = self.get_tiled_dofblocks(num_points)
         dofranges = set()
-        for mas in AF:
-            mas_full_dofblock = tuple(MATR[j][1:3] for j in mas)
+        for mas, mas_full_dofblock in self.get_monomial_dofblocks(num_points):
+            if mas_full_dofblock in tiled:
+                continue
             if tuple(mas_full_dofblock[:iarg]) == tuple(outer_dofblock):
-                dofrange = mas_full_dofblock[iarg]
-                # Skip empty dofranges TODO: Possible to remove these and related code earlier?
-                if dofrange[0] != dofrange[1]:
-                    dofranges.add(dofrange)
+                dofranges.add(mas_full_dofblock[iarg])
         dofranges = sorted(dofranges)
 
         # Build loops for each dofrange
         for dofrange in dofranges:
             dofblock = outer_dofblock + (dofrange,)
 
+            # Compute products invariant in the innermost argument loop at this level
+            body = []
+            if iarg == self.ir["rank"] - 2:
+                body += self.generate_argument_partition(num_points, dofblock)
+
             # Generate nested inner loops (only triggers for forms with two or more arguments
-            body = self.generate_quadrature_body_dofblocks(num_points, dofblock)
+            body += self.generate_quadrature_body_dofblocks(num_points, dofblock)
 
             # Wrap setup, subloops, and accumulation in a loop for this level
             idof = self.backend.access.argument_loop_index(iarg)
             parts += [L.ForRange(idof, dofrange[0], dofrange[1], body=body)]
         return parts
 
-    def generate_partition(self, name, V, partition, table_ranges, num_points):
+    def generate_partition(self, name, V, partition, table_ranges, num_points, precomputed_coefficients=None):
+        """Generate definitions of terminals and computation of intermediates in a partition.
+
+        Varying coefficients are defined together such that evaluations
+        sharing coefficient dofs can be fused. If precomputed_coefficients
+        is an array name, the coefficients are evaluated in all quadrature
+        points before the quadrature loop, stored in this array.
+        """
         L = self.backend.language
 
         definitions = []
         intermediates = []
+        coefficient_data = []
+        fuse_coefficients = self.parameters["fuse_coefficient_evaluation"]
 
         vaccesses = self.vaccesses[num_points]
 
+        # V-index -> ModifiedTerminal, analysed when building the ir
+        modified_terminals = self.ir["uflacs"]["expr_ir"][num_points]["modified_terminals"]
+
         partition_indices = [i for i, p in enumerate(partition) if p]
         for i in partition_indices:
             v = V[i]
 
-            if is_modified_terminal(v):
-                mt = analyse_modified_terminal(v)
+            mt = modified_terminals[i]
+            if mt is not None:
                 # Backend specific modified terminal translation
                 vaccess = self.backend.access(mt.terminal, mt, table_ranges[i], num_points)
-                vdef = self.backend.definitions(mt.terminal, mt, table_ranges[i], vaccess)
 
-                # Store definitions of terminals in list
-                if vdef is not None:
-                    definitions.append(vdef)
+                if (fuse_coefficients and isinstance(mt.terminal, Coefficient)
+                        and not is_cellwise_constant(mt.terminal)):
+                    # Defer definitions of varying coefficients to fuse them below
+                    coefficient_data.append((mt, table_ranges[i], vaccess))
+                else:
+                    vdef = self.backend.definitions(mt.terminal, mt, table_ranges[i], vaccess)
+
+                    # Store definitions of terminals in list
+                    if vdef is not None:
+                        definitions.append(vdef)
             else:
                 # Get previously visited operands (TODO: use edges of V instead of ufl_operands?)
                 vops = [vaccesses[op] for op in v.ufl_operands]
@@ -312,12 +681,22 @@ class IntegralGenerator(object):
             # Store access node for future reference
             vaccesses[v] = vaccess
 
+        # Fused definitions of varying coefficients
+        if coefficient_data:
+            if precomputed_coefficients is None:
+                precomputed = None
+            else:
+                precomputed = (precomputed_coefficients, num_points)
+            precode, code = self.backend.definitions.coefficients(coefficient_data, precomputed)
+            self._quadrature_preloop[num_points] += precode
+            definitions = code + definitions
+
         parts = []
         # Compute all terminals first
         parts += definitions
         if intermediates:
             # Declare array large enough to hold all subexpressions we've emitted
-            parts += [L.ArrayDecl("double", name, len(intermediates))]
+            parts += [L.ArrayDecl(self.scalar_type, name, len(intermediates))]
             # Then add all computations
             parts += intermediates
         return parts
@@ -388,7 +767,7 @@ class IntegralGenerator(object):
         # Then add all computations
         if intermediates:
             # Declare array large enough to hold all subexpressions we've emitted
-            parts += [L.ArrayDecl("double", name, len(intermediates))]
+            parts += [L.ArrayDecl(self.scalar_type, name, len(intermediates))]
             parts += intermediates
         return parts
 
@@ -413,41 +792,126 @@ class IntegralGenerator(object):
         L = self.backend.language
         expr_ir = self.ir["uflacs"]["expr_ir"][num_points]
         arrayname = "sv{0}".format(num_points)
+        if self.parameters["precompute_coefficients"] and num_points > 1:
+            precomputed = "wq{0}".format(num_points)
+        else:
+            precomputed = None
         parts = self.generate_partition(arrayname,
                                         expr_ir["V"],
                                         expr_ir["varying"],
                                         expr_ir["table_ranges"],
-                                        num_points)
+                                        num_points,
+                                        precomputed)
         if parts:
             parts.insert(0, L.Comment("Section for geometrically varying computations"))
         return parts
 
-    def generate_argument_partition(self, num_points, iarg, dofrange):
-        """Generate code for the partition corresponding to arguments 0..iarg within given dofblock."""
-        parts = []
-        # TODO: What do we want to do here? Define!
-        # Should this be a single loop over i0, i1 separately
-        # outside of the double loop over (i0,i1)?
-        return parts
+    def get_argument_partition(self, num_points, outer_dofblock):
+        """Return the accumulations of dofblocks inside outer_dofblock with the invariant products hoisted.
 
-    def generate_integrand_accumulation(self, num_points, dofblock):
+        The dofblocks are those of the innermost argument loops nested in
+        the dof loops of outer_dofblock. Monomials of a dofblock sharing
+        the last argument are grouped, such that
+
+            A[i0, i1] += f*FE0[i0]*FE1[i1] + g*FE2[i0]*FE1[i1]
+
+        becomes (f*FE0[i0] + g*FE2[i0])*FE1[i1] with the first factor
+        invariant in the innermost loop.
+
+        Returns (hoisted, accumulations), where hoisted is the list
+        of invariant product expressions and accumulations is a dict
+        mapping each dofblock to a list of (monomials, expression index
+        into hoisted or None, product expression).
+        """
+        tiled = self.get_tiled_dofblocks(num_points)
+        dofblocks = sorted(set(dofblock for mas, dofblock in self.get_monomial_dofblocks(num_points)
+                               if dofblock not in tiled and tuple(dofblock[:-1]) == tuple(outer_dofblock)))
+
+        hoisted = []
+        accumulations = {}
+        for dofblock in dofblocks:
+            # Group monomials by last argument, in order of first appearance
+            keys = []
+            groups = {}
+            for args, factors in self.get_monomial_factors(num_points, dofblock):
+                key = args[-1]
+                if key not in groups:
+                    keys.append(key)
+                    groups[key] = []
+                groups[key].append((args, factors))
+
+            accumulations[dofblock] = []
+            for key in keys:
+                group = groups[key]
+                monomials = [args for args, factors in group]
+                last = group[0][1][-1]
+                if len(group) == 1 and len(group[0][1]) <= 2:
+                    # Single binary product, nothing to hoist
+                    accumulations[dofblock].append((monomials, None, group[0][1]))
+                else:
+                    prefixes = [self.backend.language.Product(factors[:-1]) for args, factors in group]
+                    if len(prefixes) == 1:
+                        expr = prefixes[0]
+                    else:
+                        expr = self.backend.language.Sum(prefixes)
+                    accumulations[dofblock].append((monomials, len(hoisted), [last]))
+                    hoisted.append(expr)
+        return hoisted, accumulations
+
+    def argument_partition_array_name(self, num_points):
+        return "sa{0}".format(num_points)
+
+    def generate_argument_partition(self, num_points, outer_dofblock):
+        """Generate code for the partition of products invariant in the innermost argument loops within outer_dofblock.
+
+        The monomial factors and the tables of all but the last
+        argument are multiplied in the dof loops of outer_dofblock
+        instead of in the innermost dof loops.
+        """
         parts = []
+        if not self.parameters["hoist_loop_invariants"]:
+            return parts
+
         L = self.backend.language
+        hoisted, accumulations = self.get_argument_partition(num_points, outer_dofblock)
+        if not hoisted:
+            return parts
+
+        name = self.argument_partition_array_name(num_points)
+        parts += [L.Comment("Products invariant in the innermost argument loop"),
+                  L.ArrayDecl(self.scalar_type, name, len(hoisted))]
+        parts += [L.Assign(L.ArrayAccess(name, j), expr) for j, expr in enumerate(hoisted)]
+
+        # Store accumulations for generate_integrand_accumulation
+        for dofblock, accumulation in iteritems(accumulations):
+            self._hoisted_accumulations[(num_points, dofblock)] = [
+                (monomials, L.Product(([] if j is None else [L.ArrayAccess(name, j)]) + factors))
+                for monomials, j, factors in accumulation]
+        return parts
+
+    def get_monomial_factors(self, num_points, dofblock, factor_accesses=None):
+        """Return list of (monomial, factor expressions) for the monomials of a dofblock.
 
+        The factors are the monomial factor, omitted if it is one,
+        followed by the argument table accesses in argument order.
+        The optional dict factor_accesses maps factor expressions to
+        accesses to use instead of the variables of the quadrature loop body.
+        """
         expr_ir = self.ir["uflacs"]["expr_ir"][num_points]
-        AF = expr_ir["argument_factorization"]
         V = expr_ir["V"]
         MATR = expr_ir["modified_argument_table_ranges"]
+        block_ranges = self.get_argument_table_ranges(num_points)
         MA = expr_ir["modified_arguments"]
+        factor_accesses = factor_accesses or {}
 
-        idofs = [self.backend.access.argument_loop_index(i) for i in range(self.ir["rank"])]
+        monomials = []
 
         # Find the blocks to build: (TODO: This is rather awkward,
         # having to rediscover these relations here)
         arguments_and_factors = sorted(iteritems(expr_ir["argument_factorization"]),
                                        key=lambda x: x[0])
         for args, factor_index in arguments_and_factors:
-            if not all(tuple(dofblock[iarg]) == tuple(MATR[ma][1:3])
+            if not all(tuple(dofblock[iarg]) == tuple(block_ranges[ma][1:3])
                        for iarg, ma in enumerate(args)):
                 continue
 
@@ -459,7 +923,9 @@ class IntegralGenerator(object):
                 # TODO: Nicer way to check for f=1?
                 pass
             else:
-                fexpr = self.vaccesses[num_points][v]
+                fexpr = factor_accesses.get(v)
+                if fexpr is None:
+                    fexpr = self.vaccesses[num_points][v]
                 factors.append(fexpr)
 
             # Get table names
@@ -470,11 +936,40 @@ class IntegralGenerator(object):
 
             factors.extend(argfactors)
 
+            monomials.append((args, factors))
+        return monomials
+
+    def get_monomial_products(self, num_points, dofblock, factor_accesses=None):
+        """Return list of (monomial, product expression) for the monomials of a dofblock.
+
+        The optional dict factor_accesses maps factor expressions to
+        accesses to use instead of the variables of the quadrature loop body.
+        """
+        L = self.backend.language
+        return [(args, L.Product(factors))
+                for args, factors in self.get_monomial_factors(num_points, dofblock, factor_accesses)]
+
+    def generate_integrand_accumulation(self, num_points, dofblock):
+        parts = []
+        L = self.backend.language
+
+        idofs = [self.backend.access.argument_loop_index(i) for i in range(self.ir["rank"])]
+
+        # Use grouped monomials with hoisted invariant products if any, otherwise each monomial by itself
+        accumulation = self._hoisted_accumulations.get((num_points, dofblock))
+        if accumulation is None:
+            accumulation = [((args,), prod) for args, prod in self.get_monomial_products(num_points, dofblock)]
+
+        assigned = self._assigned_monomials.get(num_points, ())
+        for monomials, prod in accumulation:
             # Format index access to A
             A_access = self.backend.access.element_tensor_entry(idofs, self._A_shape)
 
-            # Emit assignment
-            parts += [L.AssignAdd(A_access, L.Product(factors))]
+            # Emit assignment, or accumulation if other monomials contribute to the same entries
+            if any(args in assigned for args in monomials):
+                parts += [L.Assign(A_access, prod)]
+            else:
+                parts += [L.AssignAdd(A_access, prod)]
 
         return parts
 
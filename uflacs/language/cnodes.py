@@ -182,20 +182,38 @@ class Null(CExprLiteral):
     def __eq__(self, other):
         return isinstance(other, Null)
 
+# Suffixes of float literals of each floating point type
+_float_literal_suffixes = {
+    "double": "",
+    "float": "f",
+    "long double": "L",
+    }
+
+def float_literal_suffix(typename):
+    """Return the float literal suffix for a (possibly qualified) type name.
+
+    Returns an empty string for non-floating point types.
+    """
+    qualifiers = ("static", "const", "constexpr", "volatile")
+    base = " ".join(w for w in typename.split() if w not in qualifiers)
+    return _float_literal_suffixes.get(base, "")
+
 class LiteralFloat(CExprLiteral):
-    "A floating point literal value."
-    __slots__ = ("value",)
+    "A floating point literal value, with an optional type suffix like 'f' for float."
+    __slots__ = ("value", "suffix")
     precedence = PRECEDENCE.LITERAL
 
-    def __init__(self, value):
+    def __init__(self, value, suffix=""):
         assert isinstance(value, (float, int, numpy.number))
         self.value = value
+        self.suffix = suffix
 
     def ce_format(self):
-        return format_float(self.value)
+        return format_float(self.value) + self.suffix
 
     def __eq__(self, other):
-        return isinstance(other, LiteralFloat) and self.value == other.value
+        return (isinstance(other, LiteralFloat) and self.value == other.value
+                and self.suffix == other.suffix)
 
     def __nonzero__(self):
         return bool(self.value)
@@ -884,9 +902,26 @@ class Throw(CStatement):
         self.message = message
 
     def cs_format(self):
-        assert '"' not in message
+        assert '"' not in self.message
         return "throw " + self.exception + '("' + self.message + '");'
 
+class MemZero(CStatement):
+    "Set a contiguous range of array entries to zero."
+    __slots__ = ("name", "size", "offset")
+    def __init__(self, name, size, offset=0):
+        self.name = as_symbol(name)
+        self.size = as_cexpr(size)
+        self.offset = as_cexpr(offset)
+
+    def cs_format(self):
+        name = self.name.ce_format()
+        size = self.size.ce_format()
+        if self.offset == LiteralInt(0):
+            ptr = name
+        else:
+            ptr = name + " + " + self.offset.ce_format()
+        return "memset(" + ptr + ", 0, " + size + " * sizeof(*" + name + "));"
+
 class Comment(CStatement):
     "Line comment(s) used for annotating the generated code with human readable remarks."
     __slots__ = ("comment",)
@@ -926,6 +961,9 @@ class VariableDecl(CStatement):
 
         if value is not None:
             value = as_cexpr(value)
+            # Give plain float literals the suffix of the declared type
+            if isinstance(value, LiteralFloat) and not value.suffix:
+                value = LiteralFloat(value.value, float_literal_suffix(typename))
         self.value = value
 
     def cs_format(self):
@@ -967,7 +1005,7 @@ def build_initializer_lists(values, sizes, level=0, formatter=str):
         return [build_1d_initializer_list(values, formatter)]
     else:
         # Render all sublists
-        parts = [build_initializer_lists(val, sizes[1:], level+1) for val in values]
+        parts = [build_initializer_lists(val, sizes[1:], level+1, formatter) for val in values]
         # Add comma after last line in each part except the last one
         for part in parts[:-1]:
             part[-1] += ","
@@ -1037,8 +1075,14 @@ class ArrayDecl(CStatement):
             # Zero initial values
             return decl + " = {};"
         else:
-            # Construct initializer lists for arbitrary multidimensional array values
-            initializer_lists = build_initializer_lists(self.values, self.sizes)
+            # Construct initializer lists for arbitrary multidimensional array values,
+            # with float values suffixed according to the declared type
+            suffix = float_literal_suffix(self.typename)
+            if suffix:
+                formatter = lambda v: str(v) + suffix if isinstance(v, (float, numpy.floating)) else str(v)
+            else:
+                formatter = str
+            initializer_lists = build_initializer_lists(self.values, self.sizes, formatter=formatter)
             if len(initializer_lists) == 1:
                 return decl + " = " + initializer_lists[0] + ";"
             else:
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011-2015 Martin Sandve Alnæs
+#
+# This file is part of UFLACS.
+#
+# UFLACS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UFLACS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
+
+"""Python language backend formatting the CNodes AST as vectorized numpy code.
+
+This module exports the same node interface as cnodes, such that
+code generators can build the AST with either module as language,
+and adds py_format and py_format_expr for formatting the AST as
+Python source instead of C++.
+
+The generated code evaluates a batch of cells at once. Arrays
+passed as input or output carry the cell axis last, such that
+indexing them with the same indices as in the C++ code gives an
+array of values over all cells, and every scalar operation in the
+generated code is an elementwise numpy operation over the cells.
+Entity numbers such as facet may be arrays of one entity per cell,
+indexing into tables with them uses numpy fancy indexing.
+"""
+
+import numpy
+
+from ffc.log import error
+
+from uflacs.language.cnodes import *
+from uflacs.language.cnodes import _is_zero
+from uflacs.language.format_lines import Indented, format_indented_lines
+from uflacs.language.format_value import format_float
+
+
+############## Expression formatting
+
+def _py_format_operand(o, parent_precedence, strict=False):
+    s = py_format_expr(o)
+    if o.precedence > parent_precedence or (strict and o.precedence == parent_precedence):
+        s = "(" + s + ")"
+    return s
+
+def _py_format_prefix(o, op):
+    return op + _py_format_operand(o.arg, o.precedence, strict=True)
+
+def _py_format_binop(o, op):
+    lhs = _py_format_operand(o.lhs, o.precedence)
+    rhs = _py_format_operand(o.rhs, o.precedence, strict=True)
+    return lhs + " " + op + " " + rhs
+
+_py_comparisons = (EQ, NE, LT, GT, LE, GE)
+
+def _py_format_comparison(o, op):
+    # Python chains comparisons, parenthesize nested ones on both sides
+    operands = []
+    for arg in (o.lhs, o.rhs):
+        s = py_format_expr(arg)
+        if isinstance(arg, _py_comparisons) or arg.precedence > o.precedence:
+            s = "(" + s + ")"
+        operands.append(s)
+    return operands[0] + " " + op + " " + operands[1]
+
+def _py_format_naryop(o, op):
+    args = [_py_format_operand(arg, o.precedence, strict=True) for arg in o.args]
+    return (" " + op + " ").join(args)
+
+def _py_format_call(function, args):
+    return function + "(" + ", ".join(py_format_expr(arg) for arg in args) + ")"
+
+def _py_format_array_access(o):
+    # Leading literal indices are applied one at a time, such
+    # that the outermost level can be a Python sequence like w,
+    # and the remaining indices as a tuple to let numpy handle
+    # per cell entity indices with fancy indexing
+    s = py_format_expr(o.array)
+    indices = list(o.indices)
+    while len(indices) > 1 and isinstance(indices[0], LiteralInt):
+        s += "[" + py_format_expr(indices.pop(0)) + "]"
+    return s + "[" + ", ".join(py_format_expr(i) for i in indices) + "]"
+
+def _py_format_literal_bool(o):
+    return "True" if o.value else "False"
+
+def _py_not_supported(o):
+    error("The Python language backend does not support {0}.".format(type(o).__name__))
+
+_py_expr_formatters = {
+    LiteralFloat: lambda o: format_float(o.value),
+    LiteralInt: lambda o: str(o.value),
+    LiteralBool: _py_format_literal_bool,
+    LiteralString: lambda o: repr(o.value),
+    Null: lambda o: "None",
+    Symbol: lambda o: o.name,
+    Neg: lambda o: _py_format_prefix(o, "-"),
+    Pos: lambda o: _py_format_prefix(o, "+"),
+    Not: lambda o: _py_format_call("numpy.logical_not", [o.arg]),
+    Add: lambda o: _py_format_binop(o, "+"),
+    Sub: lambda o: _py_format_binop(o, "-"),
+    Mul: lambda o: _py_format_binop(o, "*"),
+    Div: lambda o: _py_format_binop(o, "/"),
+    EQ: lambda o: _py_format_comparison(o, "=="),
+    NE: lambda o: _py_format_comparison(o, "!="),
+    LT: lambda o: _py_format_comparison(o, "<"),
+    GT: lambda o: _py_format_comparison(o, ">"),
+    LE: lambda o: _py_format_comparison(o, "<="),
+    GE: lambda o: _py_format_comparison(o, ">="),
+    And: lambda o: _py_format_call("numpy.logical_and", [o.lhs, o.rhs]),
+    Or: lambda o: _py_format_call("numpy.logical_or", [o.lhs, o.rhs]),
+    Sum: lambda o: _py_format_naryop(o, "+"),
+    Product: lambda o: _py_format_naryop(o, "*"),
+    ArrayAccess: _py_format_array_access,
+    Conditional: lambda o: _py_format_call("numpy.where", [o.condition, o.true, o.false]),
+    Call: lambda o: _py_format_call(py_format_expr(o.function), o.arguments),
+    }
+
+# Assignment operators are expressions in C but only valid as statements in Python
+_py_assign_operators = {
+    Assign: "=",
+    AssignAdd: "+=",
+    AssignSub: "-=",
+    AssignMul: "*=",
+    AssignDiv: "/=",
+    }
+
+def py_format_expr(o):
+    "Format a CExpr node as a Python expression string."
+    formatter = _py_expr_formatters.get(type(o))
+    if formatter is None:
+        _py_not_supported(o)
+    return formatter(o)
+
+
+############## Statement formatting
+
+def _has_code(lines):
+    "Check if formatted lines contain anything but comments."
+    if isinstance(lines, str):
+        return any(line.strip() and not line.strip().startswith("#")
+                   for line in lines.split("\n"))
+    elif isinstance(lines, Indented):
+        return _has_code(lines.body)
+    else:
+        return any(_has_code(part) for part in lines)
+
+def _py_format_body(body):
+    lines = py_format(body)
+    if not _has_code(lines):
+        lines = [lines, "pass"]
+    return Indented(lines)
+
+def _py_format_statement(o):
+    op = _py_assign_operators.get(type(o.expr))
+    if op is None:
+        return py_format_expr(o.expr)
+    return py_format_expr(o.expr.lhs) + " " + op + " " + py_format_expr(o.expr.rhs)
+
+def _py_format_variable_decl(o):
+    value = "None" if o.value is None else py_format_expr(o.value)
+    return o.symbol.name + " = " + value
+
+def _py_format_values(values):
+    if isinstance(values, (list, tuple, numpy.ndarray)):
+        return "[" + ", ".join(_py_format_values(v) for v in values) + "]"
+    return str(values)
+
+def _py_format_array_decl(o):
+    if o.values is None or _is_zero(o.values):
+        # Entries of temporary arrays are values over all cells,
+        # an object array lets each entry hold a numpy array
+        sizes = repr(tuple(int(n) for n in o.sizes))
+        return o.symbol.name + " = numpy.zeros(" + sizes + ", dtype=object)"
+    else:
+        floating = any(t in o.typename.split() for t in ("double", "float"))
+        end = "], dtype=" + ("float" if floating else "int") + ")"
+        values = numpy.asarray(o.values)
+        assert values.shape == o.sizes
+        if len(o.sizes) == 1:
+            return o.symbol.name + " = numpy.array(" + _py_format_values(values)[:-1] + end
+        rows = [_py_format_values(v) + "," for v in values]
+        rows[-1] = rows[-1][:-1]
+        return (o.symbol.name + " = numpy.array([", Indented(rows), end)
+
+def _py_format_memzero(o):
+    if isinstance(o.offset, LiteralInt) and isinstance(o.size, LiteralInt):
+        end = LiteralInt(int(o.offset) + int(o.size))
+    else:
+        end = Add(o.offset, o.size)
+    return (py_format_expr(o.name) + "[" + py_format_expr(o.offset) + ":"
+            + py_format_expr(end) + "] = 0.0")
+
+def _py_format_for_range(o):
+    return ("for " + py_format_expr(o.index) + " in range(" + py_format_expr(o.begin)
+            + ", " + py_format_expr(o.end) + "):",
+            _py_format_body(o.body))
+
+def _py_format_comment(o):
+    return ["# " + line.strip() for line in o.comment.strip().split("\n")]
+
+def _py_format_throw(o):
+    return "raise RuntimeError(" + repr(o.message) + ")"
+
+def _py_format_if(o, keyword):
+    return (keyword + " " + py_format_expr(o.condition) + ":",
+            _py_format_body(o.body))
+
+def _py_format_switch(o):
+    error("The Python language backend does not support switch statements, "
+          "the switch argument may vary between the cells of a batch.")
+
+_py_statement_formatters = {
+    StatementList: lambda o: [py_format(st) for st in o.statements],
+    Statement: _py_format_statement,
+    Using: lambda o: [],
+    Pragma: lambda o: [],
+    Break: lambda o: "break",
+    Continue: lambda o: "continue",
+    Return: lambda o: "return " + py_format_expr(o.value),
+    Throw: _py_format_throw,
+    Comment: _py_format_comment,
+    MemZero: _py_format_memzero,
+    VariableDecl: _py_format_variable_decl,
+    ArrayDecl: _py_format_array_decl,
+    Scope: lambda o: py_format(o.body),
+    If: lambda o: _py_format_if(o, "if"),
+    ElseIf: lambda o: _py_format_if(o, "elif"),
+    Else: lambda o: ("else:", _py_format_body(o.body)),
+    While: lambda o: _py_format_if(o, "while"),
+    ForRange: _py_format_for_range,
+    Switch: _py_format_switch,
+    }
+
+def py_format(o):
+    "Format a CStatement node as Python source lines, returns S: string | list(S) | Indented(S)."
+    formatter = _py_statement_formatters.get(type(o))
+    if formatter is None:
+        _py_not_supported(o)
+    return formatter(o)
+
+def format_python(o, level=0):
+    "Format a CStatement node as a Python source string."
+    return format_indented_lines(py_format(as_cstatement(o)), level)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011-2015 Martin Sandve Alnæs
+#
+# This file is part of UFLACS.
+#
+# UFLACS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UFLACS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tools for Python/numpy expression formatting."""
+
+from ufl.corealg.multifunction import MultiFunction
+
+from uflacs.language.ufl_to_cnodes import UFL2CNodesMixin
+
+# Numpy and scipy functions that are elementwise over arrays of cells,
+# with names differing from the cmath function names
+_numpy_function_names = {
+    "pow": "numpy.power",
+    "abs": "numpy.abs",
+    "min": "numpy.minimum",
+    "max": "numpy.maximum",
+    "acos": "numpy.arccos",
+    "asin": "numpy.arcsin",
+    "atan": "numpy.arctan",
+    "atan2": "numpy.arctan2",
+    "erf": "scipy.special.erf",
+    "erfc": "scipy.special.erfc",
+    "cyl_bessel_i": "scipy.special.iv",
+    "cyl_bessel_j": "scipy.special.jv",
+    "cyl_bessel_k": "scipy.special.kv",
+    "cyl_neumann": "scipy.special.yv",
+    }
+
+def numpy_function_name(name):
+    "Return the name of the numpy function corresponding to a cmath function."
+    return _numpy_function_names.get(name, "numpy." + name)
+
+class UFL2PyNodesMixin(UFL2CNodesMixin):
+    """Rules collection mixin for a UFL to PyNodes translator class.
+
+    Builds the same AST as the CNodes translator, only
+    with calls to numpy functions instead of cmath.
+    """
+
+    def _call(self, name, args):
+        return self.L.Call(numpy_function_name(name), args)
+
+    def power(self, o, a, b):
+        return self._call("pow", (a, b))
+
+    def _cmath(self, name, op):
+        return self._call(name, op)
+
+    def atan_2(self, o, y, x):
+        return self._call("atan2", (y, x))
+
+    def min_value(self, o, a, b):
+        return self._call("min", (a, b))
+
+    def max_value(self, o, a, b):
+        return self._call("max", (a, b))
+
+    def _bessel(self, o, n, v, name):
+        return self._call(name, (n, v))
+
+class UFL2PyNodesTranslator(MultiFunction, UFL2PyNodesMixin):
+    """UFL to PyNodes translator class."""
+    def __init__(self, language):
+        MultiFunction.__init__(self)
+        UFL2PyNodesMixin.__init__(self, language)
@@ -24,4 +24,17 @@ def default_parameters():
         "enable_factorization": False,  # True, # Fails for hyperelasticity demo in dolfin, needs debugging
         "max_registers": 1024,  # 8 B * 1024 = 8 KB # TODO: Tune this for something very complex
         "score_threshold": 3,  # TODO: Scoring is work in progress and this will change meaning later
+        "parallel_workers": 0,  # Number of processes building integrand irs, 0 for sequential, -1 for all cpus
+        "specialize_interior_facets": False,  # Generate a kernel variant for each facet pair in interior facet integrals
+        "max_tensor_reset_ranges": 8,  # Max number of separate ranges of the element tensor to reset, otherwise reset all
+        "enable_tiled_accumulation": False,  # Accumulate dofblocks in local tiles where the cost model finds it profitable
+        "max_tile_size": 1024,  # Max number of entries in a tile, 8 B * 1024 = 8 KB
+        "fuse_coefficient_evaluation": True,  # Evaluate all components and derivatives of a coefficient in one dof loop
+        "precompute_coefficients": False,  # Evaluate varying coefficients in all quadrature points before the quadrature loop
+        "scalar_type": "double",  # C type of intermediate values and accumulation in kernels, "double", "float" or "long double"
+        "table_type": None,  # C type of quadrature weights and element tables, defaults to scalar_type
+        "fold_weights_into_tables": False,  # Multiply quadrature weights into the tables of the first argument instead of the monomial factors
+        "reduce_divisions": False,  # Multiply by reciprocals of loop invariant, shared or literal denominators instead of dividing
+        "hoist_loop_invariants": False,  # Reassociate products by loop level and hoist argument invariant products out of the innermost dof loop
+        "reassociate_chains": False,  # Reassociate chains of sums and products into balanced trees grouped by loop level
     }
@@ -20,21 +20,24 @@
 
 
 from ufl import product
-from ufl.checks import is_cellwise_constant
+from ufl.classes import QuadratureWeight
 from uflacs.analysis.modified_terminals import is_modified_terminal, analyse_modified_terminal
 
 from uflacs.analysis.graph import build_graph
-from uflacs.analysis.graph_vertices import build_scalar_graph_vertices
+from uflacs.analysis.graph_vertices import traverse_unique_post_order
 from uflacs.analysis.graph_rebuild import rebuild_with_scalar_subexpressions
-from uflacs.analysis.graph_dependencies import (compute_dependencies,
-                                                mark_active, mark_image)
+from uflacs.analysis.graph_dependencies import mark_active
 from uflacs.analysis.graph_ssa import (compute_dependency_count,
                                        invert_dependencies,
                                        default_cache_score_policy,
                                        compute_cache_scores,
-                                       allocate_registers)
+                                       allocate_registers,
+                                       mark_partitions,
+                                       loop_level_partition_seed,
+                                       KERNEL_LEVEL, QUADRATURE_LEVEL)
+from uflacs.analysis.reassociation import rebalance_products, reassociate_chains, reduce_divisions
 
-from uflacs.analysis.factorization import compute_argument_factorization
+from uflacs.analysis.factorization import compute_argument_factorization, divide_monomials_by_factor
 
 
 def build_scalar_graph(expressions):
@@ -56,10 +59,25 @@ def build_scalar_graph(expressions):
 
     assert len(scalar_expressions) == sum(product(expr.ufl_shape) for expr in expressions)
 
-    # Build new list representation of graph where all vertices of V represent single scalar operations
-    e2i, V, target_variables = build_scalar_graph_vertices(scalar_expressions)
+    # Build new list representation of graph where all vertices of V represent single scalar operations,
+    # with the sparse dependency matrix built in the same traversal
+    e2i, V, target_variables, dependencies, shapes = \
+        traverse_unique_post_order(scalar_expressions, skip_terminal_modifiers=True,
+                                   build_dependencies=True)
 
-    return e2i, V, target_variables
+    return e2i, V, target_variables, dependencies
+
+
+def mark_loop_levels(V, target_variables, dependencies, rank):
+    """Mark the active vertices and the outermost loop level each vertex is invariant in.
+
+    Arguments are factored out of V, so the loop level of a vertex
+    is the kernel or quadrature loop level. Non-active vertices get level -1.
+    """
+    active, num_active = mark_active(dependencies, target_variables)
+    loop_levels = mark_partitions(V, active, dependencies, rank,
+                                  partition_seed=loop_level_partition_seed)
+    return active, loop_levels
 
 
 def compute_expr_ir(expressions, parameters):
@@ -82,12 +100,8 @@ def compute_expr_ir(expressions, parameters):
     if not isinstance(expressions, list):
         expressions = [expressions]
 
-    # TODO: Can we merge these three calls to something more efficient overall?
-    # Build scalar list-based graph representation
-    e2i, V, target_variables = build_scalar_graph(expressions)
-
-    # Compute sparse dependency matrix
-    dependencies = compute_dependencies(e2i, V)
+    # Build scalar list-based graph representation and sparse dependency matrix
+    e2i, V, target_variables, dependencies = build_scalar_graph(expressions)
 
     # Compute factorization of arguments
     argument_factorization, modified_arguments, V, target_variables, dependencies = \
@@ -97,45 +111,63 @@ def compute_expr_ir(expressions, parameters):
     for i in range(len(modified_arguments)):
         modified_arguments[i] = analyse_modified_terminal(modified_arguments[i])
 
-    # --- Various dependency analysis ---
+    rank = max([len(k) for k in argument_factorization.keys()] + [0])
 
-    # Count the number of dependencies every subexpr has
-    depcount = compute_dependency_count(dependencies)
+    # Move the quadrature weight out of the monomial factors,
+    # to be folded into the tables of the first argument instead
+    weighted_argument = None
+    if parameters["fold_weights_into_tables"] and rank > 0:
+        folded = divide_monomials_by_factor(V, argument_factorization, QuadratureWeight)
+        if folded is not None:
+            e2i, V, target_variables, dependencies, argument_factorization = folded
+            weighted_argument = 0
 
-    # Build the 'inverse' of the sparse dependency matrix
-    inverse_dependencies = invert_dependencies(dependencies, depcount)
+    # --- Various dependency analysis ---
 
-    # Mark subexpressions of V that are actually needed for final result
-    active, num_active = mark_active(dependencies, target_variables)
+    # Mark active subexpressions and the outermost loop level each subexpression is invariant in
+    active, loop_levels = mark_loop_levels(V, target_variables, dependencies, rank)
+
+    if parameters["reduce_divisions"]:
+        # Replace divisions by loop invariant or shared denominators
+        # with multiplications by reciprocals computed once
+        e2i, V, target_variables, dependencies, index_map = \
+            reduce_divisions(V, target_variables, dependencies, active, loop_levels)
+        for mas in argument_factorization:
+            argument_factorization[mas] = index_map[argument_factorization[mas]]
+        active, loop_levels = mark_loop_levels(V, target_variables, dependencies, rank)
+
+    if parameters["hoist_loop_invariants"]:
+        # Rebalance product trees ((a*c)*(b*d) -> (a*b)*(c*d)) to make
+        # piecewise quantities 'float' out of the quadrature loop
+        e2i, V, target_variables, dependencies, index_map = \
+            rebalance_products(V, target_variables, dependencies, active, loop_levels)
+        for mas in argument_factorization:
+            argument_factorization[mas] = index_map[argument_factorization[mas]]
+        active, loop_levels = mark_loop_levels(V, target_variables, dependencies, rank)
+
+    if parameters["reassociate_chains"]:
+        # Reassociate long chains of sums and products ((((a+b)+c)+d) -> (a+c)+(b+d))
+        # into balanced trees, combining loop invariant terms first
+        e2i, V, target_variables, dependencies, index_map = \
+            reassociate_chains(V, target_variables, dependencies, active, loop_levels)
+        for mas in argument_factorization:
+            argument_factorization[mas] = index_map[argument_factorization[mas]]
+        active, loop_levels = mark_loop_levels(V, target_variables, dependencies, rank)
 
     # Build set of modified_terminal indices into factorized_vertices
     modified_terminal_indices = [i for i, v in enumerate(V)
                                  if is_modified_terminal(v)]
 
-    # Build piecewise/varying markers for factorized_vertices
-    spatially_dependent_terminal_indices = [i for i in modified_terminal_indices
-                                            if not is_cellwise_constant(V[i])]
-    varying, num_spatial = mark_image(inverse_dependencies,
-                                      spatially_dependent_terminal_indices)
-    piecewise = 1 - varying
-    # Skip non-active things
-    varying *= active
-    piecewise *= active
+    # Build piecewise/varying markers for factorized_vertices,
+    # non-active vertices are marked with level -1 and get neither
+    piecewise = 1 * (loop_levels == KERNEL_LEVEL)
+    varying = 1 * (loop_levels == QUADRATURE_LEVEL)
 
     # TODO: Skip literals in both varying and piecewise
     # nonliteral = ...
     # varying *= nonliteral
     # piecewise *= nonliteral
 
-    # TODO: Inspection of varying shows that factorization is
-    # needed for effective loop invariant code motion w.r.t. quadrature loop as well.
-    # Postphoning that until everything is working fine again.
-    # Core ingredients for such factorization would be:
-    # - Flatten products of products somehow
-    # - Sorting flattened product factors by loop dependency then by canonical ordering
-    # Or to keep binary products:
-    # - Rebalancing product trees ((a*c)*(b*d) -> (a*b)*(c*d)) to make piecewise quantities 'float' to the top of the list
-
     # rank = max(len(k) for k in argument_factorization.keys())
     # for i,a in enumerate(modified_arguments):
     #    iarg = a.number()
@@ -151,6 +183,7 @@ def compute_expr_ir(expressions, parameters):
     # Result of factorization:
     expr_ir["modified_arguments"] = modified_arguments         # (array) MA-index -> UFL expression of modified arguments
     expr_ir["argument_factorization"] = argument_factorization  # (dict) tuple(MA-indices) -> V-index of monomial factor
+    expr_ir["weighted_argument"] = weighted_argument  # (int) Number of argument with quadrature weights folded into its tables, or None
 
     # TODO: More structured MA organization?
     #modified_arguments[rank][block][entry] -> UFL expression of modified argument
@@ -169,6 +202,7 @@ def compute_expr_ir(expressions, parameters):
 
     # Metadata about each vertex
     #expr_ir["active"] = active       # (array) V-index -> bool
+    expr_ir["loop_levels"] = loop_levels  # (array) V-index -> outermost loop level the vertex is invariant in
     expr_ir["piecewise"] = piecewise  # (array) V-index -> bool
     expr_ir["varying"] = varying     # (array) V-index -> bool
 